@@ -0,0 +1,118 @@
+import gzip
+import heapq
+import json
+import os
+import zlib
+
+from itertools import groupby
+
+from django.conf import settings
+from django.utils.dateparse import parse_datetime
+
+# Archived reviews are kept in one gzip file of JSON Lines per user. Every
+# compaction appends a new gzip member, so files are never rewritten. The
+# reviews of a member are sorted by card, review date and id. A member left
+# cut short by a compaction that died while writing it is skipped by
+# readers and cut off before the next one is appended.
+
+CHUNK_SIZE = 16 * 1024
+
+
+def archive_path(user_id):
+    return os.path.join(settings.MEMORAY_REVIEW_ARCHIVE_DIR,
+                        'user-%d.jsonl.gz' % user_id)
+
+
+def has_archive(user_id):
+    # Nothing is archived where compact_reviews has no directory to use.
+    return (settings.MEMORAY_REVIEW_ARCHIVE_DIR is not None and
+            os.path.exists(archive_path(user_id)))
+
+
+def append_reviews(user_id, reviews):
+    # reviews are (id, card_id, review_date, answer_quality) tuples. The
+    # file is synced before returning, so the rows can then be deleted.
+    os.makedirs(settings.MEMORAY_REVIEW_ARCHIVE_DIR, exist_ok=True)
+    reviews = sorted(reviews, key=lambda review: (review[1], review[2],
+                                                   review[0]))
+    path = archive_path(user_id)
+    with open(path, 'r+b' if os.path.exists(path) else 'w+b') as archive:
+        # Anything after the last complete member is a cut short one.
+        _, end = member_offsets(archive)
+        archive.seek(end)
+        archive.truncate()
+        with gzip.GzipFile(fileobj=archive, mode='wb') as member:
+            for review_id, card_id, review_date, answer_quality in reviews:
+                member.write((json.dumps({
+                    "id": review_id,
+                    "card": card_id,
+                    "review_date": review_date.isoformat(),
+                    "answer_quality": answer_quality,
+                }) + '\n').encode('utf-8'))
+        archive.flush()
+        os.fsync(archive.fileno())
+
+
+def member_offsets(archive):
+    # Where each complete gzip member of archive starts, and where the last
+    # of them ends. Members record no length, so the file is decompressed
+    # once to find them.
+    offsets = []
+    end = position = 0
+    decompressor = None
+    archive.seek(0)
+    for chunk in iter(lambda: archive.read(CHUNK_SIZE), b''):
+        position += len(chunk)
+        while chunk:
+            if decompressor is None:
+                start = position - len(chunk)
+                decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            decompressor.decompress(chunk)
+            if not decompressor.eof:
+                break
+            chunk = decompressor.unused_data
+            offsets.append(start)
+            end = position - len(chunk)
+            decompressor = None
+    return offsets, end
+
+
+def member_reviews(archive, offset):
+    # Yields (card_id, review_date, id, answer_quality) for the reviews of
+    # the member at offset. archive is shared with the other members'
+    # readers, so every read seeks to where this one left off.
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    pending = b''
+    while not decompressor.eof:
+        archive.seek(offset)
+        chunk = archive.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        offset += len(chunk)
+        lines = (pending + decompressor.decompress(chunk)).split(b'\n')
+        pending = lines.pop()
+        for line in lines:
+            review = json.loads(line.decode('utf-8'))
+            yield (review['card'], parse_datetime(review['review_date']),
+                   review['id'], review['answer_quality'])
+
+
+def read_reviews(user_id):
+    # Yields (card_id, review_date, answer_quality) for the user's archived
+    # reviews in card and review date order. The members are merged as they
+    # are read, so only a chunk of each is held in memory. A compaction
+    # that died after archiving but before deleting rows archives them
+    # again on the next run, so duplicates are skipped by review id within
+    # each card.
+    if not has_archive(user_id):
+        return
+    with open(archive_path(user_id), 'rb') as archive:
+        reviews = heapq.merge(*[member_reviews(archive, offset)
+                                for offset in member_offsets(archive)[0]])
+        for card_id, card_reviews in groupby(reviews,
+                                             key=lambda review: review[0]):
+            seen = set()
+            for _, review_date, review_id, answer_quality in card_reviews:
+                if review_id not in seen:
+                    seen.add(review_id)
+                    yield card_id, review_date, answer_quality
@@ -0,0 +1,69 @@
+import copy
+
+from django.conf import settings
+from django.core.cache import caches
+
+from rest_framework_jwt.authentication import (
+    JSONWebTokenAuthentication, jwt_get_username_from_payload
+)
+
+from api.cache import LRUCache
+
+USER_CACHE_SETTINGS = {
+    'MAX_SIZE': 10000,
+    'TTL': 60,
+    'SHARED_CACHE': None,
+}
+USER_CACHE_SETTINGS.update(getattr(settings, 'MEMORAY_USER_CACHE', {}))
+
+user_cache = LRUCache(USER_CACHE_SETTINGS['MAX_SIZE'],
+                      USER_CACHE_SETTINGS['TTL'])
+
+
+def user_cache_key(username):
+    return 'memoray:user:%s' % username
+
+
+def shared_user_cache():
+    alias = USER_CACHE_SETTINGS['SHARED_CACHE']
+    return caches[alias] if alias else None
+
+
+def get_cached_user(username):
+    # With a shared cache the per-process cache is skipped: another worker
+    # can only invalidate a user in the shared one.
+    key = user_cache_key(username)
+    if shared_user_cache() is not None:
+        return shared_user_cache().get(key)
+    return user_cache.get(key)
+
+
+def cache_user(user):
+    key = user_cache_key(user.get_username())
+    if shared_user_cache() is not None:
+        shared_user_cache().set(key, user, USER_CACHE_SETTINGS['TTL'])
+    else:
+        user_cache.set(key, user)
+
+
+def invalidate_cached_user(username):
+    # Without a shared cache, other worker processes keep their copy until
+    # its TTL runs out.
+    key = user_cache_key(username)
+    user_cache.delete(key)
+    if shared_user_cache() is not None:
+        shared_user_cache().delete(key)
+
+
+class CachedJSONWebTokenAuthentication(JSONWebTokenAuthentication):
+    # Resolves the token's user from the shared cache if one is configured,
+    # or else the per-process cache, falling back to the database.
+    def authenticate_credentials(self, payload):
+        username = jwt_get_username_from_payload(payload)
+        user = get_cached_user(username) if username else None
+        if user is None:
+            user = super(CachedJSONWebTokenAuthentication,
+                         self).authenticate_credentials(payload)
+            cache_user(user)
+        # Views may modify request.user, so never hand out the cached object.
+        return copy.copy(user)
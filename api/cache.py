@@ -0,0 +1,63 @@
+from collections import OrderedDict
+import threading
+import time
+
+
+class LRUCache(object):
+    # Thread-safe, per-process least recently used cache whose entries also
+    # expire ttl seconds after they were stored. With max_bytes, the total
+    # sizeof() of the values is bounded as well as their number.
+    def __init__(self, max_size, ttl, max_bytes=None, sizeof=len):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.size = 0
+        self.hits = self.misses = self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, expires_at, size = entry
+            if expires_at <= time.monotonic():
+                self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        size = self.sizeof(value) if self.max_bytes is not None else 0
+        with self._lock:
+            self._remove(key)
+            if self.max_bytes is not None and size > self.max_bytes:
+                return
+            self._entries[key] = (value, time.monotonic() + self.ttl, size)
+            self.size += size
+            while ((self.max_size is not None and
+                    len(self._entries) > self.max_size) or
+                   (self.max_bytes is not None and
+                    self.size > self.max_bytes)):
+                _, (_, _, evicted_size) = self._entries.popitem(last=False)
+                self.size -= evicted_size
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry[2]
@@ -0,0 +1,99 @@
+from collections import OrderedDict
+
+from django.db import transaction
+from django.utils import timezone
+
+from api.models import Card, Deck, Tombstone, card_content_hash
+
+
+def survivor(cards):
+    # Of duplicate (id, times_reviewed, ...) cards the most reviewed one,
+    # or else the oldest, is kept.
+    return max(cards, key=lambda card: (card[1], -card[0]))
+
+
+def merge_decks(deck, other):
+    # Moves the cards of other into deck and deletes other. Of a card both
+    # decks have, the copy survivor() picks is kept in deck and the other
+    # one is deleted along with its reviews. Returns the number of cards
+    # moved and of duplicates deleted.
+    with transaction.atomic():
+        # Cards from before content hashes are hashed first, so that they
+        # are compared too.
+        collapsed, _ = collapse_duplicates(list(
+            Card.objects.select_for_update()
+            .filter(deck__in=[deck, other], content_hash__isnull=True)
+            .order_by('pk')
+            .values_list('id', 'deck_id', 'front', 'back', 'times_reviewed')))
+        in_both = (Card.objects.filter(deck__in=[deck, other])
+                   .filter(content_hash__in=deck.cards.values('content_hash'))
+                   .filter(content_hash__in=other.cards.values('content_hash'))
+                   .values_list('id', 'times_reviewed', 'deck_id',
+                                'content_hash'))
+        copies = {}
+        for card_id, times_reviewed, deck_id, content_hash in in_both:
+            copies.setdefault(content_hash, []).append(
+                (card_id, times_reviewed, deck_id))
+        replaced = []
+        staying = []
+        for pair in copies.values():
+            kept = survivor(pair)
+            for card in pair:
+                if card is not kept:
+                    (replaced if card[2] == deck.pk else staying).append(
+                        card[0])
+
+        # The copies in deck that lose make room for the ones moved in.
+        Tombstone.objects.bulk_create([
+            Tombstone(user_id=deck.user_id, model='card', object_id=card_id)
+            for card_id in replaced])
+        Card.objects.filter(pk__in=replaced).delete()
+        moved = other.cards.exclude(pk__in=staying).update(
+            deck=deck, updated_at=timezone.now())
+        Tombstone.objects.create(user_id=other.user_id, model='deck',
+                                 object_id=other.pk)
+        _, deleted = other.delete()
+    return moved, collapsed + len(replaced) + deleted.get(Card._meta.label, 0)
+
+
+def collapse_duplicates(cards):
+    # cards are (id, deck_id, front, back, times_reviewed) rows of cards
+    # without a content hash. Of every set of cards of a deck with the same
+    # content, the one survivor() picks is kept and given its hash; the
+    # others are deleted. Cards that already have a hash are looked up
+    # once. Returns the number of cards deleted and the ids of their users.
+    groups = OrderedDict()
+    for card_id, deck_id, front, back, times_reviewed in cards:
+        key = (deck_id, card_content_hash(front, back))
+        groups.setdefault(key, []).append((card_id, times_reviewed, False))
+    hashed = Card.objects.filter(
+        deck_id__in=set(deck_id for deck_id, _ in groups),
+        content_hash__in=set(content_hash for _, content_hash in groups))
+    for card_id, deck_id, content_hash, times_reviewed in hashed.values_list(
+            'id', 'deck_id', 'content_hash', 'times_reviewed'):
+        if (deck_id, content_hash) in groups:
+            groups[deck_id, content_hash].append(
+                (card_id, times_reviewed, True))
+
+    kept = []
+    deleted = {}
+    for (deck_id, content_hash), group in groups.items():
+        kept_card = survivor(group)
+        if not kept_card[2]:
+            kept.append(Card(pk=kept_card[0], content_hash=content_hash))
+        for card in group:
+            if card is not kept_card:
+                deleted[card[0]] = deck_id
+
+    # Deleted cards are gone before their content hash moves to a survivor.
+    owners = {}
+    if deleted:
+        owners = dict(Deck.objects.filter(pk__in=set(deleted.values()))
+                      .values_list('pk', 'user_id'))
+        Tombstone.objects.bulk_create([
+            Tombstone(user_id=owners[deck_id], model='card',
+                      object_id=card_id)
+            for card_id, deck_id in sorted(deleted.items())])
+        Card.objects.filter(pk__in=list(deleted)).delete()
+    Card.objects.update_columns(kept, ['content_hash'])
+    return len(deleted), set(owners.values())
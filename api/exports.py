@@ -0,0 +1,99 @@
+import csv
+import itertools
+import json
+
+from datetime import datetime
+
+from api import archive
+from api.models import Review
+
+CARD_FIELDS = ('id', 'front', 'back', 'creation_date', 'interval',
+               'easiness_factor', 'times_reviewed', 'last_review_date',
+               'next_due_at')
+REVIEW_FIELDS = ('review_date', 'answer_quality')
+
+
+class Echo(object):
+    # File-like object for csv.writer that hands each row back instead of
+    # buffering it, so rows can be yielded straight into the response.
+    def write(self, value):
+        return value
+
+
+def export_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def history_lookup(reviews):
+    # reviews are (card_id, review_date, answer_quality) rows in card id
+    # order. Returns a function giving a card's reviews, which has to be
+    # called with increasing card ids; only the current card's reviews are
+    # held in memory.
+    histories = itertools.groupby(reviews, key=lambda review: review[0])
+    card_id, history = next(histories, (None, ()))
+
+    def lookup(wanted_id):
+        nonlocal card_id, history
+        while card_id is not None and card_id < wanted_id:
+            card_id, history = next(histories, (None, ()))
+        if card_id != wanted_id:
+            return []
+        found = [dict(zip(REVIEW_FIELDS, map(export_value, review[1:])))
+                 for review in history]
+        card_id, history = next(histories, (None, ()))
+        return found
+    return lookup
+
+
+def card_histories(deck, include_reviews):
+    # Yields (card, reviews) pairs in card id order. Cards, reviews and
+    # archived reviews are each read as a stream in card id order and
+    # merged, so only the history of the current card is held in memory.
+    # Archived reviews come first in a card's history.
+    cards = (deck.cards.order_by('id')
+             .values_list(*CARD_FIELDS).iterator())
+    if include_reviews:
+        archived = history_lookup(archive.read_reviews(deck.user_id))
+        reviews = history_lookup(
+            Review.objects.filter(card__deck=deck)
+            .order_by('card_id', 'review_date', 'id')
+            .values_list('card_id', *REVIEW_FIELDS).iterator())
+
+    for card in cards:
+        card = dict(zip(CARD_FIELDS, map(export_value, card)))
+        if include_reviews:
+            yield card, archived(card['id']) + reviews(card['id'])
+        else:
+            yield card, []
+
+
+def export_jsonl(histories, include_reviews):
+    for card, reviews in histories:
+        if include_reviews:
+            card['reviews'] = reviews
+        yield json.dumps(card) + '\n'
+
+
+def export_csv(histories, include_reviews):
+    writer = csv.writer(Echo())
+    columns = CARD_FIELDS + REVIEW_FIELDS if include_reviews else CARD_FIELDS
+    yield writer.writerow(columns)
+    for card, reviews in histories:
+        row = [card[field] for field in CARD_FIELDS]
+        if not include_reviews:
+            yield writer.writerow(row)
+            continue
+        # One row per review, repeating the card columns; a card without
+        # reviews still gets a row with empty review columns.
+        for review in reviews or [dict.fromkeys(REVIEW_FIELDS)]:
+            yield writer.writerow(row + [review[field]
+                                         for field in REVIEW_FIELDS])
+
+
+def export_deck(deck, export_format, include_reviews):
+    histories = card_histories(deck, include_reviews)
+    if export_format == 'csv':
+        return export_csv(histories, include_reviews)
+    return export_jsonl(histories, include_reviews)
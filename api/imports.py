@@ -0,0 +1,134 @@
+import csv
+import json
+
+from django.db import transaction
+
+from rest_framework.exceptions import ValidationError
+from rest_framework.fields import empty
+
+from api.models import Card, card_content_hash
+from api.serializers import CardImportSerializer
+
+CSV_MEDIA_TYPES = ('text/csv',)
+JSONL_MEDIA_TYPES = ('application/jsonl', 'application/x-ndjson',
+                     'application/x-jsonlines')
+CHUNK_SIZE = 500
+INVALID_ENCODING = {"non_field_errors": ["Invalid UTF-8."]}
+
+
+class UnsupportedImportFormat(Exception):
+    pass
+
+
+class DecodedLines(object):
+    # Iterates over the lines of a binary stream as text. A line that is
+    # not valid UTF-8 is decoded with replacement characters, so readers
+    # keep counting lines, and its number is added to invalid.
+    def __init__(self, stream):
+        self.lines = iter(stream)
+        self.line_number = 0
+        self.invalid = set()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        line = next(self.lines)
+        self.line_number += 1
+        encoding = 'utf-8-sig' if self.line_number == 1 else 'utf-8'
+        try:
+            return line.decode(encoding)
+        except UnicodeDecodeError:
+            self.invalid.add(self.line_number)
+            return line.decode(encoding, 'replace')
+
+
+def read_rows(stream, media_type):
+    # Yields (row_number, data, error) for every row of the uploaded body
+    # without reading the whole body into memory; exactly one of data and
+    # error is set. Row numbers are line numbers in the uploaded file.
+    lines = DecodedLines(stream)
+    if media_type in CSV_MEDIA_TYPES:
+        reader = csv.DictReader(lines)
+        for row in reader:
+            # A row can span several lines, any of which may be invalid.
+            if lines.invalid:
+                lines.invalid.clear()
+                yield reader.line_num, None, INVALID_ENCODING
+                continue
+            yield reader.line_num, row, None
+    elif media_type in JSONL_MEDIA_TYPES:
+        for line_number, line in enumerate(lines, 1):
+            if line_number in lines.invalid:
+                yield line_number, None, INVALID_ENCODING
+                continue
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                yield line_number, None, {"non_field_errors": ["Invalid JSON."]}
+                continue
+            if not isinstance(row, dict):
+                yield line_number, None, {
+                    "non_field_errors": ["Expected a JSON object."]}
+                continue
+            yield line_number, row, None
+    else:
+        raise UnsupportedImportFormat(media_type)
+
+
+def validate_row(fields, data):
+    # Runs the serializer's fields directly; building a serializer per row
+    # deep-copies its fields and dominates the cost of large imports.
+    validated_data = {}
+    errors = {}
+    for name, field in fields.items():
+        try:
+            validated_data[name] = field.run_validation(data.get(name, empty))
+        except ValidationError as exc:
+            errors[name] = exc.detail
+    return validated_data, errors
+
+
+def import_cards(deck, rows, chunk_size=CHUNK_SIZE):
+    fields = CardImportSerializer().fields
+    created = valid = 0
+    errors = []
+    chunk = []
+    for row_number, data, error in rows:
+        if error is None:
+            validated_data, error = validate_row(fields, data)
+        if error:
+            errors.append({"row": row_number, "errors": error})
+        else:
+            chunk.append(Card(deck=deck, **validated_data))
+            valid += 1
+
+        if len(chunk) >= chunk_size:
+            created += create_chunk(deck, chunk)
+            chunk = []
+    created += create_chunk(deck, chunk)
+    return {"created": created, "duplicates": valid - created,
+            "errors": errors}
+
+
+def create_chunk(deck, cards):
+    # Rows repeating a card of the deck, or an earlier row, are skipped;
+    # the deck's cards are looked up once per chunk.
+    if not cards:
+        return 0
+    for card in cards:
+        card.content_hash = card_content_hash(card.front, card.back)
+    with transaction.atomic():
+        seen = set(Card.objects.filter(
+            deck=deck, content_hash__in=set(card.content_hash
+                                            for card in cards))
+            .values_list('content_hash', flat=True))
+        new_cards = []
+        for card in cards:
+            if card.content_hash not in seen:
+                seen.add(card.content_hash)
+                new_cards.append(card)
+        Card.objects.bulk_create(new_cards)
+    return len(new_cards)
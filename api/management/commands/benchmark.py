@@ -0,0 +1,169 @@
+import json
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from api.models import Card, Tombstone
+from api.versions import get_data_version
+
+# (name, method, path, query budget). Paths are formatted with the ids of
+# the benchmark user's objects; budgets cover the whole request, including
+# authentication, and must not grow with the amount of data. Users are
+# cached after their first authenticated request, which is users-list.
+ENDPOINTS = (
+    ('auth', 'post', '/memoray-auth/', 1),
+    ('users-list', 'get', '/users/', 3),
+    ('users-detail', 'get', '/users/{user}/', 2),
+    ('decks-list', 'get', '/decks/', 4),
+    ('decks-create', 'post', '/decks/', 6),
+    ('decks-detail', 'get', '/decks/{deck}/', 4),
+    ('decks-update', 'patch', '/decks/{deck}/', 5),
+    ('decks-cards', 'get', '/decks/{deck}/cards/', 5),
+    ('decks-import', 'post', '/decks/{deck}/import/', 7),
+    ('decks-export', 'get', '/decks/{deck}/export/?reviews=1', 3),
+    ('cards-list', 'get', '/cards/', 4),
+    ('cards-due', 'get', '/cards/due/', 3),
+    ('cards-session', 'get', '/cards/session/', 2),
+    ('cards-search', 'get', '/cards/?q=front%201', 4),
+    ('cards-create', 'post', '/cards/', 6),
+    ('cards-detail', 'get', '/cards/{card}/', 4),
+    ('cards-update', 'patch', '/cards/{card}/', 7),
+    ('reviews-list', 'get', '/reviews/', 4),
+    ('reviews-create', 'post', '/reviews/', 7),
+    ('reviews-bulk', 'post', '/reviews/bulk/', 6),
+    ('reviews-detail', 'get', '/reviews/{review}/', 4),
+    ('reviews-destroy', 'delete', '/reviews/{review}/', 12),
+    ('cards-destroy', 'delete', '/cards/{card}/', 10),
+    ('decks-destroy', 'delete', '/decks/{deck}/', 12),
+    ('sync', 'get', '/sync/', 4),
+    ('stats', 'get', '/stats/?days=365', 7),
+)
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+class Command(BaseCommand):
+    help = ("Drives every API endpoint in process and reports latency "
+            "percentiles and query counts. Fails if an endpoint runs more "
+            "queries than its budget.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--username', default='user0')
+        parser.add_argument('--password', default='password')
+        parser.add_argument('--iterations', type=int, default=20)
+
+    def handle(self, *args, **options):
+        self.client = Client()
+        self.options = options
+        try:
+            self.user = User.objects.get(username=options['username'])
+        except User.DoesNotExist:
+            raise CommandError('User "%s" does not exist; run generate_data '
+                               'first.' % options['username'])
+        # The first read of a user's data creates their data version.
+        get_data_version(self.user)
+        started = timezone.now()
+
+        self.results = dict((name, ([], [])) for name, _, _, _ in ENDPOINTS)
+        for _ in range(options['iterations']):
+            self.run_iteration()
+        # Leave no trace of the objects the benchmark created and deleted.
+        Tombstone.objects.filter(user=self.user,
+                                 deleted_at__gte=started).delete()
+
+        over_budget = []
+        self.stdout.write("%-16s %9s %9s %9s %9s %8s %7s" % (
+            "endpoint", "p50 ms", "p90 ms", "p99 ms", "max ms", "queries",
+            "budget"))
+        for name, _, _, budget in ENDPOINTS:
+            latencies, query_counts = self.results[name]
+            self.stdout.write("%-16s %9.1f %9.1f %9.1f %9.1f %8d %7d" % (
+                name, percentile(latencies, 0.5), percentile(latencies, 0.9),
+                percentile(latencies, 0.99), max(latencies),
+                max(query_counts), budget))
+            if max(query_counts) > budget:
+                over_budget.append("%s (%d > %d)" % (
+                    name, max(query_counts), budget))
+        if over_budget:
+            raise CommandError("Query budget exceeded: " +
+                               ", ".join(over_budget))
+
+    def run_iteration(self):
+        # Requests run in the order of ENDPOINTS. Every write works on a
+        # deck created in this iteration, and that deck is deleted at the
+        # end, so repeated runs see the same data.
+        response = self.request('auth', {
+            "username": self.options['username'],
+            "password": self.options['password']})
+        self.token = response['token']
+        ids = {"user": self.user.pk}
+        for name, method, path, _ in ENDPOINTS[1:]:
+            data = self.request_data(name, ids)
+            response = self.request(name, data, **ids)
+            if name == 'decks-create':
+                ids['deck'] = response['id']
+            elif name == 'cards-create':
+                ids['card'] = response['id']
+            elif name == 'reviews-create':
+                ids['review'] = response['id']
+
+    def request_data(self, name, ids):
+        if name == 'decks-create':
+            return {"name": "benchmark"}
+        if name == 'decks-update':
+            return {"name": "benchmark deck"}
+        if name == 'decks-import':
+            return "".join(["front,back\n"] + [
+                "front %d,back %d\n" % (number, number)
+                for number in range(100)])
+        if name == 'cards-create':
+            return {"front": "front", "back": "back", "deck": ids['deck']}
+        if name == 'cards-update':
+            return {"front": "new front"}
+        if name == 'reviews-create':
+            return {"card": ids['card'], "answer_quality": 4}
+        if name == 'reviews-bulk':
+            return [{"card": card_id, "answer_quality": 3} for card_id in
+                    Card.objects.filter(deck_id=ids['deck'])
+                    .values_list('pk', flat=True)[:50]]
+        return None
+
+    def request(self, name, data=None, **ids):
+        _, method, path, _ = next(endpoint for endpoint in ENDPOINTS
+                                  if endpoint[0] == name)
+        kwargs = {}
+        if name != 'auth':
+            kwargs['HTTP_AUTHORIZATION'] = 'JWT ' + self.token
+        if name == 'decks-import':
+            kwargs['content_type'] = 'text/csv'
+        elif data is not None:
+            data = json.dumps(data)
+            kwargs['content_type'] = 'application/json'
+
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            response = getattr(self.client, method)(
+                path.format(**ids), data, **kwargs)
+            if response.streaming:
+                content = b''.join(response.streaming_content)
+            else:
+                content = response.content
+            elapsed = time.perf_counter() - started
+        if response.status_code >= 400:
+            raise CommandError("%s returned %d: %s" % (
+                name, response.status_code, content[:200]))
+
+        latencies, query_counts = self.results[name]
+        latencies.append(elapsed * 1000)
+        query_counts.append(len(queries))
+        if response.get('Content-Type', '').startswith('application/json'):
+            return json.loads(content.decode('utf-8'))
+        return None
@@ -0,0 +1,50 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.models import Card, Deck
+from api.serializers import CardSerializer, DeckSerializer
+
+
+class Command(BaseCommand):
+    help = ("Compares rendering cards and decks through ModelSerializer with "
+            "the values() fast path used by list endpoints.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10000,
+                            help="Number of cards and of decks rendered.")
+        parser.add_argument('--repeat', type=int, default=3,
+                            help="Runs per path; the fastest one is "
+                                 "reported.")
+
+    def handle(self, *args, **options):
+        self.stdout.write("%-6s %6s %14s %14s %8s" % (
+            "model", "rows", "instances/s", "values/s", "speedup"))
+        for name, queryset, serializer_class in [
+                ('cards', Card.objects.order_by('pk'), CardSerializer),
+                ('decks', Deck.objects.with_card_counts().order_by('pk'),
+                 DeckSerializer)]:
+            queryset = queryset[:options['rows']]
+            instances, slow = self.best_of(options['repeat'], lambda: (
+                serializer_class(queryset.all(), many=True).data))
+            serializer = serializer_class()
+            rows, fast = self.best_of(options['repeat'], lambda: (
+                serializer.values_representation(
+                    queryset.values(*serializer.values_columns()))))
+            if [dict(row) for row in instances] != [dict(row) for row in rows]:
+                raise CommandError("The fast path renders %s differently." %
+                                   name)
+            count = max(len(rows), 1)
+            self.stdout.write("%-6s %6d %14.0f %14.0f %7.1fx" % (
+                name, len(rows), count / slow, count / fast, slow / fast))
+
+    def best_of(self, repeat, render):
+        # Timings include running the query, as a list request does, so
+        # render must not reuse an evaluated queryset.
+        best = None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            result = render()
+            elapsed = max(time.perf_counter() - started, 1e-9)
+            best = elapsed if best is None else min(best, elapsed)
+        return result, best
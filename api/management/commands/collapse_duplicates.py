@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.duplicates import collapse_duplicates
+from api.models import Card
+from api.versions import data_changed
+
+
+class Command(BaseCommand):
+    help = ("Gives cards created before content hashes existed their hash, "
+            "deleting the duplicates among them.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500,
+                            help="Number of cards processed per transaction.")
+
+    def handle(self, *args, **options):
+        last_id = 0
+        total_cards = total_deleted = 0
+        while True:
+            with transaction.atomic():
+                cards = list(Card.objects.select_for_update()
+                             .filter(content_hash__isnull=True, pk__gt=last_id)
+                             .order_by('pk')
+                             .values_list('id', 'deck_id', 'front', 'back',
+                                          'times_reviewed')
+                             [:options['chunk_size']])
+                if not cards:
+                    break
+                deleted, user_ids = collapse_duplicates(cards)
+            # Deleted cards disappear from every list of their users.
+            for user_id in user_ids:
+                data_changed(user_id)
+            total_cards += len(cards)
+            total_deleted += deleted
+            last_id = cards[-1][0]
+        self.stdout.write("Checked %d cards, deleted %d duplicates." % (
+            total_cards, total_deleted))
@@ -0,0 +1,96 @@
+from datetime import timedelta
+from itertools import groupby
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from api import archive
+from api.models import Card, Review, ReviewSummary
+from api.scheduler import INITIAL_EASINESS_FACTOR
+from api.versions import data_changed
+
+
+class Command(BaseCommand):
+    help = ("Moves old reviews to the review archive and rolls them up into "
+            "per-card review summaries.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than', type=int, default=180,
+                            help="Compact reviews older than this many days.")
+        parser.add_argument('--chunk-size', type=int, default=500,
+                            help="Number of cards compacted per transaction.")
+
+    def handle(self, *args, **options):
+        if settings.MEMORAY_REVIEW_ARCHIVE_DIR is None:
+            raise CommandError(
+                "MEMORAY_REVIEW_ARCHIVE_DIR is not set. Compacted reviews "
+                "are deleted from the database, so set it to a directory "
+                "on persistent storage.")
+        cutoff = timezone.now() - timedelta(days=options['older_than'])
+        last_id = 0
+        total_cards = total_reviews = 0
+        while True:
+            card_ids = list(Review.objects
+                            .filter(review_date__lt=cutoff, card_id__gt=last_id)
+                            .order_by('card_id')
+                            .values_list('card_id', flat=True)
+                            .distinct()[:options['chunk_size']])
+            if not card_ids:
+                break
+            with transaction.atomic():
+                reviews, user_ids = self.compact(card_ids, cutoff)
+            # Compacted reviews disappear from the reviews endpoint.
+            for user_id in user_ids:
+                data_changed(user_id)
+            total_reviews += reviews
+            last_id = card_ids[-1]
+            total_cards += len(card_ids)
+        self.stdout.write("Compacted %d reviews of %d cards." % (
+            total_reviews, total_cards))
+
+    def compact(self, card_ids, cutoff):
+        # Locking the cards keeps new reviews of them, which lock the card
+        # too, and rebuild_schedules out until the chunk is committed.
+        list(Card.objects.select_for_update().filter(pk__in=card_ids)
+             .order_by('pk').values_list('pk'))
+        reviews = Review.objects.filter(card_id__in=card_ids,
+                                        review_date__lt=cutoff)
+        rows = list(reviews.order_by('card_id', 'review_date', 'id')
+                    .values_list('id', 'card_id', 'card__deck__user_id',
+                                 'review_date', 'answer_quality'))
+        summaries = {summary.card_id: summary for summary in
+                     ReviewSummary.objects.filter(card_id__in=card_ids)}
+
+        for card_id, card_rows in groupby(rows, key=lambda row: row[1]):
+            summary = summaries.setdefault(card_id, ReviewSummary(
+                card_id=card_id, interval=0,
+                easiness_factor=INITIAL_EASINESS_FACTOR, times_reviewed=0))
+            # Replays on a throwaway card so that the summary holds exactly
+            # the state Card.review reaches after these reviews.
+            card = Card(interval=summary.interval,
+                        easiness_factor=summary.easiness_factor,
+                        times_reviewed=summary.times_reviewed)
+            for _, _, _, review_date, answer_quality in card_rows:
+                card.review(answer_quality, review_date)
+                field = 'answer_quality_%d' % answer_quality
+                if hasattr(summary, field):
+                    setattr(summary, field, getattr(summary, field) + 1)
+            summary.interval = card.interval
+            summary.easiness_factor = card.easiness_factor
+            summary.times_reviewed = card.times_reviewed
+            summary.last_review_date = card.last_review_date
+
+        # Rows are archived, and the archive synced, before they are deleted.
+        rows.sort(key=lambda row: (row[2], row[0]))
+        for user_id, user_rows in groupby(rows, key=lambda row: row[2]):
+            archive.append_reviews(user_id, [
+                (review_id, card_id, review_date, answer_quality)
+                for review_id, card_id, _, review_date, answer_quality
+                in user_rows
+            ])
+        reviews.delete()
+        ReviewSummary.objects.filter(card_id__in=card_ids).delete()
+        ReviewSummary.objects.bulk_create(summaries.values())
+        return len(rows), set(row[2] for row in rows)
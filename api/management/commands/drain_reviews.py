@@ -0,0 +1,38 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.models import PendingReview, apply_pending_reviews
+from api.versions import data_changed
+
+
+class Command(BaseCommand):
+    help = ("Applies reviews queued in the outbox while "
+            "MEMORAY_REVIEW_OUTBOX is on.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help="Number of reviews whose cards are applied "
+                                 "per transaction.")
+        parser.add_argument('--interval', type=float, default=1.0,
+                            help="Seconds to wait when the outbox is empty.")
+        parser.add_argument('--once', action='store_true',
+                            help="Exit once the outbox is empty instead of "
+                                 "waiting for more reviews.")
+
+    def handle(self, *args, **options):
+        applied = 0
+        while True:
+            pending = apply_pending_reviews(PendingReview.objects.all(),
+                                            limit=options['batch_size'],
+                                            skip_locked=True)
+            applied += len(pending)
+            if pending:
+                for user_id in set(review.user_id for review in pending):
+                    data_changed(user_id)
+                self.stderr.write("Applied %d reviews." % len(pending))
+                continue
+            if options['once']:
+                break
+            time.sleep(options['interval'])
+        self.stdout.write("Applied %d reviews." % applied)
@@ -0,0 +1,142 @@
+from datetime import timedelta
+import random
+import time
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Case, DateTimeField, Value, When
+from django.utils import timezone
+
+from api.models import Card, Deck, Review, card_content_hash
+
+# Answer qualities are drawn from this list, so most reviews are passing
+# grades and a few are blackouts.
+ANSWER_QUALITIES = (0, 1, 2, 3, 3, 4, 4, 4, 5, 5)
+
+
+class Command(BaseCommand):
+    help = ("Fills the database with synthetic users, decks, cards and "
+            "review histories for benchmarking.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--decks-per-user', type=int, default=3)
+        parser.add_argument('--cards-per-deck', type=int, default=50)
+        parser.add_argument('--reviews-per-card', type=int, default=10,
+                            help="Average number of reviews per card; "
+                                 "histories are also cut off at the present.")
+        parser.add_argument('--history-days', type=int, default=365,
+                            help="Decks are created up to this many days "
+                                 "ago.")
+        parser.add_argument('--prefix', default='user',
+                            help="Usernames are the prefix followed by a "
+                                 "number.")
+        parser.add_argument('--first', type=int, default=0,
+                            help="Number of the first generated user.")
+        parser.add_argument('--password', default='password',
+                            help="Password shared by every generated user.")
+        parser.add_argument('--seed', type=int, default=None)
+        parser.add_argument('--chunk-size', type=int, default=100,
+                            help="Number of users generated per "
+                                 "transaction.")
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.random = random.Random(options['seed'])
+        self.now = timezone.now()
+        # Hashing is deliberately slow, so every user shares one hash.
+        self.password = make_password(options['password'])
+        first = options['first']
+
+        started = time.time()
+        totals = [0, 0, 0, 0]
+        for start in range(first, first + options['users'],
+                           options['chunk_size']):
+            stop = min(start + options['chunk_size'], first + options['users'])
+            with transaction.atomic():
+                counts = self.generate(range(start, stop))
+            totals = [total + count for total, count in zip(totals, counts)]
+            self.stderr.write("%d users, %d decks, %d cards, %d reviews, "
+                              "%.0fs" % tuple(totals + [time.time() - started]))
+        self.stdout.write("Created %d users, %d decks, %d cards and %d "
+                          "reviews." % tuple(totals))
+
+    def generate(self, numbers):
+        # Django fills in primary keys after bulk_create only on PostgreSQL,
+        # so each level is read back in insertion order to link its children.
+        usernames = [self.options['prefix'] + str(number) for number in numbers]
+        if User.objects.filter(username__in=usernames).exists():
+            raise CommandError("Some of the users %s to %s already exist; "
+                               "choose another --prefix or --first." % (
+                                   usernames[0], usernames[-1]))
+        User.objects.bulk_create([
+            User(username=username, password=self.password)
+            for username in usernames
+        ])
+        user_ids = list(User.objects.filter(username__in=usernames)
+                        .order_by('pk').values_list('pk', flat=True))
+
+        Deck.objects.bulk_create([
+            Deck(user_id=user_id, name="Deck %d" % number)
+            for user_id in user_ids
+            for number in range(self.options['decks_per_user'])
+        ])
+        deck_ids = list(Deck.objects.filter(user_id__in=user_ids)
+                        .order_by('pk').values_list('pk', flat=True))
+
+        created = {}
+        cards = []
+        histories = []
+        for deck_id in deck_ids:
+            created[deck_id] = self.now - timedelta(
+                days=self.random.uniform(0, self.options['history_days']))
+            for number in range(self.options['cards_per_deck']):
+                front, back = "Front %d" % number, "Back %d" % number
+                card = Card(deck_id=deck_id, front=front, back=back,
+                            content_hash=card_content_hash(front, back),
+                            next_due_at=created[deck_id])
+                histories.append(self.review_history(card, created[deck_id]))
+                cards.append(card)
+        Card.objects.bulk_create(cards)
+        self.backdate_cards(created)
+        card_ids = (Card.objects.filter(deck_id__in=deck_ids)
+                    .order_by('pk').values_list('pk', flat=True))
+
+        reviews = [
+            Review(card_id=card_id, answer_quality=answer_quality,
+                   review_date=review_date)
+            for card_id, history in zip(card_ids, histories)
+            for answer_quality, review_date in history
+        ]
+        Review.objects.bulk_create(reviews)
+        return len(user_ids), len(deck_ids), len(cards), len(reviews)
+
+    def review_history(self, card, created):
+        # Reviews the card in memory on (roughly) its due dates, so the
+        # stored scheduling state matches what its history replays to.
+        history = []
+        limit = self.random.randint(0, 2 * self.options['reviews_per_card'])
+        review_date = created + timedelta(hours=self.random.uniform(0, 48))
+        while len(history) < limit and review_date < self.now:
+            answer_quality = self.random.choice(ANSWER_QUALITIES)
+            card.review(answer_quality, review_date)
+            history.append((answer_quality, review_date))
+            review_date = card.next_due_at + timedelta(
+                hours=self.random.uniform(0, 72))
+        return history
+
+    def backdate_cards(self, created):
+        # creation_date is auto_now_add, so it can only be set after insert.
+        field = Card._meta.get_field('creation_date')
+        deck_ids = list(created)
+        batch_size = connection.ops.bulk_batch_size(
+            ['pk', field, field], deck_ids) or 1
+        for start in range(0, len(deck_ids), batch_size):
+            batch = deck_ids[start:start + batch_size]
+            Card.objects.filter(deck_id__in=batch).update(creation_date=Case(
+                *[When(deck_id=deck_id,
+                       then=Value(created[deck_id], output_field=field))
+                  for deck_id in batch],
+                output_field=DateTimeField()))
@@ -0,0 +1,106 @@
+import os
+import resource
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.models import Card, Deck, replay_reviews, scheduling_state
+from api.versions import data_changed
+
+
+class Command(BaseCommand):
+    help = "Rebuilds every card's scheduling state from its review history."
+
+    progress_interval = 5
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500,
+                            help="Number of cards rebuilt per transaction.")
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Print the cards whose state would change "
+                                 "without writing anything.")
+        parser.add_argument('--checkpoint',
+                            help="File recording the last rebuilt card. If "
+                                 "it exists the run resumes after that card; "
+                                 "it is removed once every card is rebuilt.")
+
+    def handle(self, *args, **options):
+        self.dry_run = options['dry_run']
+        checkpoint = None if self.dry_run else options['checkpoint']
+        last_id = self.read_checkpoint(checkpoint)
+
+        self.started = self.reported = time.time()
+        self.total_cards = self.total_reviews = self.total_changed = 0
+        while True:
+            with transaction.atomic():
+                cards = Card.objects.filter(pk__gt=last_id).order_by('pk')
+                if not self.dry_run:
+                    cards = cards.select_for_update()
+                cards = list(cards[:options['chunk_size']])
+                if not cards:
+                    break
+
+                changed = self.rebuild(cards)
+                if self.dry_run:
+                    for card, old_state in changed:
+                        self.stdout.write(self.describe_change(card, old_state))
+                else:
+                    Card.objects.update_scheduling(
+                        [card for card, _ in changed])
+
+            if changed and not self.dry_run:
+                user_ids = (Deck.objects
+                            .filter(cards__in=[card.pk for card, _ in changed])
+                            .values_list('user_id', flat=True).distinct())
+                for user_id in user_ids:
+                    data_changed(user_id)
+            last_id = cards[-1].pk
+            self.total_cards += len(cards)
+            self.total_changed += len(changed)
+            if checkpoint:
+                self.write_checkpoint(checkpoint, last_id)
+            if time.time() - self.reported >= self.progress_interval:
+                self.report_progress()
+
+        if checkpoint and os.path.exists(checkpoint):
+            os.remove(checkpoint)
+        self.report_progress()
+        self.stdout.write("%s %d of %d cards from %d reviews." % (
+            "Would change" if self.dry_run else "Changed",
+            self.total_changed, self.total_cards, self.total_reviews))
+
+    def rebuild(self, cards):
+        changed, reviews = replay_reviews(cards)
+        self.total_reviews += reviews
+        return changed
+
+    def describe_change(self, card, old_state):
+        changes = [
+            "%s %s -> %s" % (field, old, new)
+            for field, old, new in zip(Card.SCHEDULING_FIELDS, old_state,
+                                       scheduling_state(card))
+            if old != new
+        ]
+        return "card %d: %s" % (card.pk, ", ".join(changes))
+
+    def report_progress(self):
+        self.reported = time.time()
+        elapsed = max(self.reported - self.started, 1e-6)
+        # ru_maxrss is reported in kilobytes on Linux.
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+        self.stderr.write(
+            "%d cards, %d reviews, %.0f rows/s, peak RSS %.1f MB" % (
+                self.total_cards, self.total_reviews,
+                (self.total_cards + self.total_reviews) / elapsed, peak_rss))
+
+    def read_checkpoint(self, checkpoint):
+        if checkpoint and os.path.exists(checkpoint):
+            with open(checkpoint) as checkpoint_file:
+                return int(checkpoint_file.read())
+        return 0
+
+    def write_checkpoint(self, checkpoint, last_id):
+        with open(checkpoint + '.tmp', 'w') as checkpoint_file:
+            checkpoint_file.write(str(last_id))
+        os.replace(checkpoint + '.tmp', checkpoint)
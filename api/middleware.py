@@ -0,0 +1,92 @@
+from collections import Counter
+import json
+import logging
+import re
+import time
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+
+from api.response_cache import response_cache_counters
+
+logger = logging.getLogger('api.instrumentation')
+
+SQL_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+SQL_IN_LISTS = re.compile(r"\bIN \((?:\?, )*\?\)")
+
+
+def query_shape(sql):
+    sql = SQL_LITERALS.sub('?', sql)
+    return SQL_IN_LISTS.sub('IN (...)', sql)
+
+
+def repeated_queries(queries, threshold):
+    shapes = Counter(query_shape(query['sql']) for query in queries)
+    return [{"sql": shape, "count": count}
+            for shape, count in shapes.most_common() if count > threshold]
+
+
+class InstrumentationMiddleware(object):
+    # Opt-in with MEMORAY_INSTRUMENTATION; when it is off the middleware
+    # removes itself at startup and costs nothing per request.
+    def __init__(self, get_response):
+        if not getattr(settings, 'MEMORAY_INSTRUMENTATION', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.n_plus_one_threshold = getattr(
+            settings, 'MEMORAY_N_PLUS_ONE_THRESHOLD', 10)
+
+    def __call__(self, request):
+        started = time.perf_counter()
+        request.instrumentation = {'view_started': None, 'render_started': None}
+        force_debug_cursor = connection.force_debug_cursor
+        connection.force_debug_cursor = True
+        try:
+            response = self.get_response(request)
+        finally:
+            connection.force_debug_cursor = force_debug_cursor
+        finished = time.perf_counter()
+
+        queries = list(connection.queries_log)
+        timings = {
+            "total": finished - started,
+            "db": sum(float(query['time']) for query in queries),
+        }
+        view_started = request.instrumentation['view_started']
+        render_started = request.instrumentation['render_started']
+        if view_started is not None:
+            timings["view"] = (render_started or finished) - view_started
+        if render_started is not None:
+            timings["render"] = finished - render_started
+
+        response['Server-Timing'] = ', '.join(
+            '%s;dur=%.1f' % (name, seconds * 1000)
+            + (';desc="%d queries"' % len(queries) if name == 'db' else '')
+            for name, seconds in sorted(timings.items()))
+
+        repeated = repeated_queries(queries, self.n_plus_one_threshold)
+        record = {
+            "method": request.method,
+            "path": request.path,
+            "status": response.status_code,
+            "queries": len(queries),
+            "repeated_queries": repeated,
+            "response_cache": response_cache_counters(),
+        }
+        for name, seconds in timings.items():
+            record[name + "_ms"] = round(seconds * 1000, 1)
+        if repeated:
+            logger.warning(json.dumps(record, sort_keys=True))
+        else:
+            logger.info(json.dumps(record, sort_keys=True))
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.instrumentation['view_started'] = time.perf_counter()
+
+    def process_template_response(self, request, response):
+        # DRF responses are rendered after this hook returns, so everything
+        # from here to the end of the request is serialization.
+        request.instrumentation['render_started'] = time.perf_counter()
+        return response
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.6 on 2026-10-17 02:59
+from __future__ import unicode_literals
+
+from datetime import timedelta
+
+from django.db import migrations
+from django.db.models import Count, Max
+
+
+def backfill_scheduling_state(apps, schema_editor):
+    Card = apps.get_model('api', 'Card')
+    cards = Card.objects.annotate(
+        review_count=Count('reviews'),
+        latest_review_date=Max('reviews__review_date'))
+
+    for card in cards.iterator():
+        card.times_reviewed = card.review_count
+        card.last_review_date = card.latest_review_date
+        if card.last_review_date is None:
+            card.next_due_at = card.creation_date
+        else:
+            card.next_due_at = (card.last_review_date +
+                                timedelta(days=card.interval))
+        card.save(update_fields=[
+            'times_reviewed', 'last_review_date', 'next_due_at'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0016_card_scheduling_state'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_scheduling_state,
+                             migrations.RunPython.noop),
+    ]
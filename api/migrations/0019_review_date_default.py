@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.6 on 2026-10-17 03:01
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0018_card_due_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='review',
+            name='review_date',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.6 on 2026-10-17 03:07
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0020_review_date_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='card',
+            name='deck',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='cards', to='api.Deck'),
+        ),
+        migrations.AlterField(
+            model_name='review',
+            name='card',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='reviews', to='api.Card'),
+        ),
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['card', '-review_date'], name='api_review_card_date_idx'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.6 on 2026-10-17 03:15
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('api', '0022_sync_tracking'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PendingReview',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('answer_quality', models.IntegerField()),
+                ('review_date', models.DateTimeField(default=django.utils.timezone.now)),
+                ('card', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='pending_reviews', to='api.Card')),
+                ('user', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='pending_reviews', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='pendingreview',
+            index=models.Index(fields=['user', 'id'], name='api_pendingreview_user_idx'),
+        ),
+    ]
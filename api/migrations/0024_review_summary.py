@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.6 on 2026-10-17 03:18
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0023_review_outbox'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReviewSummary',
+            fields=[
+                ('card', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='review_summary', serialize=False, to='api.Card')),
+                ('interval', models.IntegerField()),
+                ('easiness_factor', models.FloatField()),
+                ('times_reviewed', models.IntegerField()),
+                ('last_review_date', models.DateTimeField()),
+                ('answer_quality_0', models.IntegerField(default=0)),
+                ('answer_quality_1', models.IntegerField(default=0)),
+                ('answer_quality_2', models.IntegerField(default=0)),
+                ('answer_quality_3', models.IntegerField(default=0)),
+                ('answer_quality_4', models.IntegerField(default=0)),
+                ('answer_quality_5', models.IntegerField(default=0)),
+            ],
+        ),
+    ]
@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.6 on 2026-10-17 03:44
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0025_data_version'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='card',
+            index=models.Index(fields=['deck', 'next_due_at', 'times_reviewed', 'interval'], name='api_card_deck_due_sched_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='card',
+            index=models.Index(fields=['deck', 'times_reviewed', 'next_due_at'], name='api_card_deck_new_idx'),
+        ),
+        migrations.RemoveIndex(
+            model_name='card',
+            name='api_card_deck_due_idx',
+        ),
+    ]
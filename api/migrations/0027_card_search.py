@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+# SQLite keeps an external content FTS5 table in step with api_card through
+# triggers. Django rebuilds SQLite tables for most schema changes, which
+# drops their triggers, so later migrations of Card run
+# SQLITE_CREATE_TRIGGERS again.
+SQLITE_CREATE_TABLE = [
+    "CREATE VIRTUAL TABLE api_card_fts USING fts5("
+    "front, back, content='api_card', content_rowid='id')",
+    "INSERT INTO api_card_fts(api_card_fts) VALUES ('rebuild')",
+]
+SQLITE_CREATE_TRIGGERS = [
+    "CREATE TRIGGER api_card_fts_insert AFTER INSERT ON api_card BEGIN "
+    "INSERT INTO api_card_fts(rowid, front, back) "
+    "VALUES (new.id, new.front, new.back); END",
+    "CREATE TRIGGER api_card_fts_delete AFTER DELETE ON api_card BEGIN "
+    "INSERT INTO api_card_fts(api_card_fts, rowid, front, back) "
+    "VALUES ('delete', old.id, old.front, old.back); END",
+    "CREATE TRIGGER api_card_fts_update AFTER UPDATE OF front, back "
+    "ON api_card BEGIN "
+    "INSERT INTO api_card_fts(api_card_fts, rowid, front, back) "
+    "VALUES ('delete', old.id, old.front, old.back); "
+    "INSERT INTO api_card_fts(rowid, front, back) "
+    "VALUES (new.id, new.front, new.back); END",
+]
+SQLITE_DROP = [
+    "DROP TRIGGER IF EXISTS api_card_fts_insert",
+    "DROP TRIGGER IF EXISTS api_card_fts_delete",
+    "DROP TRIGGER IF EXISTS api_card_fts_update",
+    "DROP TABLE IF EXISTS api_card_fts",
+]
+
+# The expression must match api.search.POSTGRESQL_VECTOR for the planner
+# to use the index.
+POSTGRESQL_CREATE = [
+    "CREATE INDEX api_card_search_idx ON api_card USING GIN "
+    "(to_tsvector('simple', front || ' ' || back))",
+]
+POSTGRESQL_DROP = [
+    "DROP INDEX IF EXISTS api_card_search_idx",
+]
+
+
+def run(schema_editor, statements):
+    for statement in statements.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(statement)
+
+
+def create_search_index(apps, schema_editor):
+    run(schema_editor, {
+        'sqlite': SQLITE_CREATE_TABLE + SQLITE_CREATE_TRIGGERS,
+        'postgresql': POSTGRESQL_CREATE,
+    })
+
+
+def drop_search_index(apps, schema_editor):
+    run(schema_editor, {
+        'sqlite': SQLITE_DROP,
+        'postgresql': POSTGRESQL_DROP,
+    })
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0026_study_session_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.6 on 2026-10-17 03:50
+from __future__ import unicode_literals
+
+from importlib import import_module
+
+from django.db import migrations, models
+
+card_search = import_module('api.migrations.0027_card_search')
+
+
+def recreate_search_triggers(apps, schema_editor):
+    # SQLite rebuilds api_card for the schema changes, in either
+    # direction, which drops the triggers that keep api_card_fts up to
+    # date.
+    if schema_editor.connection.vendor == 'sqlite':
+        for statement in card_search.SQLITE_CREATE_TRIGGERS:
+            schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0027_card_search'),
+    ]
+
+    operations = [
+        migrations.RunPython(migrations.RunPython.noop,
+                             recreate_search_triggers),
+        migrations.AddField(
+            model_name='card',
+            name='content_hash',
+            field=models.CharField(editable=False, max_length=40, null=True),
+        ),
+        migrations.AlterUniqueTogether(
+            name='card',
+            unique_together=set([('deck', 'content_hash')]),
+        ),
+        migrations.RunPython(recreate_search_triggers,
+                             migrations.RunPython.noop),
+    ]
@@ -1,53 +1,136 @@
-from django.db import models
+from django.db import connection, connections, models, transaction
+from django.db.models import Case, Count, IntegerField, Sum, Value, When
 from django.utils import timezone
 from django.contrib.auth.models import User
-from datetime import timedelta
+import hashlib
+import unicodedata
+
+import numpy as np
+
+from api import scheduler
+
+
+class DeckQuerySet(models.QuerySet):
+    def with_card_counts(self):
+        now = timezone.now()
+        return self.annotate(
+            card_count=Count('cards'),
+            due_count=Sum(Case(When(cards__next_due_at__lte=now, then=1),
+                               default=0, output_field=IntegerField())),
+            new_count=Sum(Case(When(cards__times_reviewed=0, then=1),
+                               default=0, output_field=IntegerField())))
 
 
 class Deck(models.Model):
     user = models.ForeignKey(User, related_name="decks",
-                             on_delete=models.CASCADE)
+                             on_delete=models.CASCADE, db_index=False)
     name = models.CharField(max_length=40)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = DeckQuerySet.as_manager()
+
+    class Meta:
+        # Leads with user, see Card.Meta.
+        indexes = [
+            models.Index(fields=['user', 'updated_at'],
+                         name='api_deck_user_updated_idx'),
+        ]
+
+
+class CardQuerySet(models.QuerySet):
+    def lock_owned(self, user, ids):
+        # Ownership is checked with a subquery rather than a join so that
+        # FOR UPDATE locks only the card rows, and rows are locked in primary
+        # key order so that concurrent batches cannot deadlock.
+        cards = self.select_for_update().filter(
+            deck__in=Deck.objects.filter(user=user),
+            pk__in=ids).order_by('pk')
+        return {card.pk: card for card in cards}
+
+    def update_scheduling(self, cards):
+        return self.update_columns(cards, Card.SCHEDULING_FIELDS,
+                                   updated_at=timezone.now())
+
+    def update_columns(self, cards, names, **values):
+        # One UPDATE ... SET col = CASE id WHEN ... per batch instead of a
+        # save() per card; batches respect the backend's parameter limit.
+        fields = [Card._meta.get_field(name) for name in names]
+        batch_size = connections[self.db].ops.bulk_batch_size(
+            ['pk'] + fields * 2, cards) or 1
+        updated = 0
+        for start in range(0, len(cards), batch_size):
+            batch = cards[start:start + batch_size]
+            updates = dict(values)
+            for field in fields:
+                whens = [
+                    When(pk=card.pk, then=Value(getattr(card, field.attname),
+                                                output_field=field))
+                    for card in batch
+                ]
+                updates[field.attname] = Case(*whens, output_field=field)
+            updated += self.filter(
+                pk__in=[card.pk for card in batch]).update(**updates)
+        return updated
+
+
+def card_content_hash(front, back):
+    # Cards are duplicates when their front and back are equal up to case,
+    # Unicode normalization and whitespace.
+    def normalize(text):
+        text = unicodedata.normalize('NFKC', text).casefold()
+        return ' '.join(text.split())
+    content = '%s\x00%s' % (normalize(front), normalize(back))
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
 
 
 class Card(models.Model):
+    SCHEDULING_FIELDS = ('interval', 'easiness_factor', 'times_reviewed',
+                         'last_review_date', 'next_due_at')
+
     deck = models.ForeignKey(Deck, related_name="cards",
-                             on_delete=models.CASCADE)
+                             on_delete=models.CASCADE, db_index=False)
     front = models.CharField(max_length=200)
     back = models.CharField(max_length=200)
     creation_date = models.DateTimeField(auto_now_add=True)
     interval = models.IntegerField(default=0)
     easiness_factor = models.FloatField(default=2.5)
+    times_reviewed = models.IntegerField(default=0)
+    last_review_date = models.DateTimeField(null=True, blank=True)
+    next_due_at = models.DateTimeField(default=timezone.now)
+    updated_at = models.DateTimeField(auto_now=True)
+    # card_content_hash of front and back, unique per deck. Null until
+    # collapse_duplicates has processed cards created before it existed.
+    content_hash = models.CharField(max_length=40, null=True, editable=False)
+
+    objects = CardQuerySet.as_manager()
+
+    def save(self, *args, **kwargs):
+        fields = kwargs.get('update_fields')
+        if fields is None or set(fields) & set(['front', 'back']):
+            self.content_hash = card_content_hash(self.front, self.back)
+            if fields is not None:
+                kwargs['update_fields'] = list(fields) + ['content_hash']
+        super(Card, self).save(*args, **kwargs)
 
     @property
     def is_due(self):
-        if self.last_review_date():
-            next_review = self.last_review_date() + timedelta(days=self.interval)
-            return next_review <= timezone.now()
-        else:
-            return True
+        return self.next_due_at <= timezone.now()
 
-    def last_review_date(self):
-        if self.reviews.all().count() == 0:
-            return None
-        else:
-            return self.reviews.all()[0].review_date
-
-    def review(self, answer_quality):
-        if self.times_reviewed() == 0:
-            self.interval = 0;
-        elif self.times_reviewed() == 1:
-            self.interval = 1;
-        elif self.times_reviewed() == 2:
-            self.interval = 6;
+    def review(self, answer_quality, review_date=None):
+        self.times_reviewed += 1
+        if self.times_reviewed == 1:
+            self.interval = 1
+        elif self.times_reviewed == 2:
+            self.interval = 6
         else:
             easiness_factor = self.new_easiness_factor(answer_quality)
             self.easiness_factor = easiness_factor
             interval = self.new_interval(easiness_factor)
             self.interval = interval
 
-    def times_reviewed(self):
-        return self.reviews.all().count()
+        self.last_review_date = review_date or timezone.now()
+        self.next_due_at = scheduler.due_date(self.last_review_date,
+                                              self.interval)
 
     def new_easiness_factor(self, answer_quality):
         MAX_EASINESS_FACTOR = 2.5
@@ -63,14 +146,220 @@ class Card(models.Model):
         return round(new_easiness_factor, 2)
 
     def new_interval(self, easiness_factor):
-        return int(self.interval * easiness_factor)
+        return min(int(self.interval * easiness_factor),
+                   scheduler.MAX_INTERVAL)
+
+    class Meta:
+        # Composite indexes lead with the foreign key, so they also serve
+        # lookups by it and the foreign key has no index of its own.
+        indexes = [
+            # Covers the columns the study session ranks cards by.
+            models.Index(fields=['deck', 'next_due_at', 'times_reviewed',
+                                 'interval'],
+                         name='api_card_deck_due_sched_idx'),
+            # New cards of a deck in the order they are studied.
+            models.Index(fields=['deck', 'times_reviewed', 'next_due_at'],
+                         name='api_card_deck_new_idx'),
+            models.Index(fields=['deck', 'updated_at'],
+                         name='api_card_deck_updated_idx'),
+        ]
+        unique_together = ('deck', 'content_hash')
 
 
 class Review(models.Model):
     card = models.ForeignKey(Card, related_name='reviews',
-                             on_delete=models.CASCADE)
-    review_date = models.DateTimeField(auto_now_add=True)
+                             on_delete=models.CASCADE, db_index=False)
+    review_date = models.DateTimeField(default=timezone.now, db_index=True)
     answer_quality = models.IntegerField()
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     class Meta:
         ordering = ["-review_date"]
+        # Leads with card, see Card.Meta.
+        indexes = [
+            models.Index(fields=['card', '-review_date'],
+                         name='api_review_card_date_idx'),
+            # Pages a user's reviews for /sync/ without reading the rows.
+            models.Index(fields=['card', 'updated_at'],
+                         name='api_review_card_updated_idx'),
+        ]
+
+
+class ReviewSummary(models.Model):
+    # Roll-up of the reviews of a card that compact_reviews moved to the
+    # review archive: the card's scheduling state after its last archived
+    # review and how often each answer quality was given. Rebuilding the
+    # card replays its remaining reviews from this state.
+    card = models.OneToOneField(Card, related_name="review_summary",
+                                on_delete=models.CASCADE, primary_key=True)
+    interval = models.IntegerField()
+    easiness_factor = models.FloatField()
+    times_reviewed = models.IntegerField()
+    last_review_date = models.DateTimeField()
+    answer_quality_0 = models.IntegerField(default=0)
+    answer_quality_1 = models.IntegerField(default=0)
+    answer_quality_2 = models.IntegerField(default=0)
+    answer_quality_3 = models.IntegerField(default=0)
+    answer_quality_4 = models.IntegerField(default=0)
+    answer_quality_5 = models.IntegerField(default=0)
+
+
+class DataVersion(models.Model):
+    # Bumped after every write to a user's decks, cards or reviews; ETags
+    # are derived from it. Representations also change when a card becomes
+    # due, so due_boundary records the earliest upcoming next_due_at and
+    # reads bump the version once it has passed. Writes set it to the
+    # current time to have the next read recompute it.
+    user = models.OneToOneField(User, related_name="data_version",
+                                on_delete=models.CASCADE, primary_key=True)
+    version = models.BigIntegerField(default=0)
+    due_boundary = models.DateTimeField(null=True)
+
+
+class Tombstone(models.Model):
+    # Records a deletion made through the API so that syncing clients can
+    # drop the object; children removed by the cascade get no tombstone.
+    user = models.ForeignKey(User, related_name="tombstones",
+                             on_delete=models.CASCADE, db_index=False)
+    model = models.CharField(max_length=20)
+    object_id = models.IntegerField()
+    deleted_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'deleted_at'],
+                         name='api_tombstone_user_idx'),
+        ]
+
+
+def record_reviews(cards, entries):
+    # cards maps card ids to Card instances, entries is an ordered iterable
+    # of (card_id, answer_quality, review_date). Reviews are replayed on the
+    # cards in memory and written with one INSERT and one UPDATE per batch.
+    reviews = []
+    reviewed_cards = {}
+    for card_id, answer_quality, review_date in entries:
+        card = cards[card_id]
+        card.review(answer_quality, review_date)
+        reviewed_cards[card.pk] = card
+        reviews.append(Review(card=card, answer_quality=answer_quality,
+                              review_date=review_date))
+
+    Review.objects.bulk_create(reviews)
+    Card.objects.update_scheduling(list(reviewed_cards.values()))
+    return reviews
+
+
+def scheduling_state(card):
+    return [getattr(card, field) for field in Card.SCHEDULING_FIELDS]
+
+
+def replay_reviews(cards):
+    # Recomputes the scheduling state of the cards from their reviews, and
+    # their review summaries for compacted history, in memory. Returns the
+    # cards whose state changed with their old state, and the number of
+    # reviews replayed.
+    positions = {card.pk: position for position, card in enumerate(cards)}
+    reviews = (Review.objects
+               .filter(card_id__in=list(positions))
+               .order_by('card_id', 'review_date', 'id')
+               .values_list('card_id', 'answer_quality', 'review_date')
+               .iterator())
+
+    card_positions = []
+    answer_qualities = []
+    last_review_dates = {}
+    for card_id, answer_quality, review_date in reviews:
+        card_positions.append(positions[card_id])
+        answer_qualities.append(answer_quality)
+        last_review_dates[card_id] = review_date
+
+    # Cards with compacted history start from their review summary.
+    interval = np.zeros(len(cards), dtype=np.int64)
+    easiness_factor = np.full(len(cards), scheduler.INITIAL_EASINESS_FACTOR)
+    times_reviewed = np.zeros(len(cards), dtype=np.int64)
+    summary_dates = {}
+    summaries = ReviewSummary.objects.filter(card_id__in=list(positions))
+    for summary in summaries:
+        position = positions[summary.card_id]
+        interval[position] = summary.interval
+        easiness_factor[position] = summary.easiness_factor
+        times_reviewed[position] = summary.times_reviewed
+        summary_dates[summary.card_id] = summary.last_review_date
+
+    state = scheduler.replay(card_positions, answer_qualities, interval,
+                             easiness_factor, times_reviewed)
+
+    changed = []
+    for card, interval, easiness_factor, times_reviewed in zip(cards, *state):
+        old_state = scheduling_state(card)
+        card.interval = int(interval)
+        card.easiness_factor = float(easiness_factor)
+        card.times_reviewed = int(times_reviewed)
+        card.last_review_date = last_review_dates.get(
+            card.pk, summary_dates.get(card.pk))
+        if card.last_review_date is None:
+            card.next_due_at = card.creation_date
+        else:
+            card.next_due_at = scheduler.due_date(card.last_review_date,
+                                                  card.interval)
+        if scheduling_state(card) != old_state:
+            changed.append((card, old_state))
+    return changed, len(card_positions)
+
+
+def rebuild_scheduling(card_ids):
+    # For writes that change a card's history other than by appending a
+    # review. Must run in the transaction that made the change.
+    cards = list(Card.objects.select_for_update().filter(
+        pk__in=card_ids).order_by('pk'))
+    changed, _ = replay_reviews(cards)
+    Card.objects.update_scheduling([card for card, _ in changed])
+
+
+class PendingReview(models.Model):
+    # Outbox of reviews accepted while MEMORAY_REVIEW_OUTBOX is on. Rows are
+    # applied by the drain_reviews worker, or by the owner's next due-queue
+    # fetch, and deleted once applied.
+    user = models.ForeignKey(User, related_name="pending_reviews",
+                             on_delete=models.CASCADE, db_index=False)
+    card = models.ForeignKey(Card, related_name="pending_reviews",
+                             on_delete=models.CASCADE)
+    answer_quality = models.IntegerField()
+    review_date = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'id'],
+                         name='api_pendingreview_user_idx'),
+        ]
+
+
+def apply_pending_reviews(pending, limit=None, skip_locked=False):
+    # Applies the pending reviews in the queryset in submission order and
+    # removes them from the outbox, all in one transaction, and returns the
+    # applied PendingReview objects. Reviews are claimed a card at a time:
+    # the cards of the first limit reviews are locked before any of their
+    # reviews are read, and then all of those are applied, so a card's
+    # reviews are never split between workers and applied out of order.
+    # Workers pass skip_locked so that they pass over cards another worker
+    # is applying; readers must not, so that they wait for those reviews.
+    skip_locked = (skip_locked and
+                   connection.features.has_select_for_update_skip_locked)
+    with transaction.atomic():
+        card_ids = pending.order_by('pk').values_list('card_id', flat=True)
+        if limit is not None:
+            card_ids = card_ids[:limit]
+        cards = list(Card.objects.select_for_update(skip_locked=skip_locked)
+                     .filter(pk__in=set(card_ids)).order_by('pk'))
+        pending = list(pending.filter(card__in=cards)
+                       .select_for_update().order_by('pk'))
+        if not pending:
+            return pending
+        record_reviews({card.pk: card for card in cards}, [
+            (review.card_id, review.answer_quality, review.review_date)
+            for review in pending
+        ])
+        PendingReview.objects.filter(
+            pk__in=[review.pk for review in pending]).delete()
+    return pending
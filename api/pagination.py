@@ -0,0 +1,133 @@
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+from rest_framework.pagination import _reverse_ordering
+
+
+class SizedCursorPagination(CursorPagination):
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+
+class KeysetCursorPagination(SizedCursorPagination):
+    # DRF's cursor holds the first ordering column only and steps over rows
+    # tied on it with an OFFSET. Here it holds every ordering column, which
+    # together have to be unique, and the page starts after that key.
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.page_size = self.get_page_size(request)
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+
+        self.cursor = self.decode_cursor(request)
+        if self.cursor is None:
+            offset, reverse, current_position = 0, False, None
+        else:
+            offset, reverse, current_position = self.cursor
+
+        if reverse:
+            queryset = queryset.order_by(*_reverse_ordering(self.ordering))
+        else:
+            queryset = queryset.order_by(*self.ordering)
+        if current_position is not None:
+            queryset = queryset.filter(self.after_position(
+                queryset.model, current_position, reverse))
+
+        results = list(queryset[offset:offset + self.page_size + 1])
+        self.page = results[:self.page_size]
+        if len(results) > len(self.page):
+            following_position = self._get_position_from_instance(
+                results[-1], self.ordering)
+        else:
+            following_position = None
+        if reverse:
+            self.page.reverse()
+
+        # As in CursorPagination.paginate_queryset.
+        started = current_position is not None or offset > 0
+        if reverse:
+            self.has_next = started
+            self.has_previous = following_position is not None
+            self.next_position = current_position
+            self.previous_position = following_position
+        else:
+            self.has_next = following_position is not None
+            self.has_previous = started
+            self.next_position = following_position
+            self.previous_position = current_position
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+        return self.page
+
+    def after_position(self, model, position, reverse):
+        # Rows past position in the order the page is read in, as
+        # (a > x) | (a = x) & ((b > y) | ...), bounded by a >= x so that
+        # the index on the ordering columns is used.
+        try:
+            values = json.loads(position)
+            if len(values) != len(self.ordering):
+                raise ValueError(position)
+            values = [
+                model._meta.get_field(order.lstrip('-')).to_python(value)
+                for order, value in zip(self.ordering, values)]
+        except (TypeError, ValueError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+        lookups = []
+        for order in self.ordering:
+            descending = order.startswith('-')
+            lookups.append((order.lstrip('-'),
+                            '__lt' if reverse != descending else '__gt'))
+        after = None
+        for (name, lookup), value in reversed(list(zip(lookups, values))):
+            past = Q(**{name + lookup: value})
+            after = past if after is None else (
+                past | Q(**{name: value}) & after)
+        name, lookup = lookups[0]
+        return Q(**{name + lookup + 'e': values[0]}) & after
+
+    def _get_position_from_instance(self, instance, ordering):
+        if isinstance(instance, dict):
+            values = [instance[order.lstrip('-')] for order in ordering]
+        else:
+            values = [getattr(instance, order.lstrip('-'))
+                      for order in ordering]
+        return json.dumps([str(value) for value in values])
+
+
+class DeckPagination(SizedCursorPagination):
+    ordering = 'id'
+
+
+class DueCardPagination(KeysetCursorPagination):
+    ordering = ('next_due_at', 'id')
+
+
+class CardPagination(SizedCursorPagination):
+    ordering = 'id'
+
+
+class ReviewPagination(KeysetCursorPagination):
+    # Reviews posted together in one bulk request share their review_date.
+    ordering = ('-review_date', '-id')
+
+
+class SearchPagination(PageNumberPagination):
+    # Search results are ordered by rank, which a cursor cannot encode.
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
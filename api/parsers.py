@@ -0,0 +1,30 @@
+from django.utils import six
+
+from rest_framework import parsers
+from rest_framework.exceptions import ParseError
+
+import msgpack
+import rapidjson
+
+
+class FastJSONParser(parsers.JSONParser):
+    # Parses with python-rapidjson. Request bodies are expected to be UTF-8,
+    # as RFC 8259 requires.
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return rapidjson.loads(stream.read())
+        except ValueError as exc:
+            raise ParseError('JSON parse error - %s' % six.text_type(exc))
+
+
+class MessagePackParser(parsers.BaseParser):
+    media_type = 'application/msgpack'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        # Malformed input raises ValueError; a map or array used as a map
+        # key raises TypeError.
+        try:
+            return msgpack.unpackb(stream.read(), raw=False)
+        except (ValueError, TypeError) as exc:
+            raise ParseError('MessagePack parse error - %s' %
+                             six.text_type(exc))
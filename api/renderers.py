@@ -0,0 +1,61 @@
+import json
+
+from rest_framework import renderers
+from rest_framework.utils import encoders
+
+import msgpack
+import rapidjson
+
+
+class ExportRenderer(renderers.BaseRenderer):
+    # Export actions stream their own response; these renderers let content
+    # negotiation pick the export format and only ever render error details.
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return json.dumps(data).encode(self.charset)
+
+
+class JSONLinesRenderer(ExportRenderer):
+    media_type = 'application/x-ndjson'
+    format = 'jsonl'
+
+
+class CSVRenderer(ExportRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+
+class FastJSONRenderer(renderers.JSONRenderer):
+    # Renders with python-rapidjson. Datetimes and other types rapidjson
+    # does not handle the way DRF does go through DRF's encoder, so the
+    # output matches JSONRenderer. Indented output, as used by the browsable
+    # API, and dicts with keys that are not strings, which rapidjson
+    # rejects, are left to JSONRenderer.
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None or self.get_indent(
+                accepted_media_type, renderer_context or {}) is not None:
+            return super(FastJSONRenderer, self).render(
+                data, accepted_media_type, renderer_context)
+        try:
+            ret = rapidjson.dumps(data, ensure_ascii=self.ensure_ascii,
+                                  default=self.encoder_class().default)
+        except TypeError:
+            return super(FastJSONRenderer, self).render(
+                data, accepted_media_type, renderer_context)
+        # Escaped like JSONRenderer does, to keep the output valid JavaScript.
+        ret = ret.replace('\u2028', '\\u2028').replace('\u2029', '\\u2029')
+        return ret.encode('utf-8')
+
+
+class MessagePackRenderer(renderers.BaseRenderer):
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return bytes()
+        return msgpack.packb(data, use_bin_type=True,
+                             default=encoders.JSONEncoder().default)
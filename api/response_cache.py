@@ -0,0 +1,140 @@
+import hashlib
+import threading
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+from django.utils.http import urlencode
+
+from api.cache import LRUCache
+
+RESPONSE_CACHE_SETTINGS = {
+    'CACHE': None,
+    'MAX_BYTES': 64 * 1024 * 1024,
+    'TTL': 300,
+}
+RESPONSE_CACHE_SETTINGS.update(getattr(settings, 'MEMORAY_RESPONSE_CACHE', {}))
+
+# Every entry's key carries the user's current generation. Invalidating a
+# user moves them to a new generation, which no older entry matches; the
+# old entries are then never read and age out of the cache.
+
+
+def new_generation():
+    return uuid.uuid4().hex
+
+
+class LocalResponseCache(object):
+    # Per-process LRU bounded by the total size of the cached responses.
+    def __init__(self, max_bytes, ttl):
+        self.entries = LRUCache(None, ttl, max_bytes,
+                                sizeof=lambda entry: len(entry[0]))
+        self.generations = {}
+        self.lock = threading.Lock()
+
+    def generation(self, user_id):
+        with self.lock:
+            return self.generations.setdefault(user_id, new_generation())
+
+    def invalidate(self, user_id):
+        with self.lock:
+            self.generations[user_id] = new_generation()
+
+    def get(self, key):
+        return self.entries.get(key)
+
+    def set(self, key, entry):
+        self.entries.set(key, entry)
+
+    def counters(self):
+        return {
+            "hits": self.entries.hits,
+            "misses": self.entries.misses,
+            "evictions": self.entries.evictions,
+            "bytes": self.entries.size,
+        }
+
+
+class SharedResponseCache(object):
+    # Entries and generations live in a CACHES backend shared by all
+    # workers. The backend evicts entries itself without reporting it, so
+    # only hits and misses of this worker are counted.
+    def __init__(self, alias, ttl):
+        self.cache = caches[alias]
+        self.ttl = ttl
+        self.hits = self.misses = 0
+
+    def generation_key(self, user_id):
+        return 'memoray:response-generation:%d' % user_id
+
+    def generation(self, user_id):
+        generation = self.cache.get(self.generation_key(user_id))
+        if generation is None:
+            self.cache.add(self.generation_key(user_id), new_generation(),
+                           None)
+            generation = self.cache.get(self.generation_key(user_id))
+        return generation
+
+    def invalidate(self, user_id):
+        self.cache.set(self.generation_key(user_id), new_generation(), None)
+
+    def get(self, key):
+        entry = self.cache.get(key)
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return entry
+
+    def set(self, key, entry):
+        self.cache.set(key, entry, self.ttl)
+
+    def counters(self):
+        return {"hits": self.hits, "misses": self.misses, "evictions": None}
+
+
+def build_response_cache():
+    if RESPONSE_CACHE_SETTINGS['CACHE']:
+        return SharedResponseCache(RESPONSE_CACHE_SETTINGS['CACHE'],
+                                   RESPONSE_CACHE_SETTINGS['TTL'])
+    return LocalResponseCache(RESPONSE_CACHE_SETTINGS['MAX_BYTES'],
+                              RESPONSE_CACHE_SETTINGS['TTL'])
+
+
+response_cache = build_response_cache()
+
+
+def response_cache_key(request, version):
+    # The data version changes with every write and whenever one of the
+    # user's cards becomes due, so entries never serve a stale is_due.
+    user_id = request.user.pk
+    route = '%s?%s %s' % (
+        request.path, urlencode(sorted(request.query_params.lists()),
+                                doseq=True),
+        request.accepted_renderer.media_type)
+    return 'memoray:response:%d:%s:%d:%s' % (
+        user_id, response_cache.generation(user_id), version,
+        hashlib.sha1(route.encode('utf-8')).hexdigest())
+
+
+def get_cached_response(request, version):
+    entry = response_cache.get(response_cache_key(request, version))
+    if entry is None:
+        return None
+    content, content_type = entry
+    return HttpResponse(content, content_type=content_type)
+
+
+def cache_response(request, version, response):
+    response.render()
+    response_cache.set(response_cache_key(request, version),
+                       (response.content, response['Content-Type']))
+
+
+def invalidate_responses(user_id):
+    response_cache.invalidate(user_id)
+
+
+def response_cache_counters():
+    return response_cache.counters()
@@ -0,0 +1,83 @@
+from datetime import datetime, timedelta
+
+from django.utils import timezone
+
+import numpy as np
+
+MAX_EASINESS_FACTOR = 2.5
+MIN_EASINESS_FACTOR = 1.1
+INITIAL_EASINESS_FACTOR = 2.5
+# Intervals grow without bound under good answers and would overflow
+# datetime arithmetic after about 2.9M days, so they stop at 100 years.
+MAX_INTERVAL = 36500
+LAST_DUE_DATE = datetime(9999, 1, 1, tzinfo=timezone.utc)
+
+
+def due_date(last_review_date, interval):
+    # Reviews dated close to datetime.max are due at LAST_DUE_DATE.
+    if LAST_DUE_DATE - last_review_date <= timedelta(days=interval):
+        return LAST_DUE_DATE
+    return last_review_date + timedelta(days=interval)
+
+
+def review(interval, easiness_factor, times_reviewed, answer_quality):
+    # Array version of Card.review: element i of every argument describes
+    # one card, and the new (interval, easiness_factor, times_reviewed) are
+    # returned as fresh arrays. The float operations are done in the same
+    # order as in Card.new_easiness_factor so the results are bit-identical.
+    interval = np.asarray(interval, dtype=np.int64)
+    easiness_factor = np.asarray(easiness_factor, dtype=np.float64)
+    times_reviewed = np.asarray(times_reviewed, dtype=np.int64) + 1
+    answer_quality = np.asarray(answer_quality, dtype=np.float64)
+
+    new_easiness_factor = (easiness_factor - 0.8 + 0.28 * answer_quality -
+                           0.02 * answer_quality * answer_quality)
+    new_easiness_factor = np.round(np.clip(
+        new_easiness_factor, MIN_EASINESS_FACTOR, MAX_EASINESS_FACTOR), 2)
+    new_interval = np.minimum(
+        np.trunc(interval * new_easiness_factor).astype(np.int64),
+        MAX_INTERVAL)
+
+    graduated = times_reviewed > 2
+    easiness_factor = np.where(graduated, new_easiness_factor,
+                               easiness_factor)
+    interval = np.where(graduated, new_interval,
+                        np.where(times_reviewed == 1, 1, 6))
+    return interval, easiness_factor, times_reviewed
+
+
+def replay(card_positions, answer_quality, interval, easiness_factor,
+           times_reviewed):
+    # Folds review histories of many cards through review(). card_positions
+    # gives, for every review, the index of its card in the state arrays;
+    # reviews of one card must appear in the order they happened. Each step
+    # applies the k-th review of every card at once, so the Python loop runs
+    # once per review of the most reviewed card, not once per review.
+    card_positions = np.asarray(card_positions, dtype=np.int64)
+    answer_quality = np.asarray(answer_quality, dtype=np.int64)
+    interval = np.array(interval, dtype=np.int64)
+    easiness_factor = np.array(easiness_factor, dtype=np.float64)
+    times_reviewed = np.array(times_reviewed, dtype=np.int64)
+    if not len(card_positions):
+        return interval, easiness_factor, times_reviewed
+
+    by_card = np.argsort(card_positions, kind='mergesort')
+    card_positions = card_positions[by_card]
+    answer_quality = answer_quality[by_card]
+
+    starts = np.flatnonzero(np.diff(card_positions)) + 1
+    starts = np.concatenate(([0], starts))
+    counts = np.diff(np.concatenate((starts, [len(card_positions)])))
+    steps = np.arange(len(card_positions)) - np.repeat(starts, counts)
+
+    by_step = np.argsort(steps, kind='mergesort')
+    card_positions = card_positions[by_step]
+    answer_quality = answer_quality[by_step]
+    bounds = np.searchsorted(steps[by_step], np.arange(counts.max() + 1))
+
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        cards = card_positions[start:end]
+        interval[cards], easiness_factor[cards], times_reviewed[cards] = \
+            review(interval[cards], easiness_factor[cards],
+                   times_reviewed[cards], answer_quality[start:end])
+    return interval, easiness_factor, times_reviewed
@@ -0,0 +1,59 @@
+import re
+
+from django.db import connections
+
+# Cards are searched through a text index on front and back: an FTS5 table
+# on SQLite and a GIN expression index on PostgreSQL, both created by
+# migration 0027. Every word must match as the start of a word, so that
+# results follow typing.
+
+# Must match the expression of api_card_search_idx.
+POSTGRESQL_VECTOR = (
+    "to_tsvector('simple', api_card.front || ' ' || api_card.back)")
+
+
+class SearchNotSupported(Exception):
+    pass
+
+
+def search_terms(text):
+    # Punctuation separates words in both indexes, and leaving it out keeps
+    # the query syntax of either out of reach of users.
+    return re.findall(r'\w+', text, re.UNICODE)
+
+
+def fts5_query(terms):
+    return ' '.join('"%s"*' % term.replace('"', '""') for term in terms)
+
+
+def tsquery(terms):
+    return ' & '.join(
+        "'%s':*" % term.replace('\\', '\\\\').replace("'", "''")
+        for term in terms)
+
+
+def search_cards(cards, text):
+    # cards filtered to those matching text, best match first.
+    terms = search_terms(text)
+    if not terms:
+        return cards.none().order_by('id')
+    vendor = connections[cards.db].vendor
+    if vendor == 'sqlite':
+        # bm25() is lower for better matches; the front weighs double.
+        cards = cards.extra(
+            tables=['api_card_fts'],
+            where=['api_card_fts.rowid = api_card.id',
+                   'api_card_fts MATCH %s'],
+            params=[fts5_query(terms)],
+            select={'search_rank': '-bm25(api_card_fts, 2.0, 1.0)'})
+    elif vendor == 'postgresql':
+        query = "to_tsquery('simple', %s)"
+        cards = cards.extra(
+            where=['%s @@ %s' % (POSTGRESQL_VECTOR, query)],
+            params=[tsquery(terms)],
+            select={'search_rank': 'ts_rank(%s, %s)' % (POSTGRESQL_VECTOR,
+                                                        query)},
+            select_params=[tsquery(terms)])
+    else:
+        raise SearchNotSupported(vendor)
+    return cards.order_by('-search_rank', 'id')
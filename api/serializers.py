@@ -1,29 +1,151 @@
 from rest_framework import serializers
-from api.models import Deck, Card, Review
+from rest_framework.permissions import SAFE_METHODS
+from api.models import Deck, Card, PendingReview, Review, card_content_hash
 from django.contrib.auth.models import User
+from django.utils import timezone
 
+from collections import OrderedDict
 
-class ReviewSerializer(serializers.ModelSerializer):
+
+class SparseFieldsMixin(object):
+    # Renders only the fields listed in ?fields=id,front,... on reads.
+    def __init__(self, *args, **kwargs):
+        super(SparseFieldsMixin, self).__init__(*args, **kwargs)
+        request = self.context.get('request')
+        if (request is None or request.method not in SAFE_METHODS or
+                'fields' not in request.query_params):
+            return
+        requested = [name.strip() for name in
+                     request.query_params['fields'].split(',') if name.strip()]
+        unknown = [name for name in requested if name not in self.fields]
+        if unknown:
+            raise serializers.ValidationError(
+                {"fields": ["Unknown fields: %s." % ", ".join(unknown)]})
+        for name in set(self.fields) - set(requested):
+            self.fields.pop(name)
+
+
+class ValuesMixin(object):
+    # Read-only fast path that renders rows of queryset.values() instead of
+    # model instances. Fields whose values() value already is their
+    # representation are copied; computed_fields maps other fields to the
+    # columns that compute_<field>(row) reads.
+    RAW_FIELDS = (serializers.BooleanField, serializers.CharField,
+                  serializers.FloatField, serializers.IntegerField,
+                  serializers.PrimaryKeyRelatedField)
+    computed_fields = {}
+
+    def values_columns(self):
+        columns = []
+        for name, field in self.fields.items():
+            for column in self.computed_fields.get(name, (field.source,)):
+                if column not in columns:
+                    columns.append(column)
+        return columns
+
+    def values_representation(self, rows):
+        readers = []
+        for name, field in self.fields.items():
+            if name in self.computed_fields:
+                readers.append((name, getattr(self, 'compute_' + name)))
+            elif isinstance(field, self.RAW_FIELDS):
+                readers.append((name, lambda row, source=field.source:
+                                row[source]))
+            else:
+                readers.append((name, lambda row, field=field:
+                                field.to_representation(row[field.source])))
+        return [OrderedDict((name, read(row)) for name, read in readers)
+                for row in rows]
+
+
+class ReviewSerializer(SparseFieldsMixin, ValuesMixin,
+                       serializers.ModelSerializer):
     class Meta:
         model = Review
         fields = ('id', 'review_date', 'answer_quality', 'card')
+        read_only_fields = ('review_date',)
 
 
-class CardSerializer(serializers.ModelSerializer):
+class PendingReviewSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = PendingReview
+        fields = ('review_date', 'answer_quality', 'card')
+
+
+class ReviewEntrySerializer(serializers.Serializer):
+    card = serializers.IntegerField()
+    answer_quality = serializers.IntegerField(min_value=0, max_value=5)
+    reviewed_at = serializers.DateTimeField(required=False)
+
+
+class CardSerializer(SparseFieldsMixin, ValuesMixin,
+                     serializers.ModelSerializer):
+    computed_fields = {'is_due': ('next_due_at',)}
+
     class Meta:
         model = Card
         fields = ('id', 'front', 'back', 'is_due', 'deck')
 
+    def compute_is_due(self, row):
+        return row['next_due_at'] <= timezone.now()
+
+    def validate(self, attrs):
+        # One lookup through the deck's unique content hash index; partial
+        # updates keep the rest of the card as it is.
+        instance = self.instance
+        deck_id = attrs['deck'].pk if 'deck' in attrs else instance.deck_id
+        content_hash = card_content_hash(
+            attrs['front'] if 'front' in attrs else instance.front,
+            attrs['back'] if 'back' in attrs else instance.back)
+        duplicates = Card.objects.filter(deck_id=deck_id,
+                                         content_hash=content_hash)
+        if instance is not None:
+            duplicates = duplicates.exclude(pk=instance.pk)
+        if duplicates.exists():
+            raise serializers.ValidationError(
+                "This deck already has a card with this front and back.")
+        return attrs
+
+
+class StudyCardSerializer(ValuesMixin, serializers.ModelSerializer):
+    class Meta:
+        model = Card
+        fields = ('id', 'front', 'back', 'deck') + Card.SCHEDULING_FIELDS
+
+
+class SyncCardSerializer(ValuesMixin, serializers.ModelSerializer):
+    # Cards only come back in a sync when they change, so clients get the
+    # schedule to tell when they are due rather than a point-in-time is_due.
+    class Meta:
+        model = Card
+        fields = ('id', 'front', 'back', 'deck') + Card.SCHEDULING_FIELDS
+
+
+class CardImportSerializer(serializers.Serializer):
+    front = serializers.CharField(max_length=200)
+    back = serializers.CharField(max_length=200)
+
+
+class DeckSerializer(SparseFieldsMixin, ValuesMixin,
+                     serializers.ModelSerializer):
+    card_count = serializers.IntegerField(read_only=True)
+    due_count = serializers.IntegerField(read_only=True)
+    new_count = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = Deck
+        fields = ('id', 'name', 'user', 'card_count', 'due_count', 'new_count')
 
-class DeckSerializer(serializers.ModelSerializer):
-    cards = CardSerializer(many=True, read_only=True)
 
+class SyncDeckSerializer(ValuesMixin, serializers.ModelSerializer):
+    # Card counts change without the deck being saved, so they are left to
+    # clients, which have the cards.
     class Meta:
         model = Deck
-        fields = ('id', 'name', 'cards', 'user')
+        fields = ('id', 'name', 'user')
 
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ('id', 'username', 'decks')
@@ -0,0 +1,50 @@
+from django.contrib.auth.models import User
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from api.authentication import invalidate_cached_user
+from api.models import Card, Deck, Review
+from api.versions import data_changed_on_commit
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user(sender, instance, **kwargs):
+    invalidate_cached_user(instance.get_username())
+
+
+# Any write to a user's decks, cards or reviews bumps their data version,
+# which also invalidates their cached responses and stats. Bulk writes,
+# which send no signals, call data_changed themselves.
+def card_owner_changed(card):
+    # The owner is read from related objects already loaded, if any.
+    deck = getattr(card, Card.deck.cache_name, None)
+    if deck is not None:
+        data_changed_on_commit(user_id=deck.user_id)
+    else:
+        data_changed_on_commit(deck_id=card.deck_id)
+
+
+@receiver(post_save, sender=Deck)
+@receiver(post_delete, sender=Deck)
+def deck_data_changed(sender, instance, **kwargs):
+    data_changed_on_commit(user_id=instance.user_id)
+
+
+@receiver(post_save, sender=Card)
+@receiver(post_delete, sender=Card)
+def card_data_changed(sender, instance, **kwargs):
+    card_owner_changed(instance)
+
+
+# There is no post_delete receiver for reviews, so that deleting a card
+# deletes its reviews without loading every row. Reviews deleted through
+# the API call data_changed, and with their card the card's receiver
+# runs.
+@receiver(post_save, sender=Review)
+def review_data_changed(sender, instance, **kwargs):
+    card = getattr(instance, Review.card.cache_name, None)
+    if card is not None:
+        card_owner_changed(card)
+    else:
+        data_changed_on_commit(card_id=instance.card_id)
@@ -0,0 +1,108 @@
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from api.models import Card, Deck, Review, ReviewSummary
+from api.versions import get_data_version
+
+FORECAST_DAYS = (30, 90, 365)
+ANSWER_QUALITIES = range(6)
+# Answers of 3 and above are recalled correctly in SM-2.
+PASSING_QUALITY = 3
+# Cached stats are keyed by the user's data version, so a write makes them
+# stale everywhere; the timeout only bounds how long old entries are kept.
+STATS_CACHE_TIMEOUT = getattr(settings, 'MEMORAY_STATS_CACHE_TIMEOUT', 3600)
+
+
+def stats_cache_key(user_id, version):
+    return 'memoray:stats:%d:%d' % (user_id, version)
+
+
+def get_stats(user):
+    # Cached stats carry the day they were computed for, so the forecast
+    # moves on at midnight.
+    today = timezone.localdate()
+    key = stats_cache_key(user.pk, get_data_version(user))
+    stats = cache.get(key)
+    if stats is None or stats['date'] != today:
+        stats = compute_stats(user, today)
+        cache.set(key, stats, STATS_CACHE_TIMEOUT)
+    return stats
+
+
+def compute_stats(user, today):
+    return {
+        "date": today,
+        "forecast": due_forecast(user, today),
+        "decks": deck_retention(user),
+    }
+
+
+def due_forecast(user, today):
+    # Cards due per local calendar day for the next FORECAST_DAYS days, from
+    # one GROUP BY query; cards due before today count as overdue.
+    days = max(FORECAST_DAYS)
+    end = timezone.make_aware(
+        datetime.combine(today + timedelta(days=days), time.min))
+    counts = (Card.objects.filter(deck__user=user, next_due_at__lt=end)
+              .annotate(day=TruncDate('next_due_at'))
+              .values('day').annotate(count=Count('pk'))
+              .values_list('day', 'count'))
+    overdue = 0
+    due = [0] * days
+    for day, count in counts:
+        offset = (day - today).days
+        if offset < 0:
+            overdue += count
+        else:
+            due[offset] += count
+    return {"overdue": overdue, "due": due}
+
+
+def deck_retention(user):
+    # Answer quality distribution per deck from one GROUP BY query over the
+    # reviews and one over the summaries of compacted reviews. The default
+    # ordering is cleared so review_date stays out of the GROUP BY.
+    counts = (Review.objects.filter(card__deck__user=user).order_by()
+              .values('card__deck_id', 'answer_quality')
+              .annotate(count=Count('pk'))
+              .values_list('card__deck_id', 'answer_quality', 'count'))
+    distributions = {}
+    for deck_id, answer_quality, count in counts:
+        if answer_quality not in ANSWER_QUALITIES:
+            continue
+        distribution = distributions.setdefault(
+            deck_id, [0 for _ in ANSWER_QUALITIES])
+        distribution[answer_quality] += count
+
+    totals = {'total_%d' % answer_quality: Sum('answer_quality_%d' %
+                                               answer_quality)
+              for answer_quality in ANSWER_QUALITIES}
+    summaries = (ReviewSummary.objects.filter(card__deck__user=user)
+                 .values('card__deck_id').annotate(**totals)
+                 .values_list('card__deck_id', *sorted(totals)))
+    for summary in summaries:
+        distribution = distributions.setdefault(
+            summary[0], [0 for _ in ANSWER_QUALITIES])
+        for answer_quality, count in zip(ANSWER_QUALITIES, summary[1:]):
+            distribution[answer_quality] += count
+
+    decks = []
+    for deck_id, name in (Deck.objects.filter(user=user).order_by('pk')
+                          .values_list('pk', 'name')):
+        distribution = distributions.get(deck_id,
+                                         [0 for _ in ANSWER_QUALITIES])
+        reviews = sum(distribution)
+        decks.append({
+            "id": deck_id,
+            "name": name,
+            "reviews": reviews,
+            "answer_quality": distribution,
+            "retention": (sum(distribution[PASSING_QUALITY:]) / reviews
+                          if reviews else None),
+        })
+    return decks
@@ -0,0 +1,106 @@
+from django.conf import settings
+from django.db import connection
+from django.db.models import ExpressionWrapper, F, FloatField, Func, Q, Value
+from django.db.models.functions import Greatest
+
+from api.models import Card
+
+STUDY_SESSION_SETTINGS = {
+    'SIZE': 20,
+    'MAX_SIZE': 200,
+    'NEW_CARD_RATIO': 0.2,
+    'CANDIDATES': 1000,
+}
+STUDY_SESSION_SETTINGS.update(getattr(settings, 'MEMORAY_STUDY_SESSION', {}))
+
+SECONDS_PER_DAY = 86400.0
+
+
+class EpochSeconds(Func):
+    # Seconds since the Unix epoch of a datetime expression.
+    template = 'EXTRACT(EPOCH FROM %(expressions)s)'
+    output_field = FloatField()
+
+    def as_sqlite(self, compiler, connection):
+        return self.as_sql(
+            compiler, connection,
+            template='((julianday(%(expressions)s) - 2440587.5) * 86400.0)')
+
+    def as_mysql(self, compiler, connection):
+        return self.as_sql(compiler, connection,
+                           template='UNIX_TIMESTAMP(%(expressions)s)')
+
+
+def overdue_ratio(now):
+    # How far past its due date a card is, in units of its interval. An
+    # interval below one day counts as one day.
+    return ExpressionWrapper(
+        (Value(now.timestamp()) - EpochSeconds('next_due_at')) /
+        (Greatest(F('interval'), Value(1)) * Value(SECONDS_PER_DAY)),
+        output_field=FloatField())
+
+
+def interleave(reviews, new_cards, size, new_ratio):
+    # Up to size cards, new_ratio of them new and spread evenly among the
+    # reviews. Either kind fills the places the other has no cards for.
+    new_count = min(len(new_cards), int(round(size * new_ratio)))
+    review_count = min(len(reviews), size - new_count)
+    new_count = min(len(new_cards), size - review_count)
+    total = review_count + new_count
+
+    session = []
+    reviews, new_cards = iter(reviews), iter(new_cards)
+    taken_new = 0
+    for position in range(total):
+        if (position + 1) * new_count // total > taken_new:
+            session.append(next(new_cards))
+            taken_new += 1
+        else:
+            session.append(next(reviews))
+    return session
+
+
+def study_session(decks, columns, now, size, new_ratio, candidates):
+    # decks is the user's decks, or the one deck asked for. After the deck
+    # ids, a single query fetches the most overdue reviewed cards and the
+    # oldest new cards; the subqueries only read the card indexes, and the
+    # card rows are read for the selected cards alone. Reviews are ranked
+    # among each deck's share of candidates, the cards due longest ago read
+    # from api_card_deck_due_sched_idx, so a large backlog costs no more
+    # to rank than a small one. The share's subqueries are written out in
+    # SQL; building them as querysets costs more than running them.
+    deck_ids = list(decks.values_list('pk', flat=True))
+    if not deck_ids:
+        return []
+    share = max(size, candidates // len(deck_ids))
+    due = ('id IN (SELECT due.id FROM api_card due WHERE due.deck_id = %s '
+           'AND due.times_reviewed > 0 AND due.next_due_at <= %s '
+           'ORDER BY due.next_due_at LIMIT %s)')
+    until = connection.ops.adapt_datetimefield_value(now)
+    longest_due = Card.objects.extra(
+        where=['(%s)' % ' OR '.join([due] * len(deck_ids))],
+        params=[param for deck_id in deck_ids
+                for param in (deck_id, until, share)])
+    most_overdue = (longest_due
+                    .annotate(overdue_ratio=overdue_ratio(now))
+                    .order_by('-overdue_ratio', 'id')
+                    .values('id')[:size])
+    # An unreviewed card is due from its creation.
+    oldest_new = (Card.objects
+                  .filter(deck_id__in=deck_ids, times_reviewed=0)
+                  .order_by('next_due_at', 'id')
+                  .values('id')[:size])
+    rows = Card.objects.filter(
+        Q(pk__in=most_overdue) | Q(pk__in=oldest_new)).values(
+            *set(columns) | set(['id', 'interval', 'times_reviewed',
+                                 'next_due_at']))
+
+    reviews, new_cards = [], []
+    for row in rows:
+        (reviews if row['times_reviewed'] else new_cards).append(row)
+    reviews.sort(key=lambda row: (
+        -(now - row['next_due_at']).total_seconds() /
+        max(row['interval'], 1),
+        row['id']))
+    new_cards.sort(key=lambda row: (row['next_due_at'], row['id']))
+    return interleave(reviews, new_cards, size, new_ratio)
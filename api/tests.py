@@ -1,12 +1,53 @@
-from django.test import TestCase, Client
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase, Client, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 from django.contrib.auth.models import User
 
-from api.models import Deck, Card, Review
-from api.serializers import UserSerializer, DeckSerializer, CardSerializer, ReviewSerializer
+from api.models import Deck, Card, DataVersion, PendingReview, Review, ReviewSummary, Tombstone, apply_pending_reviews, card_content_hash, rebuild_scheduling
+from api import archive, response_cache, scheduler, views
+from api.management.commands import benchmark
+from api.authentication import USER_CACHE_SETTINGS, user_cache, user_cache_key
+from api.cache import LRUCache
+from api.imports import import_cards, read_rows
+from api.middleware import InstrumentationMiddleware, query_shape, repeated_queries
+from api.pagination import ReviewPagination
+from api.response_cache import LocalResponseCache, SharedResponseCache, invalidate_responses
+from api.search import fts5_query, search_terms, tsquery
+from api.study import STUDY_SESSION_SETTINGS
+from api.versions import data_changed, get_data_version
+from api import parsers, renderers
+from api.serializers import UserSerializer, DeckSerializer, CardSerializer, ReviewSerializer, StudyCardSerializer, SyncCardSerializer
 
+from rest_framework import serializers
+from rest_framework.renderers import JSONRenderer
 from rest_framework.test import APIClient
+from base64 import b64decode, b64encode
+from collections import OrderedDict
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
+from urllib.parse import parse_qs, urlencode, urlparse
+import csv
+import gzip
 import json
+import msgpack
+import os
+import random
+import tempfile
+import threading
+
+
+def run_commit_hooks():
+    # TestCase never commits, so the on_commit callbacks of the writes made
+    # so far are run here instead.
+    callbacks, connection.run_on_commit = connection.run_on_commit, []
+    for _, callback in callbacks:
+        callback()
 
 
 class CardModelTestCase(TestCase):
@@ -21,10 +62,10 @@ class CardModelTestCase(TestCase):
             front="front3", back="back2", deck=self.deck, interval=30)
 
     def test_if_default_last_review_date_is_empty(self):
-        self.assertEqual(self.card1.last_review_date(), None)
+        self.assertEqual(self.card1.last_review_date, None)
 
     def test_if_default_times_reviewed_is_zero(self):
-        self.assertEqual(self.card1.times_reviewed(), 0)
+        self.assertEqual(self.card1.times_reviewed, 0)
 
     def test_if_new_card_is_due(self):
         self.assertEqual(self.card1.is_due, True)
@@ -50,16 +91,18 @@ class CardReviewIntegrationTestCase(TestCase):
             front="front1", back="back1", deck=self.deck)
 
     def test_if_times_reviewed_updated_after_each_review(self):
-        Review.objects.create(card=self.card, answer_quality=2)
-        self.assertEqual(self.card.times_reviewed(), 1)
-        Review.objects.create(card=self.card, answer_quality=3)
-        Review.objects.create(card=self.card, answer_quality=1)
-        self.assertEqual(self.card.times_reviewed(), 3)
+        self.card.review(2)
+        self.assertEqual(self.card.times_reviewed, 1)
+        self.card.review(3)
+        self.card.review(1)
+        self.assertEqual(self.card.times_reviewed, 3)
 
     def test_if_last_review_date_equals_last_review_date(self):
         review1 = Review.objects.create(card=self.card, answer_quality=2)
+        self.card.review(review1.answer_quality, review1.review_date)
         review2 = Review.objects.create(card=self.card, answer_quality=4)
-        self.assertEqual(self.card.last_review_date(),
+        self.card.review(review2.answer_quality, review2.review_date)
+        self.assertEqual(self.card.last_review_date,
                          review2.review_date)
 
     def test_if_easiness_factor_not_updated_until_third_review(self):
@@ -81,6 +124,13 @@ class CardReviewIntegrationTestCase(TestCase):
         self.card.review(review.answer_quality)
         self.assertEqual(self.card.is_due, False)
 
+    def test_if_next_due_date_follows_interval(self):
+        review = Review.objects.create(card=self.card, answer_quality=4)
+        self.card.review(review.answer_quality, review.review_date)
+        self.card.review(review.answer_quality, review.review_date)
+        self.assertEqual(self.card.next_due_at,
+                         review.review_date + timedelta(days=6))
+
 
 class DeckCardIntegrationTestCase(TestCase):
     def setUp(self):
@@ -117,15 +167,29 @@ class DeckSerializerTestCase(TestCase):
         self.deck = Deck.objects.create(name="deck1", user=self.user)
 
     def test_if_deck_serializer_produce_desired_output(self):
-        serializer = DeckSerializer(self.deck)
+        deck = Deck.objects.with_card_counts().get(pk=self.deck.id)
+        serializer = DeckSerializer(deck)
         desired_output = {
             "id": self.deck.id,
             "name": "deck1",
             "user": self.user.id,
-            "cards": []
+            "card_count": 0,
+            "due_count": 0,
+            "new_count": 0
         }
         self.assertEqual(serializer.data, desired_output)
 
+    def test_if_deck_counts_cards_by_state(self):
+        Card.objects.create(front="front1", back="back1", deck=self.deck)
+        reviewed = Card.objects.create(front="front2", back="back2",
+                                       deck=self.deck)
+        reviewed.review(4)
+        reviewed.save()
+        deck = Deck.objects.with_card_counts().get(pk=self.deck.id)
+        self.assertEqual(deck.card_count, 2)
+        self.assertEqual(deck.due_count, 1)
+        self.assertEqual(deck.new_count, 1)
+
 
 class CardSerializerTestCase(TestCase):
     def setUp(self):
@@ -145,6 +209,15 @@ class CardSerializerTestCase(TestCase):
         }
         self.assertEqual(serializer.data, desired_output)
 
+    def test_if_serializing_cards_does_not_query_reviews(self):
+        for i in range(10):
+            card = Card.objects.create(
+                front="front %d" % i, back="back", deck=self.deck)
+            Review.objects.create(card=card, answer_quality=3)
+        cards = list(Card.objects.all())
+        with self.assertNumQueries(0):
+            CardSerializer(cards, many=True).data
+
 
 class ReviewSerializerTestCase(TestCase):
     def setUp(self):
@@ -225,6 +298,33 @@ class DeckViewsTestCase(TestCase):
         response = self.client.get('/decks/')
         self.assertEqual(response.status_code, 200)
 
+    def test_listing_decks_uses_one_query(self):
+        for i in range(20):
+            Card.objects.create(front="front %d" % i, back="back",
+                                deck=self.deck1)
+        # The first read also looks up the due boundary of the data version.
+        self.client.get('/decks/')
+        invalidate_responses(self.user1.pk)
+        # The other query reads the data version.
+        with self.assertNumQueries(2):
+            response = self.client.get('/decks/')
+        response_dict = json.loads((response.content).decode('utf-8'))
+        card_counts = dict((deck['id'], deck['card_count'])
+                           for deck in response_dict['results'])
+        self.assertEqual(card_counts, {self.deck1.id: 20, self.deck2.id: 0})
+
+    def test_getting_cards_of_deck(self):
+        cards = [Card.objects.create(front="front %d" % i, back="back",
+                                     deck=self.deck1)
+                 for i in range(3)]
+        response = self.client.get(
+            '/decks/' + str(self.deck1.id) + '/cards/?page_size=2')
+        self.assertEqual(response.status_code, 200)
+        response_dict = json.loads((response.content).decode('utf-8'))
+        self.assertEqual([card['id'] for card in response_dict['results']],
+                         [card.id for card in cards[:2]])
+        self.assertIsNotNone(response_dict['next'])
+
     def test_getting_one_deck(self):
         response = self.client.get('/decks/' + str(self.deck1.id) + '/')
         self.assertEqual(response.status_code, 200)
@@ -327,6 +427,45 @@ class ReviewViewsTestCase(TestCase):
         response = self.client.get('/reviews/')
         self.assertEqual(response.status_code, 200)
 
+    def test_reviews_are_paginated_newest_first(self):
+        response = self.client.get('/reviews/?page_size=2')
+        self.assertEqual(response.status_code, 200)
+        response_dict = json.loads((response.content).decode('utf-8'))
+        self.assertEqual([review['id'] for review in response_dict['results']],
+                         [self.review21.id, self.review12.id])
+
+        response = self.client.get(response_dict['next'])
+        response_dict = json.loads((response.content).decode('utf-8'))
+        self.assertEqual([review['id'] for review in response_dict['results']],
+                         [self.review11.id])
+        self.assertIsNone(response_dict['next'])
+
+    def test_reviews_given_at_once_are_all_paged(self):
+        reviewed_at = timezone.now()
+        Review.objects.bulk_create([
+            Review(card=self.card3, answer_quality=3, review_date=reviewed_at)
+            for i in range(1600)])
+        ids = []
+        url = '/reviews/?page_size=500'
+        # Bounded, as a cursor that stops advancing returns the same page.
+        for page in range(10):
+            response_dict = json.loads(
+                self.client.get(url).content.decode('utf-8'))
+            ids += [review['id'] for review in response_dict['results']]
+            url = response_dict['next']
+            if url is None:
+                break
+        self.assertEqual(len(ids), len(set(ids)))
+        self.assertEqual(len(ids), Review.objects.count())
+
+    def test_page_size_is_capped(self):
+        for i in range(3):
+            Review.objects.create(card=self.card3, answer_quality=3)
+        with mock.patch.object(ReviewPagination, 'max_page_size', 4):
+            response = self.client.get('/reviews/?page_size=100')
+        response_dict = json.loads((response.content).decode('utf-8'))
+        self.assertEqual(len(response_dict['results']), 4)
+
     def test_getting_card(self):
         response = self.client.get('/reviews/' + str(self.review21.id) + '/')
         self.assertEqual(response.status_code, 200)
@@ -367,4 +506,1869 @@ class ReviewViewsTestCase(TestCase):
         response_dict = json.loads((response.content).decode('utf-8'))
         self.assertEqual(response_dict['is_due'], False)
 
+        card = Card.objects.get(pk=self.card3.id)
+        self.assertEqual(card.times_reviewed, 1)
+        self.assertEqual(card.last_review_date, review22.review_date)
+
+
+
+
+class DueCardsViewsTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="user1")
+        self.deck1 = Deck.objects.create(name="deck1", user=self.user)
+        self.deck2 = Deck.objects.create(name="deck2", user=self.user)
+        tomorrow = timezone.now() + timedelta(days=1)
+        self.due_cards = [
+            Card.objects.create(front="front" + str(i), back="back",
+                                deck=self.deck1)
+            for i in range(5)
+        ]
+        self.other_deck_card = Card.objects.create(
+            front="front5", back="back", deck=self.deck2)
+        self.not_due_card = Card.objects.create(
+            front="front6", back="back", deck=self.deck1,
+            next_due_at=tomorrow)
+        other_user = User.objects.create(username="user2")
+        other_deck = Deck.objects.create(name="deck3", user=other_user)
+        Card.objects.create(front="front7", back="back", deck=other_deck)
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def get_ids(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        response_dict = json.loads((response.content).decode('utf-8'))
+        return [card['id'] for card in response_dict['results']], response_dict
+
+    def decoded_cursor(self, url):
+        cursor = parse_qs(urlparse(url).query)['cursor'][0]
+        return b64decode(cursor).decode('ascii')
+
+    def test_getting_due_cards(self):
+        ids, _ = self.get_ids('/cards/due/')
+        expected = [card.id for card in self.due_cards]
+        expected.append(self.other_deck_card.id)
+        self.assertEqual(ids, expected)
+
+    def test_getting_due_cards_of_one_deck(self):
+        ids, _ = self.get_ids('/cards/due/?deck=' + str(self.deck2.id))
+        self.assertEqual(ids, [self.other_deck_card.id])
+
+    def test_due_cards_are_paginated_by_cursor(self):
+        ids, page = self.get_ids('/cards/due/?deck=' + str(self.deck1.id) +
+                                 '&page_size=2')
+        pages = [ids]
+        while page['next']:
+            ids, page = self.get_ids(page['next'])
+            pages.append(ids)
+        self.assertEqual([len(ids) for ids in pages], [2, 2, 1])
+        self.assertEqual(sum(pages, []),
+                         [card.id for card in self.due_cards])
+
+    def test_due_cards_due_at_once_are_paged_by_id(self):
+        due_at = timezone.now() - timedelta(days=1)
+        Card.objects.filter(deck=self.deck1).update(next_due_at=due_at)
+        ids, page = self.get_ids('/cards/due/?deck=' + str(self.deck1.id) +
+                                 '&page_size=2')
+        self.assertNotIn('o=', self.decoded_cursor(page['next']))
+        ids, page = self.get_ids(page['next'])
+        self.assertEqual(ids, [card.id for card in self.due_cards[2:4]])
+        ids, _ = self.get_ids(page['previous'])
+        self.assertEqual(ids, [card.id for card in self.due_cards[:2]])
+
+    def test_rejecting_invalid_due_cursor(self):
+        for position in ['x', '["1"]', '["yesterday", "1"]']:
+            cursor = b64encode(urlencode({'p': position}).encode('ascii'))
+            response = self.client.get('/cards/due/?cursor=' +
+                                       cursor.decode('ascii'))
+            self.assertEqual(response.status_code, 404)
+
+    def test_rejecting_invalid_deck_filter(self):
+        response = self.client.get('/cards/due/?deck=abc')
+        self.assertEqual(response.status_code, 400)
+
+
+class BulkReviewViewsTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="user1")
+        self.deck = Deck.objects.create(name="deck1", user=self.user)
+        self.cards = [
+            Card.objects.create(front="front" + str(i), back="back",
+                                deck=self.deck)
+            for i in range(10)
+        ]
+        other_user = User.objects.create(username="user2")
+        other_deck = Deck.objects.create(name="deck2", user=other_user)
+        self.other_card = Card.objects.create(
+            front="front", back="back", deck=other_deck)
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        data_changed(self.user.pk)
+
+    def post_reviews(self, entries):
+        return self.client.post('/reviews/bulk/',
+                                content_type='application/json',
+                                data=json.dumps(entries))
+
+    def test_bulk_reviews_replay_like_single_reviews(self):
+        reviewed_at = timezone.now() - timedelta(days=3)
+        entries = [
+            {"card": self.cards[0].id, "answer_quality": quality,
+             "reviewed_at": (reviewed_at + timedelta(hours=i)).isoformat()}
+            for i, quality in enumerate([5, 4, 3, 1])
+        ]
+        response = self.post_reviews(entries)
+        self.assertEqual(response.status_code, 200)
+
+        expected = Card(interval=0, easiness_factor=2.5)
+        for i, quality in enumerate([5, 4, 3, 1]):
+            expected.review(quality, reviewed_at + timedelta(hours=i))
+        card = Card.objects.get(pk=self.cards[0].id)
+        for field in Card.SCHEDULING_FIELDS:
+            self.assertEqual(getattr(card, field), getattr(expected, field))
+        self.assertEqual(card.reviews.count(), 4)
+        self.assertEqual(card.reviews.all()[0].review_date,
+                         reviewed_at + timedelta(hours=3))
+
+    def test_bulk_reviews_use_fixed_number_of_queries(self):
+        with CaptureQueriesContext(connection) as small_batch:
+            self.post_reviews([
+                {"card": card.id, "answer_quality": 3}
+                for card in self.cards[:2]
+            ])
+        with CaptureQueriesContext(connection) as large_batch:
+            self.post_reviews([
+                {"card": card.id, "answer_quality": 3}
+                for card in self.cards * 3
+            ])
+        self.assertEqual(len(small_batch), len(large_batch))
+        self.assertEqual(Review.objects.count(), 32)
+
+    def test_bulk_reviews_reject_cards_of_other_users(self):
+        response = self.post_reviews([
+            {"card": self.cards[0].id, "answer_quality": 3},
+            {"card": self.other_card.id, "answer_quality": 3},
+        ])
+        self.assertEqual(response.status_code, 400)
+        response_list = json.loads((response.content).decode('utf-8'))
+        self.assertEqual(response_list[0], {})
+        self.assertIn('card', response_list[1])
+        self.assertEqual(Review.objects.count(), 0)
+
+    def test_bulk_reviews_validate_answer_quality(self):
+        response = self.post_reviews([
+            {"card": self.cards[0].id, "answer_quality": 6},
+        ])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Review.objects.count(), 0)
+
+    def test_bulk_reviews_are_limited(self):
+        entries = [{"card": self.cards[0].id, "answer_quality": 3}] * 3
+        with mock.patch.object(views, 'BULK_REVIEW_LIMIT', 2):
+            response = self.post_reviews(entries)
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(self.post_reviews(entries[:2]).status_code,
+                             200)
+        self.assertEqual(Review.objects.count(), 2)
+
+
+class ReviewWritePathTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="user1")
+        self.deck = Deck.objects.create(name="deck1", user=self.user)
+        self.card = Card.objects.create(
+            front="front1", back="back1", deck=self.deck)
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        data_changed(self.user.pk)
+
+    def post_review(self, card_id, answer_quality):
+        return self.client.post('/reviews/', content_type='application/json',
+                                data=json.dumps({"card": card_id,
+                                                 "answer_quality": answer_quality}))
+
+    def test_review_uses_fixed_number_of_queries(self):
+        for answer_quality in [4, 3, 2, 5]:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.post_review(self.card.id, answer_quality)
+                run_commit_hooks()
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(
+                len([query for query in queries.captured_queries
+                     if 'SAVEPOINT' not in query['sql']]), 5)
+
+    def test_review_updates_only_scheduling_columns(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.post_review(self.card.id, 4)
+        update = [query['sql'] for query in queries.captured_queries
+                  if query['sql'].startswith('UPDATE')][0]
+        self.assertIn('next_due_at', update)
+        self.assertNotIn('front', update)
+
+    def test_review_of_other_users_card_is_rejected(self):
+        other_user = User.objects.create(username="user2")
+        other_deck = Deck.objects.create(name="deck2", user=other_user)
+        other_card = Card.objects.create(
+            front="front2", back="back2", deck=other_deck)
+        response = self.post_review(other_card.id, 4)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Review.objects.count(), 0)
+
+    def test_deleting_a_review_replays_its_card(self):
+        first = self.post_review(self.card.id, 4).data
+        self.post_review(self.card.id, 5)
+        card = Card.objects.get(pk=self.card.id)
+        self.assertEqual(card.times_reviewed, 2)
+        self.client.delete('/reviews/%d/' % Review.objects.latest('id').id)
+        card.refresh_from_db()
+        self.assertEqual(card.times_reviewed, 1)
+        self.assertEqual(card.interval, 1)
+        self.assertEqual(card.last_review_date.strftime(
+            "%Y-%m-%dT%H:%M:%S.%fZ"), first['review_date'])
+        self.client.delete('/reviews/%d/' % first['id'])
+        card.refresh_from_db()
+        self.assertEqual(card.times_reviewed, 0)
+        self.assertIsNone(card.last_review_date)
+        self.assertEqual(card.next_due_at, card.creation_date)
+
+    def test_updating_a_review_replays_both_cards(self):
+        other = Card.objects.create(front="front2", back="back2",
+                                    deck=self.deck)
+        review = self.post_review(self.card.id, 4).data
+        response = self.client.put(
+            '/reviews/%d/' % review['id'],
+            {"card": other.id, "answer_quality": 3}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Card.objects.get(pk=self.card.id).times_reviewed, 0)
+        other.refresh_from_db()
+        self.assertEqual(other.times_reviewed, 1)
+        self.assertIsNotNone(other.last_review_date)
+
+        foreign_card = Card.objects.create(
+            front="front3", back="back3", deck=Deck.objects.create(
+                name="deck2", user=User.objects.create(username="user2")))
+        response = self.client.patch('/reviews/%d/' % review['id'],
+                                     {"card": foreign_card.id}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Review.objects.get(pk=review['id']).card_id,
+                         other.id)
+
+
+@skipUnless(connection.features.has_select_for_update,
+            "row locks are needed to serialize concurrent reviews")
+class ConcurrentReviewTestCase(TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="user1")
+        self.deck = Deck.objects.create(name="deck1", user=self.user)
+        self.card = Card.objects.create(
+            front="front1", back="back1", deck=self.deck)
+
+    def review_card(self, statuses):
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        try:
+            response = client.post('/reviews/', content_type='application/json',
+                                   data=json.dumps({"card": self.card.id,
+                                                    "answer_quality": 4}))
+            statuses.append(response.status_code)
+        finally:
+            connection.close()
+
+    def test_concurrent_reviews_are_not_lost(self):
+        statuses = []
+        threads = [threading.Thread(target=self.review_card, args=(statuses,))
+                   for _ in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(statuses, [200] * 20)
+        card = Card.objects.get(pk=self.card.id)
+        self.assertEqual(card.times_reviewed, 20)
+        self.assertEqual(card.reviews.count(), 20)
+        self.assertEqual(card.last_review_date,
+                         card.reviews.all()[0].review_date)
+
+
+@override_settings(MEMORAY_REVIEW_OUTBOX=True)
+class ReviewOutboxTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="user1")
+        self.deck = Deck.objects.create(name="deck1", user=self.user)
+        self.card = Card.objects.create(
+            front="front1", back="back1", deck=self.deck)
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def post_review(self, card_id, answer_quality):
+        return self.client.post('/reviews/', content_type='application/json',
+                                data=json.dumps({"card": card_id,
+                                                 "answer_quality": answer_quality}))
+
+    def due_card_ids(self):
+        response = self.client.get('/cards/due/')
+        self.assertEqual(response.status_code, 200)
+        response_dict = json.loads((response.content).decode('utf-8'))
+        return [card['id'] for card in response_dict['results']]
+
+    def test_review_is_queued_and_acknowledged(self):
+        response = self.post_review(self.card.id, 4)
+        self.assertEqual(response.status_code, 202)
+        response_dict = json.loads((response.content).decode('utf-8'))
+        self.assertEqual(response_dict['card'], self.card.id)
+        self.assertEqual(response_dict['answer_quality'], 4)
+        self.assertEqual(PendingReview.objects.count(), 1)
+        self.assertEqual(Review.objects.count(), 0)
+        self.assertEqual(Card.objects.get(pk=self.card.id).times_reviewed, 0)
+
+    def test_invalid_reviews_are_rejected_synchronously(self):
+        other_user = User.objects.create(username="user2")
+        other_deck = Deck.objects.create(name="deck2", user=other_user)
+        other_card = Card.objects.create(
+            front="front2", back="back2", deck=other_deck)
+        self.assertEqual(self.post_review(other_card.id, 4).status_code, 400)
+        self.assertEqual(self.post_review(self.card.id, 6).status_code, 400)
+        self.assertEqual(PendingReview.objects.count(), 0)
+
+    def test_drain_applies_reviews_in_order(self):
+        for answer_quality in [4, 3, 2, 5]:
+            self.post_review(self.card.id, answer_quality)
+        stdout = StringIO()
+        call_command('drain_reviews', once=True, batch_size=3, stdout=stdout,
+                     stderr=StringIO())
+
+        self.assertIn("Applied 4 reviews.", stdout.getvalue())
+        self.assertEqual(PendingReview.objects.count(), 0)
+        expected = Card(deck=self.deck)
+        for review in Review.objects.order_by('review_date', 'id'):
+            expected.review(review.answer_quality, review.review_date)
+        self.assertEqual(
+            [review.answer_quality for review in
+             Review.objects.order_by('review_date', 'id')], [4, 3, 2, 5])
+        card = Card.objects.get(pk=self.card.id)
+        for field in Card.SCHEDULING_FIELDS:
+            self.assertEqual(getattr(card, field), getattr(expected, field))
+
+    def test_reviews_are_claimed_a_card_at_a_time(self):
+        other_card = Card.objects.create(
+            front="front2", back="back2", deck=self.deck)
+        for card_id in [self.card.id, other_card.id, self.card.id]:
+            self.post_review(card_id, 4)
+        applied = apply_pending_reviews(PendingReview.objects.all(), limit=1)
+        self.assertEqual([review.card_id for review in applied],
+                         [self.card.id, self.card.id])
+        self.assertEqual(
+            list(PendingReview.objects.values_list('card_id', flat=True)),
+            [other_card.id])
+
+    def test_due_queue_reads_own_writes(self):
+        self.assertEqual(self.due_card_ids(), [self.card.id])
+        self.post_review(self.card.id, 4)
+        self.assertEqual(self.due_card_ids(), [])
+        self.assertEqual(PendingReview.objects.count(), 0)
+        self.assertEqual(Card.objects.get(pk=self.card.id).times_reviewed, 1)
+
+    def test_due_queue_leaves_other_users_reviews_queued(self):
+        other_user = User.objects.create(username="user2")
+        other_deck = Deck.objects.create(name="deck2", user=other_user)
+        other_card = Card.objects.create(
+            front="front2", back="back2", deck=other_deck)
+        PendingReview.objects.create(user=other_user, card=other_card,
+                                     answer_quality=4)
+        self.due_card_ids()
+        self.assertEqual(PendingReview.objects.count(), 1)
+
+
+class SchedulerTestCase(TestCase):
+    def test_vectorized_review_matches_card_review(self):
+        rng = random.Random(0)
+        cards = [Card(interval=rng.randint(0, 400),
+                      easiness_factor=rng.choice([1.1, 1.3, 1.96, 2.18, 2.5]),
+                      times_reviewed=rng.randint(0, 5))
+                 for _ in range(500)]
+        answer_qualities = [rng.randint(0, 5) for _ in cards]
+
+        state = scheduler.review(
+            [card.interval for card in cards],
+            [card.easiness_factor for card in cards],
+            [card.times_reviewed for card in cards],
+            answer_qualities)
+
+        for card, answer_quality in zip(cards, answer_qualities):
+            card.review(answer_quality)
+        self.assertEqual(state[0].tolist(), [card.interval for card in cards])
+        self.assertEqual(state[1].tolist(),
+                         [card.easiness_factor for card in cards])
+        self.assertEqual(state[2].tolist(),
+                         [card.times_reviewed for card in cards])
+
+    def test_replay_matches_sequential_reviews(self):
+        rng = random.Random(1)
+        cards = [Card() for _ in range(50)]
+        history = [(rng.randrange(len(cards)), rng.randint(0, 5))
+                   for _ in range(2000)]
+
+        state = scheduler.replay(
+            [position for position, _ in history],
+            [answer_quality for _, answer_quality in history],
+            [0] * len(cards), [2.5] * len(cards), [0] * len(cards))
+
+        for position, answer_quality in history:
+            cards[position].review(answer_quality)
+        self.assertEqual(state[0].tolist(), [card.interval for card in cards])
+        self.assertEqual(state[1].tolist(),
+                         [card.easiness_factor for card in cards])
+        self.assertEqual(state[2].tolist(),
+                         [card.times_reviewed for card in cards])
+
+
+    def test_intervals_stop_growing(self):
+        user = User.objects.create(username="user1")
+        deck = Deck.objects.create(name="deck1", user=user)
+        card = Card.objects.create(front="front", back="back", deck=deck)
+        client = APIClient()
+        client.force_authenticate(user=user)
+        for i in range(30):
+            response = client.post(
+                '/reviews/', content_type='application/json',
+                data=json.dumps({"card": card.id, "answer_quality": 5}))
+            self.assertEqual(response.status_code, 200)
+        card.refresh_from_db()
+        self.assertEqual(card.interval, scheduler.MAX_INTERVAL)
+        expected = [getattr(card, field) for field in Card.SCHEDULING_FIELDS]
+
+        Card.objects.update(interval=0, times_reviewed=0)
+        rebuild_scheduling([card.id])
+        card.refresh_from_db()
+        self.assertEqual(
+            [getattr(card, field) for field in Card.SCHEDULING_FIELDS],
+            expected)
+
+    def test_late_reviews_are_due_at_the_last_due_date(self):
+        card = Card(interval=100, times_reviewed=5)
+        card.review(5, datetime(9998, 12, 1, tzinfo=timezone.utc))
+        self.assertEqual(card.next_due_at, scheduler.LAST_DUE_DATE)
+
+
+class RebuildSchedulesCommandTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="user1")
+        self.deck = Deck.objects.create(name="deck1", user=self.user)
+        self.cards = [
+            Card.objects.create(front="front" + str(i), back="back",
+                                deck=self.deck)
+            for i in range(7)
+        ]
+        rng = random.Random(2)
+        start = timezone.now() - timedelta(days=100)
+        for card in self.cards[:-1]:
+            for i in range(rng.randint(1, 8)):
+                review = Review.objects.create(
+                    card=card, answer_quality=rng.randint(0, 5),
+                    review_date=start + timedelta(days=i))
+                card.review(review.answer_quality, review.review_date)
+            card.save()
+        never_reviewed = self.cards[-1]
+        never_reviewed.next_due_at = never_reviewed.creation_date
+        never_reviewed.save()
+        self.expected = {
+            card.pk: [getattr(card, field) for field in Card.SCHEDULING_FIELDS]
+            for card in Card.objects.all()
+        }
+
+    def test_rebuilding_restores_scheduling_state(self):
+        Card.objects.update(interval=99, easiness_factor=1.3,
+                            times_reviewed=42, last_review_date=None)
+        call_command('rebuild_schedules', chunk_size=3, stdout=StringIO(),
+                     stderr=StringIO())
+
+        for card in Card.objects.all():
+            self.assertEqual(
+                [getattr(card, field) for field in Card.SCHEDULING_FIELDS],
+                self.expected[card.pk])
+
+    def test_dry_run_reports_changes_without_writing(self):
+        card = self.cards[0]
+        Card.objects.filter(pk=card.pk).update(interval=99)
+        stdout = StringIO()
+        call_command('rebuild_schedules', dry_run=True, stdout=stdout,
+                     stderr=StringIO())
+
+        self.assertEqual(Card.objects.get(pk=card.pk).interval, 99)
+        output = stdout.getvalue()
+        self.assertIn("card %d: interval 99 -> " % card.pk, output)
+        self.assertIn("Would change 1 of 7 cards", output)
+
+    def test_rebuild_resumes_after_checkpoint(self):
+        Card.objects.update(interval=99)
+        checkpoint = os.path.join(tempfile.mkdtemp(), 'rebuild.checkpoint')
+        with open(checkpoint, 'w') as checkpoint_file:
+            checkpoint_file.write(str(self.cards[2].pk))
+
+        call_command('rebuild_schedules', checkpoint=checkpoint, chunk_size=2,
+                     stdout=StringIO(), stderr=StringIO())
+
+        intervals = [Card.objects.get(pk=card.pk).interval
+                     for card in self.cards]
+        self.assertEqual(intervals[:3], [99, 99, 99])
+        self.assertEqual(intervals[3:],
+                         [self.expected[card.pk][0] for card in self.cards[3:]])
+        self.assertFalse(os.path.exists(checkpoint))
+
+
+class GenerateDataCommandTestCase(TestCase):
+    def test_generating_consistent_data(self):
+        stdout = StringIO()
+        call_command('generate_data', users=3, decks_per_user=2,
+                     cards_per_deck=4, reviews_per_card=5, chunk_size=2,
+                     seed=1, stdout=stdout, stderr=StringIO())
+
+        self.assertEqual(User.objects.count(), 3)
+        self.assertEqual(Deck.objects.count(), 6)
+        self.assertEqual(Card.objects.count(), 24)
+        self.assertTrue(Review.objects.exists())
+        self.assertIn("Created 3 users, 6 decks, 24 cards and %d reviews." %
+                      Review.objects.count(), stdout.getvalue())
+        self.assertTrue(User.objects.get(username="user0")
+                        .check_password("password"))
+        for card in Card.objects.filter(times_reviewed=0):
+            self.assertEqual(card.next_due_at, card.creation_date)
+
+        # The stored scheduling state is what the histories replay to.
+        stdout = StringIO()
+        call_command('rebuild_schedules', dry_run=True, stdout=stdout,
+                     stderr=StringIO())
+        self.assertIn("Would change 0 of 24 cards", stdout.getvalue())
+
+    def test_refusing_existing_usernames(self):
+        User.objects.create(username="user1")
+        with self.assertRaises(CommandError):
+            call_command('generate_data', users=2, stdout=StringIO(),
+                         stderr=StringIO())
+        call_command('generate_data', users=2, first=2, cards_per_deck=1,
+                     stdout=StringIO(), stderr=StringIO())
+        self.assertEqual(
+            sorted(User.objects.values_list('username', flat=True)),
+            ["user1", "user2", "user3"])
+
+
+class BenchmarkCommandTestCase(TransactionTestCase):
+    # Inside TestCase every atomic block adds savepoint queries, which
+    # would count against the budgets.
+    def setUp(self):
+        user_cache.clear()
+        call_command('generate_data', users=2, decks_per_user=2,
+                     cards_per_deck=5, reviews_per_card=3, seed=1,
+                     stdout=StringIO(), stderr=StringIO())
+
+    def test_benchmark_drives_every_endpoint_within_budget(self):
+        counts = [Deck.objects.count(), Card.objects.count(),
+                  Review.objects.count(), Tombstone.objects.count()]
+        stdout = StringIO()
+        call_command('benchmark', iterations=2, stdout=stdout)
+
+        lines = stdout.getvalue().splitlines()
+        self.assertEqual([line.split()[0] for line in lines[1:]],
+                         [name for name, _, _, _ in benchmark.ENDPOINTS])
+        self.assertEqual(counts, [Deck.objects.count(), Card.objects.count(),
+                                  Review.objects.count(),
+                                  Tombstone.objects.count()])
+
+    def test_benchmark_fails_over_budget(self):
+        endpoints = [endpoint if endpoint[0] != 'cards-list' else
+                     endpoint[:3] + (3,) for endpoint in benchmark.ENDPOINTS]
+        with mock.patch.object(benchmark, 'ENDPOINTS', endpoints), \
+                self.assertRaisesRegex(CommandError, r"cards-list \(4 > 3\)"):
+            call_command('benchmark', iterations=1, stdout=StringIO())
+
+
+class DeckImportViewsTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="user1")
+        self.deck = Deck.objects.create(name="deck1", user=self.user)
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def post_file(self, content, content_type, deck=None):
+        deck = deck or self.deck
+        if not isinstance(content, bytes):
+            content = content.encode('utf-8')
+        return self.client.post('/decks/' + str(deck.id) + '/import/',
+                                content_type=content_type, data=content)
+
+    def test_importing_csv(self):
+        content = "front,back\nhund,dog\n\"katze, die\",cat\n"
+        response = self.post_file(content, 'text/csv')
+        self.assertEqual(response.status_code, 200)
+        response_dict = json.loads((response.content).decode('utf-8'))
+        self.assertEqual(response_dict,
+                         {"created": 2, "duplicates": 0, "errors": []})
+        self.assertEqual(
+            list(self.deck.cards.order_by('id').values_list('front', 'back')),
+            [("hund", "dog"), ("katze, die", "cat")])
+
+    def test_importing_jsonl_reports_invalid_rows(self):
+        content = "\n".join([
+            json.dumps({"front": "hund", "back": "dog"}),
+            "not json",
+            json.dumps({"front": "x" * 201, "back": "long"}),
+            json.dumps({"front": "katze"}),
+            json.dumps(["front", "back"]),
+            json.dumps({"front": "maus", "back": "mouse"}),
+        ])
+        response = self.post_file(content, 'application/x-ndjson')
+        self.assertEqual(response.status_code, 200)
+        response_dict = json.loads((response.content).decode('utf-8'))
+        self.assertEqual(response_dict['created'], 2)
+        self.assertEqual([error['row'] for error in response_dict['errors']],
+                         [2, 3, 4, 5])
+        self.assertIn('front', response_dict['errors'][1]['errors'])
+        self.assertIn('back', response_dict['errors'][2]['errors'])
+
+    def test_importing_in_chunks(self):
+        content = "front,back\n" + "".join(
+            "front%d,back%d\n" % (i, i) for i in range(25))
+        rows = read_rows(BytesIO(content.encode('utf-8')), 'text/csv')
+        with CaptureQueriesContext(connection) as queries:
+            report = import_cards(self.deck, rows, chunk_size=10)
+        self.assertEqual(report, {"created": 25, "duplicates": 0, "errors": []})
+        self.assertEqual(self.deck.cards.count(), 25)
+        inserts = [query for query in queries.captured_queries
+                   if query['sql'].startswith('INSERT')]
+        self.assertEqual(len(inserts), 3)
+
+    def test_invalid_utf8_is_reported_per_row(self):
+        content = (b'front,back\nhund,dog\n\xff\xfe,cat\n'
+                   b'"maus\n\xff",x\nkuh,cow\n')
+        response = self.post_file(content, 'text/csv')
+        self.assertEqual(response.status_code, 200)
+        response_dict = json.loads((response.content).decode('utf-8'))
+        self.assertEqual(response_dict['created'], 2)
+        self.assertEqual(response_dict['errors'], [
+            {"row": 3, "errors": {"non_field_errors": ["Invalid UTF-8."]}},
+            {"row": 5, "errors": {"non_field_errors": ["Invalid UTF-8."]}},
+        ])
+        response = self.post_file(b'\xff\xfe\n{"front": "a", "back": "b"}',
+                                  'application/x-ndjson')
+        response_dict = json.loads((response.content).decode('utf-8'))
+        self.assertEqual(response_dict['created'], 1)
+        self.assertEqual([error['row'] for error in response_dict['errors']],
+                         [1])
+
+    def test_rejecting_unsupported_format(self):
+        response = self.post_file("front,back", 'text/plain')
+        self.assertEqual(response.status_code, 415)
+
+    def test_importing_into_other_users_deck(self):
+        other_user = User.objects.create(username="user2")
+        other_deck = Deck.objects.create(name="deck2", user=other_user)
+        response = self.post_file("front,back\na,b\n", 'text/csv',
+                                  deck=other_deck)
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(other_deck.cards.count(), 0)
+
+
+class DeckExportViewsTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="user1")
+        self.deck = Deck.objects.create(name="deck1", user=self.user)
+        self.cards = [
+            Card.objects.create(front="front" + str(i), back="back" + str(i),
+                                deck=self.deck)
+            for i in range(3)
+        ]
+        for answer_quality in [3, 5]:
+            review = Review.objects.create(card=self.cards[1],
+                                           answer_quality=answer_quality)
+            self.cards[1].review(review.answer_quality, review.review_date)
+        self.cards[1].save()
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def export(self, query='', **extra):
+        response = self.client.get(
+            '/decks/' + str(self.deck.id) + '/export/' + query, **extra)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return response, b''.join(response.streaming_content).decode('utf-8')
+
+    def test_exporting_jsonl(self):
+        response, content = self.export()
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        cards = [json.loads(line) for line in content.splitlines()]
+        self.assertEqual([card['front'] for card in cards],
+                         ["front0", "front1", "front2"])
+        self.assertEqual(cards[1]['times_reviewed'], 2)
+        self.assertNotIn('reviews', cards[1])
+
+    def test_exporting_jsonl_with_reviews(self):
+        response, content = self.export('?reviews=true')
+        cards = [json.loads(line) for line in content.splitlines()]
+        self.assertEqual([len(card['reviews']) for card in cards], [0, 2, 0])
+        self.assertEqual(
+            [review['answer_quality'] for review in cards[1]['reviews']],
+            [3, 5])
+
+    def test_exporting_csv_with_reviews(self):
+        response, content = self.export('?reviews=1', HTTP_ACCEPT='text/csv')
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        rows = list(csv.DictReader(StringIO(content)))
+        self.assertEqual([row['front'] for row in rows],
+                         ["front0", "front1", "front1", "front2"])
+        self.assertEqual([row['answer_quality'] for row in rows],
+                         ["", "3", "5", ""])
+
+    def test_exported_csv_can_be_imported(self):
+        response, content = self.export('?format=csv')
+        other_deck = Deck.objects.create(name="deck2", user=self.user)
+        response = self.client.post(
+            '/decks/' + str(other_deck.id) + '/import/',
+            content_type='text/csv', data=content.encode('utf-8'))
+        response_dict = json.loads((response.content).decode('utf-8'))
+        self.assertEqual(response_dict['created'], 3)
+
+    def test_export_query_count_does_not_grow_with_deck(self):
+        with CaptureQueriesContext(connection) as small_deck:
+            self.export('?reviews=1')
+        for i in range(20):
+            card = Card.objects.create(front="front %d" % i, back="back",
+                                       deck=self.deck)
+            Review.objects.create(card=card, answer_quality=4)
+        with CaptureQueriesContext(connection) as large_deck:
+            self.export('?reviews=1')
+        self.assertEqual(len(small_deck), len(large_deck))
+
+
+class QueryPlanTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="user1")
+        self.deck = Deck.objects.create(name="deck1", user=self.user)
+        self.card = Card.objects.create(
+            front="front1", back="back1", deck=self.deck)
+        Review.objects.create(card=self.card, answer_quality=4)
+
+    def query_plan(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            if connection.vendor == 'sqlite':
+                cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            else:
+                # The test tables are tiny, so make the planner show which
+                # index it would use instead of scanning them.
+                cursor.execute('SET LOCAL enable_seqscan = off')
+                cursor.execute('EXPLAIN ' + sql, params)
+            return '\n'.join(str(row) for row in cursor.fetchall())
+
+    def viewset_queryset(self, viewset_class):
+        viewset = viewset_class()
+        viewset.request = mock.Mock(user=self.user)
+        viewset.action = 'list'
+        return viewset.get_queryset()
+
+    def test_viewsets_scope_by_join_instead_of_subqueries(self):
+        for viewset_class in [views.DeckViewSet, views.CardViewSet,
+                              views.ReviewViewSet]:
+            sql = str(self.viewset_queryset(viewset_class).query)
+            self.assertNotIn('(SELECT', sql)
+
+    def test_card_history_uses_card_date_index(self):
+        reviews = Review.objects.filter(card=self.card).order_by('-review_date')
+        self.assertIn('api_review_card_date_idx', self.query_plan(reviews))
+
+    def test_user_reviews_are_joined_through_card_index(self):
+        # Either review index leading with the card serves the join.
+        reviews = self.viewset_queryset(views.ReviewViewSet)
+        self.assertRegex(self.query_plan(reviews),
+                         'api_review_card_(date|updated)_idx')
+
+    def test_due_cards_use_deck_due_index(self):
+        cards = self.viewset_queryset(views.CardViewSet).filter(
+            next_due_at__lte=timezone.now())
+        self.assertIn('api_card_deck_due_sched_idx', self.query_plan(cards))
+
+
+class CachedAuthenticationTestCase(TestCase):
+    def setUp(self):
+        user_cache.clear()
+        cache.clear()
+        self.user = User(username="user1")
+        self.user.set_password("password1")
+        self.user.save()
+        self.client = APIClient()
+        response = self.client.post(
+            '/memoray-auth/', content_type='application/json',
+            data=json.dumps({"username": "user1", "password": "password1"}))
+        token = json.loads((response.content).decode('utf-8'))['token']
+        self.client.credentials(HTTP_AUTHORIZATION='JWT ' + token)
+
+    def user_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        return response, [query for query in queries.captured_queries
+                          if 'FROM "auth_user"' in query['sql'] and
+                          '"auth_user"."username"' in query['sql']]
+
+    def test_user_is_loaded_once_per_process(self):
+        response, queries = self.user_queries('/decks/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(queries), 1)
+        response, queries = self.user_queries('/decks/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(queries), 0)
+
+    def test_password_change_invalidates_cached_user(self):
+        self.user_queries('/decks/')
+        response = self.client.patch(
+            '/users/' + str(self.user.id) + '/',
+            content_type='application/json',
+            data='{"password": "new_password"}')
+        self.assertEqual(response.status_code, 201)
+        response, queries = self.user_queries('/decks/')
+        self.assertEqual(len(queries), 1)
+
+    def test_deleted_user_is_not_authenticated_from_cache(self):
+        self.user_queries('/decks/')
+        response = self.client.delete('/users/' + str(self.user.id) + '/')
+        self.assertEqual(response.status_code, 204)
+        response, queries = self.user_queries('/decks/')
+        self.assertEqual(response.status_code, 401)
+
+    def test_users_are_shared_through_cache_backend(self):
+        with mock.patch.dict(USER_CACHE_SETTINGS, {'SHARED_CACHE': 'default'}):
+            self.user_queries('/decks/')
+            user_cache.clear()
+            response, queries = self.user_queries('/decks/')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(queries), 0)
+            # Another worker saving the user only reaches the shared cache.
+            cache.delete(user_cache_key(self.user.username))
+            response, queries = self.user_queries('/decks/')
+            self.assertEqual(len(queries), 1)
+
+
+class SyncViewsTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="user1")
+        self.deck = Deck.objects.create(name="deck1", user=self.user)
+        self.card1 = Card.objects.create(
+            front="front1", back="back1", deck=self.deck)
+        self.card2 = Card.objects.create(
+            front="front2", back="back2", deck=self.deck)
+        other_user = User.objects.create(username="user2")
+        other_deck = Deck.objects.create(name="deck2", user=other_user)
+        Card.objects.create(front="front3", back="back3", deck=other_deck)
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def sync(self, cursor=None):
+        url = '/sync/' if cursor is None else '/sync/?since=' + cursor
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return json.loads((response.content).decode('utf-8'))
+
+    def age_rows(self):
+        # Move everything written so far out of the cursor overlap window.
+        past = timezone.now() - timedelta(minutes=1)
+        Deck.objects.update(updated_at=past)
+        Card.objects.update(updated_at=past)
+        Review.objects.update(updated_at=past)
+        Tombstone.objects.update(deleted_at=past)
+
+    def test_first_sync_returns_everything(self):
+        response_dict = self.sync()
+        self.assertEqual([deck['id'] for deck in response_dict['decks']],
+                         [self.deck.id])
+        self.assertEqual(
+            sorted(card['id'] for card in response_dict['cards']),
+            [self.card1.id, self.card2.id])
+
+    def test_sync_returns_only_changes_since_cursor(self):
+        self.age_rows()
+        cursor = self.sync()['cursor']
+
+        self.client.patch('/cards/' + str(self.card1.id) + '/',
+                          content_type='application/json',
+                          data='{"front": "new_front"}')
+        self.client.post('/reviews/', content_type='application/json',
+                         data=json.dumps({"card": self.card2.id,
+                                          "answer_quality": 4}))
+        self.client.delete('/cards/' + str(self.card1.id) + '/')
+
+        response_dict = self.sync(cursor)
+        self.assertEqual(response_dict['decks'], [])
+        self.assertEqual([card['id'] for card in response_dict['cards']],
+                         [self.card2.id])
+        self.assertEqual(len(response_dict['reviews']), 1)
+        self.assertEqual(response_dict['deleted'],
+                         {"deck": [], "card": [self.card1.id], "review": []})
+
+    def test_synced_cards_carry_their_schedule(self):
+        self.age_rows()
+        cursor = self.sync()['cursor']
+        self.client.post('/reviews/', content_type='application/json',
+                         data=json.dumps({"card": self.card2.id,
+                                          "answer_quality": 4}))
+        card = Card.objects.get(pk=self.card2.id)
+        synced = self.sync(cursor)['cards'][0]
+        self.assertNotIn('is_due', synced)
+        self.assertEqual(synced['times_reviewed'], 1)
+        self.assertEqual(synced['interval'], card.interval)
+        self.assertEqual(synced['next_due_at'],
+                         serializers.DateTimeField().to_representation(
+                             card.next_due_at))
+
+    def test_synced_decks_leave_out_card_counts(self):
+        self.assertEqual(sorted(self.sync()['decks'][0]),
+                         ['id', 'name', 'user'])
+
+    def test_bulk_review_updates_are_synced(self):
+        self.age_rows()
+        cursor = self.sync()['cursor']
+        self.client.post('/reviews/bulk/', content_type='application/json',
+                         data=json.dumps([{"card": self.card1.id,
+                                           "answer_quality": 3}]))
+        response_dict = self.sync(cursor)
+        self.assertEqual([card['id'] for card in response_dict['cards']],
+                         [self.card1.id])
+
+    def test_sync_is_paged_by_time_and_id(self):
+        self.age_rows()
+        card3 = Card.objects.create(front="front4", back="back4",
+                                    deck=self.deck)
+        # Rows updated together share updated_at and are paged by id.
+        Card.objects.update(updated_at=timezone.now() - timedelta(minutes=1))
+        Tombstone.objects.create(user=self.user, model='card', object_id=99)
+        pages = []
+        cursor = None
+        with mock.patch.object(views, 'SYNC_PAGE_SIZE', 2):
+            while True:
+                response_dict = self.sync(cursor)
+                pages.append(response_dict)
+                cursor = response_dict['cursor']
+                if not response_dict['more']:
+                    break
+        self.assertEqual(len(pages), 2)
+        self.assertEqual(
+            [[card['id'] for card in page['cards']] for page in pages],
+            [[self.card1.id, self.card2.id], [card3.id]])
+        self.assertEqual([len(page['decks']) for page in pages], [1, 0])
+        self.assertEqual([page['deleted']['card'] for page in pages],
+                         [[99], []])
+        self.assertEqual(self.sync(cursor)['cards'], [])
+
+    def test_rejecting_invalid_cursor(self):
+        for cursor in ['yesterday', '1,2', '1,2.3,4.5,6.7,8.x']:
+            response = self.client.get('/sync/?since=' + cursor)
+            self.assertEqual(response.status_code, 400)
+
+
+class InstrumentationMiddlewareTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="user1")
+        deck = Deck.objects.create(name="deck1", user=self.user)
+        for i in range(3):
+            Card.objects.create(front="front %d" % i, back="back", deck=deck)
+
+    def get(self, url):
+        # The middleware chain is built by the first request of a client,
+        # so the client has to be created inside override_settings.
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        return client.get(url)
+
+    def test_disabled_by_default(self):
+        with self.assertRaises(MiddlewareNotUsed):
+            InstrumentationMiddleware(lambda request: None)
+        self.assertFalse(self.get('/cards/').has_header('Server-Timing'))
+
+    @override_settings(MEMORAY_INSTRUMENTATION=True)
+    def test_server_timing_header(self):
+        with self.assertLogs('api.instrumentation', 'INFO') as logs:
+            response = self.get('/cards/')
+        timings = dict(metric.split(';', 1) for metric
+                       in response['Server-Timing'].split(', '))
+        self.assertEqual(sorted(timings),
+                         ['db', 'render', 'total', 'view'])
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record['path'], '/cards/')
+        self.assertEqual(record['status'], 200)
+        self.assertIn('desc="%d queries"' % record['queries'], timings['db'])
+        self.assertEqual(record['repeated_queries'], [])
+
+    @override_settings(MEMORAY_INSTRUMENTATION=True,
+                       MEMORAY_N_PLUS_ONE_THRESHOLD=2)
+    def test_flags_repeated_query_shapes(self):
+        values_representation = SyncCardSerializer.values_representation
+
+        def fetch_deck_per_card(serializer, rows):
+            for row in rows:
+                Deck.objects.get(pk=row['deck'])
+            return values_representation(serializer, rows)
+
+        with self.assertLogs('api.instrumentation', 'WARNING') as logs, \
+                mock.patch.object(SyncCardSerializer,
+                                  'values_representation',
+                                  fetch_deck_per_card):
+            self.get('/sync/')
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(len(record['repeated_queries']), 1)
+        self.assertEqual(record['repeated_queries'][0]['count'], 3)
+
+    def test_query_shape(self):
+        self.assertEqual(
+            query_shape("SELECT * FROM api_card WHERE id = 12 AND "
+                        "front = 'it''s' AND deck_id IN (1, 2, 3)"),
+            "SELECT * FROM api_card WHERE id = ? AND front = ? AND "
+            "deck_id IN (...)")
+        queries = [{"sql": "SELECT 1 FROM api_deck WHERE id = %d" % i}
+                   for i in range(4)] + [{"sql": "SELECT 1"}]
+        self.assertEqual(repeated_queries(queries, 3),
+                         [{"sql": "SELECT ? FROM api_deck WHERE id = ?",
+                           "count": 4}])
+        self.assertEqual(repeated_queries(queries, 4), [])
+
+
+class StatsViewsTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username="user1")
+        self.deck1 = Deck.objects.create(name="deck1", user=self.user)
+        self.deck2 = Deck.objects.create(name="deck2", user=self.user)
+        today = timezone.localdate()
+        for i, (deck, offset) in enumerate([
+                (self.deck1, -3), (self.deck1, 0), (self.deck1, 0),
+                (self.deck2, 1), (self.deck2, 45), (self.deck2, 400)]):
+            Card.objects.create(
+                front="front %d" % i, back="back", deck=deck,
+                next_due_at=timezone.make_aware(datetime.combine(
+                    today + timedelta(days=offset), time(12))))
+        self.card = Card.objects.filter(deck=self.deck1).first()
+        for answer_quality in [5, 4, 2, 3]:
+            Review.objects.create(card=self.card,
+                                  answer_quality=answer_quality)
+        other_user = User.objects.create(username="user2")
+        other_deck = Deck.objects.create(name="deck3", user=other_user)
+        Card.objects.create(front="front", back="back", deck=other_deck)
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def stats(self, url='/stats/'):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return json.loads((response.content).decode('utf-8'))
+
+    def test_due_forecast(self):
+        response_dict = self.stats()
+        self.assertEqual(response_dict['date'],
+                         timezone.localdate().isoformat())
+        self.assertEqual(response_dict['overdue'], 1)
+        self.assertEqual(len(response_dict['due']), 30)
+        self.assertEqual(response_dict['due'][:2], [2, 1])
+        self.assertEqual(sum(response_dict['due']), 3)
+
+        due = self.stats('/stats/?days=90')['due']
+        self.assertEqual(len(due), 90)
+        self.assertEqual(due[45], 1)
+        self.assertEqual(sum(self.stats('/stats/?days=365')['due']), 4)
+
+    def test_rejecting_unsupported_range(self):
+        response = self.client.get('/stats/?days=7')
+        self.assertEqual(response.status_code, 400)
+
+    def test_deck_retention(self):
+        decks = self.stats()['decks']
+        self.assertEqual(decks, [
+            {"id": self.deck1.id, "name": "deck1", "reviews": 4,
+             "answer_quality": [0, 0, 1, 1, 1, 1], "retention": 0.75},
+            {"id": self.deck2.id, "name": "deck2", "reviews": 0,
+             "answer_quality": [0, 0, 0, 0, 0, 0], "retention": None},
+        ])
+
+    def test_stats_are_cached_until_a_review_is_written(self):
+        get_data_version(self.user)
+        with CaptureQueriesContext(connection) as queries:
+            self.stats()
+        self.assertEqual(len(queries), 5)
+        with CaptureQueriesContext(connection) as queries:
+            self.stats('/stats/?days=90')
+        self.assertEqual(len(queries), 1)
+
+        self.client.post('/reviews/', content_type='application/json',
+                         data=json.dumps({"card": self.card.id,
+                                          "answer_quality": 1}))
+        run_commit_hooks()
+        self.assertEqual(self.stats()['decks'][0]['reviews'], 5)
+
+    def test_stats_follow_the_data_version(self):
+        self.stats()
+        Review.objects.create(card=self.card, answer_quality=1)
+        self.assertEqual(self.stats()['decks'][0]['reviews'], 4)
+        # As another worker would after the write commits.
+        version = get_data_version(self.user)
+        DataVersion.objects.filter(user=self.user).update(version=version + 1)
+        self.assertEqual(self.stats()['decks'][0]['reviews'], 5)
+
+    def test_cached_stats_expire_at_midnight(self):
+        self.stats()
+        tomorrow = timezone.now() + timedelta(days=1)
+        with mock.patch('django.utils.timezone.now', return_value=tomorrow):
+            response_dict = self.stats()
+        self.assertEqual(response_dict['date'],
+                         timezone.localdate(tomorrow).isoformat())
+        self.assertEqual(response_dict['overdue'], 3)
+
+
+class ReviewCompactionTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        archive_settings = override_settings(
+            MEMORAY_REVIEW_ARCHIVE_DIR=tempfile.mkdtemp())
+        archive_settings.enable()
+        self.addCleanup(archive_settings.disable)
+
+        self.user = User.objects.create(username="user1")
+        self.deck = Deck.objects.create(name="deck1", user=self.user)
+        self.cards = [
+            Card.objects.create(front="front" + str(i), back="back",
+                                deck=self.deck)
+            for i in range(3)
+        ]
+        now = timezone.now()
+        histories = [
+            [(400, 4), (390, 3), (370, 5), (300, 2), (10, 4), (2, 5)],
+            [(20, 3), (5, 4)],
+            [(365, 1), (364, 4)],
+        ]
+        for card, history in zip(self.cards, histories):
+            for days_ago, answer_quality in history:
+                review = Review.objects.create(
+                    card=card, answer_quality=answer_quality,
+                    review_date=now - timedelta(days=days_ago))
+                card.review(review.answer_quality, review.review_date)
+            card.save()
+        self.expected = {
+            card.pk: [getattr(card, field) for field in Card.SCHEDULING_FIELDS]
+            for card in Card.objects.all()
+        }
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def compact(self, older_than=180):
+        stdout = StringIO()
+        call_command('compact_reviews', older_than=older_than, chunk_size=1,
+                     stdout=stdout)
+        return stdout.getvalue()
+
+    def exported_reviews(self):
+        response = self.client.get(
+            '/decks/' + str(self.deck.id) + '/export/?reviews=1')
+        content = b''.join(response.streaming_content).decode('utf-8')
+        return [[review['answer_quality'] for review in card['reviews']]
+                for card in map(json.loads, content.splitlines())]
+
+    def test_old_reviews_are_rolled_up(self):
+        self.assertIn("Compacted 6 reviews of 2 cards.", self.compact())
+        self.assertEqual(Review.objects.count(), 4)
+        summary = ReviewSummary.objects.get(card=self.cards[0])
+        self.assertEqual(summary.times_reviewed, 4)
+        self.assertEqual(
+            [getattr(summary, 'answer_quality_%d' % answer_quality)
+             for answer_quality in range(6)], [0, 0, 1, 1, 1, 1])
+        self.assertFalse(
+            ReviewSummary.objects.filter(card=self.cards[1]).exists())
+        self.assertIn("Compacted 0 reviews of 0 cards.", self.compact())
+
+    def test_rebuild_starts_from_summaries(self):
+        self.compact(older_than=380)
+        self.compact()
+        Card.objects.update(interval=99, easiness_factor=1.3,
+                            times_reviewed=42, last_review_date=None)
+        call_command('rebuild_schedules', stdout=StringIO(),
+                     stderr=StringIO())
+        for card in Card.objects.all():
+            self.assertEqual(
+                [getattr(card, field) for field in Card.SCHEDULING_FIELDS],
+                self.expected[card.pk])
+
+    def test_archived_history_is_exported(self):
+        before = self.exported_reviews()
+        self.compact(older_than=380)
+        self.compact()
+        self.assertEqual(self.exported_reviews(), before)
+
+    def test_archive_members_are_merged_by_card(self):
+        now = timezone.now()
+        yesterday = now - timedelta(days=1)
+        archive.append_reviews(self.user.pk, [(3, 2, now, 4), (1, 1, now, 3)])
+        # Archived again by a compaction that died before deleting them.
+        archive.append_reviews(self.user.pk, [(3, 2, now, 4),
+                                              (2, 1, yesterday, 5)])
+        self.assertEqual(list(archive.read_reviews(self.user.pk)),
+                         [(1, yesterday, 5), (1, now, 3), (2, now, 4)])
+
+    def test_member_cut_short_is_replaced(self):
+        now = timezone.now()
+        archive.append_reviews(self.user.pk, [(1, 1, now, 3)])
+        complete = os.path.getsize(archive.archive_path(self.user.pk))
+        archive.append_reviews(self.user.pk, [(2, 1, now, 4)])
+        # A compaction killed halfway through writing its member.
+        with open(archive.archive_path(self.user.pk), 'r+b') as archived:
+            archived.truncate((complete + archived.seek(0, 2)) // 2)
+        self.assertEqual(list(archive.read_reviews(self.user.pk)),
+                         [(1, now, 3)])
+        archive.append_reviews(self.user.pk, [(2, 1, now, 4)])
+        self.assertEqual(list(archive.read_reviews(self.user.pk)),
+                         [(1, now, 3), (1, now, 4)])
+
+    def test_compaction_needs_an_archive_dir(self):
+        with override_settings(MEMORAY_REVIEW_ARCHIVE_DIR=None):
+            with self.assertRaises(CommandError):
+                self.compact()
+        self.assertEqual(Review.objects.count(), 10)
+
+    def test_archived_reviews_count_in_stats(self):
+        self.compact()
+        response = self.client.get('/stats/')
+        deck = json.loads((response.content).decode('utf-8'))['decks'][0]
+        self.assertEqual(deck['reviews'], 10)
+        self.assertEqual(deck['answer_quality'], [0, 1, 1, 2, 4, 2])
+
+
+class SparseFieldsTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="user1")
+        self.deck = Deck.objects.create(name="deck1", user=self.user)
+        self.cards = [
+            Card.objects.create(front="front" + str(i), back="back",
+                                deck=self.deck)
+            for i in range(3)
+        ]
+        Card.objects.filter(pk=self.cards[2].pk).update(
+            next_due_at=timezone.now() + timedelta(days=3))
+        Review.objects.create(card=self.cards[0], answer_quality=4)
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def results(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return json.loads((response.content).decode('utf-8'))['results']
+
+    def test_selecting_fields(self):
+        self.assertEqual(self.results('/cards/?fields=id,is_due'), [
+            {"id": self.cards[0].id, "is_due": True},
+            {"id": self.cards[1].id, "is_due": True},
+            {"id": self.cards[2].id, "is_due": False},
+        ])
+        self.assertEqual(self.results('/decks/?fields=name,card_count'),
+                         [{"name": "deck1", "card_count": 3}])
+        self.assertEqual(self.results('/reviews/?fields=answer_quality'),
+                         [{"answer_quality": 4}])
+        response = self.client.get('/cards/' + str(self.cards[0].id) +
+                                   '/?fields=front')
+        self.assertEqual(json.loads((response.content).decode('utf-8')),
+                         {"front": "front0"})
+
+    def test_rejecting_unknown_fields(self):
+        response = self.client.get('/cards/?fields=id,next_due')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(json.loads((response.content).decode('utf-8')),
+                         {"fields": ["Unknown fields: next_due."]})
+
+    def test_fields_do_not_restrict_writes(self):
+        response = self.client.post(
+            '/cards/?fields=id', content_type='application/json',
+            data=json.dumps({"front": "front", "back": "back",
+                             "deck": self.deck.id}))
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Card.objects.get(pk=json.loads(
+            (response.content).decode('utf-8'))['id']).front, "front")
+
+    def test_fast_path_matches_model_serializers(self):
+        cards = CardSerializer(Card.objects.order_by('pk'), many=True).data
+        self.assertEqual(self.results('/cards/'), cards)
+        self.assertEqual(
+            self.results('/decks/' + str(self.deck.id) + '/cards/'), cards)
+        self.assertEqual(self.results('/cards/due/'), cards[:2])
+        self.assertEqual(
+            self.results('/decks/'),
+            DeckSerializer(Deck.objects.with_card_counts(), many=True).data)
+
+    def test_serializer_benchmark(self):
+        stdout = StringIO()
+        call_command('benchmark_serializers', repeat=1, stdout=stdout)
+        lines = stdout.getvalue().splitlines()
+        self.assertEqual([line.split()[:2] for line in lines[1:]],
+                         [["cards", "3"], ["decks", "1"]])
+
+
+class RenderingTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="user1")
+        self.deck = Deck.objects.create(name="deck1", user=self.user)
+        for i in range(20):
+            Card.objects.create(front="front" + str(i), back="back",
+                                deck=self.deck)
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def test_fast_json_matches_json_renderer(self):
+        data = OrderedDict([
+            ("datetime", timezone.now().replace(microsecond=123456)),
+            ("date", timezone.localdate()),
+            ("decimal", Decimal("1.50")),
+            ("text", "za\u017c\u00f3\u0142\u0107 \u2028 \u2029"),
+            ("nested", [{"id": 1, "none": None, "float": 2.5}]),
+        ])
+        expected = JSONRenderer().render(data)
+        self.assertEqual(renderers.FastJSONRenderer().render(data), expected)
+        # rapidjson only takes string keys.
+        self.assertEqual(renderers.FastJSONRenderer().render({1: "one"}),
+                         b'{"1":"one"}')
+        self.assertEqual(parsers.FastJSONParser().parse(BytesIO(expected)),
+                         json.loads(expected.decode('utf-8')))
+
+    def test_rejecting_invalid_json(self):
+        response = self.client.post('/decks/', content_type='application/json',
+                                    data='{"name": ')
+        self.assertEqual(response.status_code, 400)
+
+    def test_messagepack_is_negotiated(self):
+        response = self.client.get('/cards/', HTTP_ACCEPT='application/msgpack')
+        self.assertEqual(response['Content-Type'], 'application/msgpack')
+        expected = json.loads(
+            (self.client.get('/cards/').content).decode('utf-8'))
+        self.assertEqual(msgpack.unpackb(response.content, raw=False),
+                         expected)
+
+    def test_messagepack_request_body(self):
+        response = self.client.post(
+            '/cards/', content_type='application/msgpack',
+            data=msgpack.packb({"front": "front", "back": "back",
+                                "deck": self.deck.id}, use_bin_type=True))
+        self.assertEqual(response.status_code, 201)
+        for body in [b'\xc1', b'\x81\x80\x01']:
+            response = self.client.post(
+                '/cards/', content_type='application/msgpack', data=body)
+            self.assertEqual(response.status_code, 400)
+
+    def test_large_responses_are_compressed(self):
+        response = self.client.get('/cards/', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(
+            json.loads(gzip.decompress(response.content).decode('utf-8')),
+            json.loads((self.client.get('/cards/').content).decode('utf-8')))
+
+
+class ConditionalGetTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="user1")
+        self.deck = Deck.objects.create(name="deck1", user=self.user)
+        self.card = Card.objects.create(front="front", back="back",
+                                        deck=self.deck)
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def test_matching_etag_is_answered_without_reading_cards(self):
+        response = self.client.get('/cards/')
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/cards/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(response.content, b'')
+        self.assertFalse([query for query in queries.captured_queries
+                          if 'api_card' in query['sql']])
+
+        response = self.client.get('/cards/', HTTP_IF_NONE_MATCH='W/' + etag)
+        self.assertEqual(response.status_code, 304)
+        response = self.client.get('/cards/', HTTP_IF_NONE_MATCH='"other"')
+        self.assertEqual(response.status_code, 200)
+
+    def test_etag_depends_on_path_and_accept(self):
+        etags = set([
+            self.client.get('/cards/')['ETag'],
+            self.client.get('/cards/?page_size=1')['ETag'],
+            self.client.get('/cards/', HTTP_ACCEPT='application/msgpack')['ETag'],
+            self.client.get('/cards/%d/' % self.card.id)['ETag'],
+            self.client.get('/decks/')['ETag'],
+        ])
+        self.assertEqual(len(etags), 5)
+
+    def test_writes_change_the_etag(self):
+        etag = self.client.get('/decks/')['ETag']
+        self.client.patch('/cards/%d/' % self.card.id, {"front": "new front"},
+                          format='json')
+        run_commit_hooks()
+        response = self.client.get('/decks/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+        etag = response['ETag']
+        self.client.post('/reviews/', {"card": self.card.id,
+                                       "answer_quality": 4}, format='json')
+        run_commit_hooks()
+        response = self.client.get('/decks/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get(
+            '/decks/', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+    def test_card_becoming_due_changes_the_etag(self):
+        self.client.post('/reviews/', {"card": self.card.id,
+                                       "answer_quality": 5}, format='json')
+        etag = self.client.get('/cards/due/')['ETag']
+        self.assertEqual(self.client.get(
+            '/cards/due/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        later = timezone.now() + timedelta(days=2)
+        with mock.patch('django.utils.timezone.now', return_value=later):
+            response = self.client.get('/cards/due/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'][0]['id'], self.card.id)
+
+    def test_data_version_is_created_on_first_read(self):
+        self.assertFalse(DataVersion.objects.filter(user=self.user).exists())
+        version = get_data_version(self.user)
+        self.assertEqual(get_data_version(self.user), version)
+        data_changed(self.user.pk)
+        changed_version = get_data_version(self.user)
+        self.assertGreater(changed_version, version)
+        self.assertEqual(get_data_version(self.user), changed_version)
+
+
+class ResponseCacheTestCase(TestCase):
+    def setUp(self):
+        self.cache = LocalResponseCache(1024 * 1024, 300)
+        patcher = mock.patch.object(response_cache, 'response_cache',
+                                    self.cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = User.objects.create(username="user1")
+        self.deck = Deck.objects.create(name="deck1", user=self.user)
+        self.card = Card.objects.create(front="front", back="back",
+                                        deck=self.deck)
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def test_lru_cache_evicts_by_size(self):
+        lru = LRUCache(None, 60, max_bytes=10)
+        lru.set('a', b'12345')
+        lru.set('b', b'12345')
+        self.assertEqual(lru.get('a'), b'12345')
+        lru.set('c', b'123')
+        self.assertIsNone(lru.get('b'))
+        self.assertEqual(lru.get('a'), b'12345')
+        lru.set('d', b'12345678901')
+        self.assertIsNone(lru.get('d'))
+        self.assertEqual((lru.hits, lru.misses, lru.evictions, lru.size),
+                         (2, 2, 1, 8))
+
+    def test_repeated_list_is_served_from_cache(self):
+        response = self.client.get('/cards/')
+        with self.assertNumQueries(1):
+            cached = self.client.get('/cards/')
+        self.assertEqual(cached.status_code, 200)
+        self.assertEqual(cached.content, response.content)
+        self.assertEqual(cached['Content-Type'], response['Content-Type'])
+        self.assertEqual(cached['ETag'], response['ETag'])
+        self.assertEqual(self.cache.counters()['hits'], 1)
+
+    def test_key_covers_query_params_and_media_type(self):
+        self.client.get('/cards/?page_size=1&fields=id')
+        with self.assertNumQueries(1):
+            self.client.get('/cards/?fields=id&page_size=1')
+        response = self.client.get('/cards/?fields=front')
+        self.assertEqual(json.loads(response.content.decode('utf-8'))
+                         ['results'], [{"front": "front"}])
+        response = self.client.get('/cards/',
+                                   HTTP_ACCEPT='application/msgpack')
+        self.assertEqual(response['Content-Type'], 'application/msgpack')
+        self.assertEqual(self.cache.counters()['hits'], 1)
+
+    def test_writes_invalidate_cached_lists(self):
+        self.client.get('/decks/')
+        self.client.post('/cards/', {"front": "front2", "back": "back2",
+                                     "deck": self.deck.id}, format='json')
+        run_commit_hooks()
+        response = self.client.get('/decks/')
+        self.assertEqual(response.data['results'][0]['card_count'], 2)
+
+    def test_lists_of_other_users_are_not_shared(self):
+        self.client.get('/cards/')
+        other_user = User.objects.create(username="user2")
+        self.client.force_authenticate(user=other_user)
+        response = self.client.get('/cards/')
+        self.assertEqual(response.data['results'], [])
+
+    def test_shared_backend(self):
+        cache.clear()
+        with mock.patch.object(response_cache, 'response_cache',
+                               SharedResponseCache('default', 300)):
+            response = self.client.get('/cards/')
+            with self.assertNumQueries(1):
+                self.assertEqual(self.client.get('/cards/').content,
+                                 response.content)
+            data_changed(self.user.pk)
+            self.assertEqual(response_cache.response_cache.counters(),
+                             {"hits": 1, "misses": 1, "evictions": None})
+
+
+class DataChangeSignalsTestCase(TransactionTestCase):
+    # on_commit callbacks never run inside TestCase.
+    def setUp(self):
+        self.cache = LocalResponseCache(1024 * 1024, 300)
+        patcher = mock.patch.object(response_cache, 'response_cache',
+                                    self.cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = User.objects.create(username="user1")
+        self.deck = Deck.objects.create(name="deck1", user=self.user)
+
+    def test_saves_and_deletes_invalidate_the_owner(self):
+        generation = self.cache.generation(self.user.pk)
+        card = Card.objects.create(front="front", back="back",
+                                   deck_id=self.deck.id)
+        self.assertNotEqual(self.cache.generation(self.user.pk), generation)
+
+        generation = self.cache.generation(self.user.pk)
+        Review.objects.create(card=Card.objects.get(pk=card.pk),
+                              answer_quality=4)
+        self.assertNotEqual(self.cache.generation(self.user.pk), generation)
+
+        generation = self.cache.generation(self.user.pk)
+        Deck.objects.get(pk=self.deck.pk).delete()
+        self.assertNotEqual(self.cache.generation(self.user.pk), generation)
+
+    def test_owners_are_looked_up_once_per_transaction(self):
+        generation = self.cache.generation(self.user.pk)
+        with CaptureQueriesContext(connection) as queries:
+            with transaction.atomic():
+                for i in range(5):
+                    Card.objects.create(front="front %d" % i, back="back",
+                                        deck_id=self.deck.id)
+                self.assertEqual(self.cache.generation(self.user.pk),
+                                 generation)
+        self.assertEqual(len([query for query in queries.captured_queries
+                              if query['sql'].startswith('SELECT')]), 1)
+        self.assertNotEqual(self.cache.generation(self.user.pk), generation)
+
+    def test_orm_writes_change_the_etag(self):
+        card = Card.objects.create(front="front", back="back",
+                                   deck_id=self.deck.id)
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        etag = client.get('/cards/')['ETag']
+        card.front = "changed"
+        card.save()
+        response = client.get('/cards/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'][0]['front'], "changed")
+
+        version = get_data_version(self.user)
+        Review.objects.create(card_id=card.id, answer_quality=4)
+        self.assertGreater(get_data_version(self.user), version)
+        version = get_data_version(self.user)
+        Card.objects.get(pk=card.pk).delete()
+        self.assertGreater(get_data_version(self.user), version)
+
+    def test_rolled_back_writes_do_not_invalidate(self):
+        generation = self.cache.generation(self.user.pk)
+        try:
+            with transaction.atomic():
+                Card.objects.create(front="front", back="back",
+                                    deck_id=self.deck.id)
+                raise ValueError
+        except ValueError:
+            pass
+        self.assertEqual(self.cache.generation(self.user.pk), generation)
+
+
+class StudySessionTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="user1")
+        self.deck = Deck.objects.create(name="deck1", user=self.user)
+        self.now = timezone.now()
+        other_user = User.objects.create(username="user2")
+        other_deck = Deck.objects.create(name="deck2", user=other_user)
+        Card.objects.create(front="front", back="back", deck=other_deck)
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def create_card(self, interval=0, days_overdue=0, deck=None):
+        return Card.objects.create(
+            front="front %d" % Card.objects.count(), back="back",
+            deck=deck or self.deck,
+            interval=interval, times_reviewed=1 if interval else 0,
+            last_review_date=(self.now - timedelta(days=interval + days_overdue)
+                              if interval else None),
+            next_due_at=self.now - timedelta(days=days_overdue))
+
+    def session(self, query=''):
+        response = self.client.get('/cards/session/' + query)
+        self.assertEqual(response.status_code, 200)
+        return [card['id'] for card in response.data]
+
+    def test_reviews_are_ordered_by_overdue_ratio(self):
+        slightly_overdue = self.create_card(interval=10, days_overdue=5)
+        most_overdue = self.create_card(interval=1, days_overdue=2)
+        overdue = self.create_card(interval=6, days_overdue=9)
+        self.create_card(interval=3, days_overdue=-1)
+        with self.assertNumQueries(2):
+            ids = self.session()
+        self.assertEqual(ids, [most_overdue.id, overdue.id,
+                               slightly_overdue.id])
+
+    def test_an_interval_below_one_day_counts_as_one_day(self):
+        overdue = self.create_card(interval=2, days_overdue=3)
+        relearned = self.create_card(days_overdue=1)
+        Card.objects.filter(pk=relearned.pk).update(times_reviewed=2)
+        self.assertEqual(self.session(), [overdue.id, relearned.id])
+
+    def test_reviews_are_ranked_among_the_longest_due(self):
+        longest_due = [self.create_card(interval=10, days_overdue=20 - i)
+                       for i in range(3)]
+        self.create_card(interval=1, days_overdue=5)
+        with mock.patch.dict(STUDY_SESSION_SETTINGS, {'CANDIDATES': 3}):
+            self.assertEqual(self.session('?size=3'),
+                             [card.id for card in longest_due])
+
+    def test_new_cards_are_interleaved(self):
+        reviews = [self.create_card(interval=1, days_overdue=10 - i)
+                   for i in range(8)]
+        new_cards = [self.create_card() for i in range(5)]
+        self.assertEqual(self.session('?size=5'),
+                         [card.id for card in reviews[:4]] + [new_cards[0].id])
+        self.assertEqual(
+            self.session('?size=10'),
+            [card.id for card in reviews[:4]] + [new_cards[0].id] +
+            [card.id for card in reviews[4:8]] + [new_cards[1].id])
+
+    def test_either_kind_fills_the_session(self):
+        new_cards = [self.create_card() for i in range(3)]
+        self.assertEqual(self.session('?size=5'),
+                         [card.id for card in new_cards])
+        review = self.create_card(interval=1, days_overdue=1)
+        self.assertEqual(self.session('?size=2'),
+                         [review.id, new_cards[0].id])
+
+    def test_cards_carry_their_scheduling_state(self):
+        card = self.create_card(interval=6, days_overdue=1)
+        response = self.client.get('/cards/session/')
+        self.assertEqual(
+            set(response.data[0]),
+            set(('id', 'front', 'back', 'deck') + Card.SCHEDULING_FIELDS))
+        self.assertEqual(dict(response.data[0]),
+                         dict(StudyCardSerializer(card).data))
+
+    def test_filtering_by_deck_and_validating_parameters(self):
+        other_deck = Deck.objects.create(name="deck3", user=self.user)
+        self.create_card(interval=1, days_overdue=1)
+        card = self.create_card(interval=1, days_overdue=1, deck=other_deck)
+        self.assertEqual(self.session('?deck=%d' % other_deck.id), [card.id])
+        for query in ['?size=0', '?size=201', '?size=abc', '?deck=abc']:
+            response = self.client.get('/cards/session/' + query)
+            self.assertEqual(response.status_code, 400)
+
+
+class CardSearchTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="user1")
+        self.deck = Deck.objects.create(name="deck1", user=self.user)
+        other_user = User.objects.create(username="user2")
+        other_deck = Deck.objects.create(name="deck2", user=other_user)
+        Card.objects.create(front="house", back="dom", deck=other_deck)
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def search(self, query, path='/cards/'):
+        response = self.client.get(path + query)
+        self.assertEqual(response.status_code, 200)
+        return [card['id'] for card in response.data['results']]
+
+    def test_matches_are_ranked_and_paginated(self):
+        in_back = Card.objects.create(front="dom", back="house",
+                                      deck=self.deck)
+        in_front = Card.objects.create(front="house", back="dom",
+                                       deck=self.deck)
+        Card.objects.create(front="mouse", back="mysz", deck=self.deck)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.search('?q=house'),
+                             [in_front.id, in_back.id])
+        self.assertFalse(any(' LIKE ' in query['sql']
+                             for query in queries.captured_queries))
+        response = self.client.get('/cards/?q=house&page_size=1&page=2')
+        self.assertEqual(response.data['count'], 2)
+        self.assertEqual([card['id'] for card in response.data['results']],
+                         [in_back.id])
+
+    def test_every_word_matches_as_a_prefix(self):
+        card = Card.objects.create(front="red house", back="czerwony dom",
+                                   deck=self.deck)
+        Card.objects.create(front="red", back="czerwony", deck=self.deck)
+        self.assertEqual(self.search('?q=hou%20re'), [card.id])
+        self.assertEqual(self.search('?q=%22hou%22%20re*'), [card.id])
+        self.assertEqual(self.search('?q=%22%28*'), [])
+
+    def test_searching_within_a_deck(self):
+        other_deck = Deck.objects.create(name="deck3", user=self.user)
+        card = Card.objects.create(front="house", back="dom", deck=self.deck)
+        other = Card.objects.create(front="house", back="dom",
+                                    deck=other_deck)
+        self.assertEqual(self.search('?q=house&deck=%d' % other_deck.id),
+                         [other.id])
+        self.assertEqual(
+            self.search('?q=house', '/decks/%d/cards/' % self.deck.id),
+            [card.id])
+        response = self.client.get('/cards/?q=house&deck=abc')
+        self.assertEqual(response.status_code, 400)
+
+    def test_index_follows_updates_and_deletes(self):
+        card = Card.objects.create(front="house", back="dom", deck=self.deck)
+        deleted = Card.objects.create(front="houses", back="dom",
+                                      deck=self.deck)
+        deleted.delete()
+        self.assertEqual(self.search('?q=house'), [card.id])
+        self.client.patch('/cards/%d/' % card.id, {"front": "cat"},
+                          format='json')
+        run_commit_hooks()
+        self.assertEqual(self.search('?q=house'), [])
+        self.assertEqual(self.search('?q=cat'), [card.id])
+
+    def test_query_syntax_is_escaped(self):
+        self.assertEqual(search_terms('"red" house* -(x)'),
+                         ['red', 'house', 'x'])
+        self.assertEqual(fts5_query(['red', 'house']), '"red"* "house"*')
+        self.assertEqual(tsquery(['red', 'house']), "'red':* & 'house':*")
+
+
+class DuplicateCardsTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="user1")
+        self.deck = Deck.objects.create(name="deck1", user=self.user)
+        self.other_deck = Deck.objects.create(name="deck2", user=self.user)
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def test_content_hash_normalizes_case_and_whitespace(self):
+        self.assertEqual(card_content_hash("Der  Hund", "dog"),
+                         card_content_hash(" der hund\n", "DOG"))
+        self.assertEqual(card_content_hash("ﬁsh", "fish"),
+                         card_content_hash("fish", "fish"))
+        self.assertNotEqual(card_content_hash("a b", "c"),
+                            card_content_hash("a", "b c"))
+
+    def test_creating_and_updating_duplicates_is_rejected(self):
+        card = Card.objects.create(front="hund", back="dog", deck=self.deck)
+        response = self.client.post('/cards/', {
+            "front": "Hund ", "back": "dog", "deck": self.deck.id},
+            format='json')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post('/cards/', {
+            "front": "hund", "back": "dog", "deck": self.other_deck.id},
+            format='json')
+        self.assertEqual(response.status_code, 201)
+        other = Card.objects.create(front="katze", back="cat", deck=self.deck)
+        response = self.client.patch('/cards/%d/' % other.id,
+                                     {"front": "hund", "back": "dog"},
+                                     format='json')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.patch('/cards/%d/' % card.id,
+                                     {"front": "HUND"}, format='json')
+        self.assertEqual(response.status_code, 200)
+        card.refresh_from_db()
+        self.assertEqual(card.content_hash, card_content_hash("hund", "dog"))
+
+    def test_import_skips_duplicates_with_one_lookup_per_chunk(self):
+        Card.objects.create(front="hund", back="dog", deck=self.deck)
+        content = "front,back\nHund,dog\nkatze,cat\nkatze,cat\n" + "".join(
+            "front%d,back%d\n" % (i, i) for i in range(7))
+        rows = read_rows(BytesIO(content.encode('utf-8')), 'text/csv')
+        with CaptureQueriesContext(connection) as queries:
+            report = import_cards(self.deck, rows, chunk_size=5)
+        self.assertEqual(report, {"created": 8, "duplicates": 2, "errors": []})
+        self.assertEqual(self.deck.cards.count(), 9)
+        lookups = [query for query in queries.captured_queries
+                   if query['sql'].startswith('SELECT')]
+        self.assertEqual(len(lookups), 2)
+
+    def test_merging_decks(self):
+        Card.objects.create(front="hund", back="dog", deck=self.deck)
+        studied = Card.objects.create(front="hund", back="dog",
+                                      deck=self.other_deck)
+        for answer_quality in [3, 4, 5]:
+            Review.objects.create(card=studied, answer_quality=answer_quality)
+        Card.objects.filter(pk=studied.pk).update(times_reviewed=3)
+        kept = Card.objects.create(front="maus", back="mouse",
+                                   deck=self.deck)
+        Card.objects.create(front="maus", back="mouse", deck=self.other_deck)
+        moved = Card.objects.create(front="katze", back="cat",
+                                    deck=self.other_deck)
+        response = self.client.post(
+            '/decks/%d/merge/' % self.deck.id, {"deck": self.other_deck.id},
+            format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {"moved": 2, "duplicates": 2})
+        self.assertEqual(sorted(self.deck.cards.values_list('pk', flat=True)),
+                         sorted([studied.id, kept.id, moved.id]))
+        self.assertEqual(Review.objects.filter(card=studied).count(), 3)
+        self.assertFalse(Deck.objects.filter(pk=self.other_deck.id).exists())
+        self.assertEqual(
+            sorted(Tombstone.objects.values_list('model', flat=True)),
+            ['card', 'deck'])
+
+    def test_merging_compares_cards_without_a_hash(self):
+        old = Card.objects.create(front="hund", back="dog", deck=self.deck)
+        Card.objects.filter(pk=old.pk).update(content_hash=None)
+        Card.objects.create(front="Hund", back="dog", deck=self.other_deck)
+        response = self.client.post(
+            '/decks/%d/merge/' % self.deck.id, {"deck": self.other_deck.id},
+            format='json')
+        self.assertEqual(response.data, {"moved": 0, "duplicates": 1})
+        self.assertEqual(list(self.deck.cards.values_list('pk', flat=True)),
+                         [old.id])
+        self.assertEqual(Card.objects.get(pk=old.pk).content_hash,
+                         card_content_hash("hund", "dog"))
+
+    def test_merging_validates_the_other_deck(self):
+        foreign_deck = Deck.objects.create(
+            name="deck3", user=User.objects.create(username="user2"))
+        for deck_id in [self.deck.id, foreign_deck.id, "abc"]:
+            response = self.client.post('/decks/%d/merge/' % self.deck.id,
+                                        {"deck": deck_id}, format='json')
+            self.assertEqual(response.status_code, 400)
+        self.assertTrue(Deck.objects.filter(pk=foreign_deck.id).exists())
 
+    def test_collapsing_existing_duplicates(self):
+        kept = Card.objects.create(front="hund", back="dog", deck=self.deck)
+        katze = Card.objects.create(front="katze", back="cat",
+                                    deck=self.deck)
+        Card.objects.filter(pk__in=[kept.id, katze.id]).update(
+            content_hash=None)
+        # Created before content hashes existed.
+        cards = []
+        for front, back, times_reviewed in [
+                ("Hund", "dog", 0), ("Katze", "cat", 0), ("katze", "Cat", 3),
+                ("maus", "mouse", 0)]:
+            card = Card.objects.create(front="x%d" % len(cards), back="x",
+                                       deck=self.deck)
+            Card.objects.filter(pk=card.pk).update(
+                front=front, back=back, times_reviewed=times_reviewed,
+                content_hash=None)
+            cards.append(card)
+        unrelated = Card.objects.create(front="hund", back="dog",
+                                        deck=self.other_deck)
+        stdout = StringIO()
+        call_command('collapse_duplicates', chunk_size=2, stdout=stdout)
+        self.assertIn("Checked 6 cards, deleted 3 duplicates.",
+                      stdout.getvalue())
+        self.assertEqual(
+            sorted(self.deck.cards.values_list('pk', flat=True)),
+            [kept.id, cards[2].id, cards[3].id])
+        self.assertTrue(Card.objects.filter(pk=unrelated.pk).exists())
+        self.assertFalse(Card.objects.filter(content_hash=None).exists())
+        self.assertEqual(
+            sorted(Tombstone.objects.filter(model='card')
+                   .values_list('object_id', flat=True)),
+            [katze.id, cards[0].id, cards[1].id])
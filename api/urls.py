@@ -8,6 +8,8 @@ router.register(r'users', views.UserViewSet, base_name="users")
 router.register(r'decks', views.DeckViewSet, base_name="decks")
 router.register(r'cards', views.CardViewSet, base_name="cards")
 router.register(r'reviews', views.ReviewViewSet, base_name="reviews")
+router.register(r'sync', views.SyncViewSet, base_name="sync")
+router.register(r'stats', views.StatsViewSet, base_name="stats")
 
 urlpatterns = [
     url(r'^', include(router.urls)),
@@ -0,0 +1,92 @@
+from django.db import IntegrityError, transaction
+from django.db.models import F, Min, Q, Subquery
+from django.utils import timezone
+
+from api.models import Card, DataVersion, Deck
+from api.response_cache import invalidate_responses
+
+
+def data_changed(user_id):
+    # Called after a write to the user's decks, cards or reviews has been
+    # committed, so that a version is never seen before the data it covers.
+    # The write may have moved a card's due date, so the next read looks up
+    # the due boundary again.
+    now = timezone.now()
+    updated = DataVersion.objects.filter(user_id=user_id).update(
+        version=F('version') + 1, due_boundary=now)
+    if not updated:
+        try:
+            with transaction.atomic():
+                DataVersion.objects.create(user_id=user_id, version=1,
+                                           due_boundary=now)
+        except IntegrityError:
+            DataVersion.objects.filter(user_id=user_id).update(
+                version=F('version') + 1, due_boundary=now)
+    invalidate_responses(user_id)
+
+
+def get_data_version(user):
+    # One query, except on the first read after a write or after one of the
+    # user's cards has become due, when a second one moves the due boundary.
+    data_version = DataVersion.objects.filter(user=user).first()
+    if data_version is None:
+        data_changed(user.pk)
+        data_version = DataVersion.objects.get(user=user)
+    now = timezone.now()
+    if data_version.due_boundary is None or data_version.due_boundary > now:
+        return data_version.version
+
+    due_boundary = (Card.objects
+                    .filter(deck__user=user, next_due_at__gt=now)
+                    .order_by().values('deck__user')
+                    .annotate(due_boundary=Min('next_due_at'))
+                    .values('due_boundary'))
+    # Conditional, so that a write racing with this read keeps its marker.
+    if DataVersion.objects.filter(
+            user=user, version=data_version.version).update(
+                version=F('version') + 1,
+                due_boundary=Subquery(due_boundary)):
+        return data_version.version + 1
+    return DataVersion.objects.get(user=user).version
+
+
+# Model signals only name a deck or a card for most writes, so their
+# owners are collected and looked up once, when the transaction commits;
+# a version bumped any earlier could be read with the old data.
+class PendingDataChange(object):
+    def __init__(self):
+        self.user_ids = set()
+        self.deck_ids = set()
+        self.card_ids = set()
+
+    def __call__(self):
+        user_ids = self.user_ids
+        if self.deck_ids or self.card_ids:
+            # Decks deleted in the same transaction are gone by now; their
+            # own post_delete named the user directly.
+            user_ids.update(Deck.objects.filter(
+                Q(pk__in=self.deck_ids) | Q(cards__in=self.card_ids))
+                .values_list('user_id', flat=True).distinct())
+        for user_id in user_ids:
+            data_changed(user_id)
+
+
+def data_changed_on_commit(user_id=None, deck_id=None, card_id=None):
+    # Joins the change already waiting for the current transaction's
+    # commit; a rolled back transaction drops it along with its owners.
+    connection = transaction.get_connection()
+    pending = None
+    if connection.in_atomic_block:
+        pending = next((callback for _, callback in connection.run_on_commit
+                        if isinstance(callback, PendingDataChange)), None)
+    register = pending is None
+    if register:
+        pending = PendingDataChange()
+    if user_id is not None:
+        pending.user_ids.add(user_id)
+    if deck_id is not None:
+        pending.deck_ids.add(deck_id)
+    if card_id is not None:
+        pending.card_ids.add(card_id)
+    if register:
+        transaction.on_commit(pending)
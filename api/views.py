@@ -1,71 +1,552 @@
 from django.contrib.auth.models import User
-from api.models import Deck, Card, Review
-from api.serializers import UserSerializer, DeckSerializer, CardSerializer, ReviewSerializer
+from api.models import Deck, Card, PendingReview, Review, Tombstone, apply_pending_reviews, rebuild_scheduling, record_reviews
+from api.serializers import UserSerializer, DeckSerializer, CardSerializer, PendingReviewSerializer, ReviewSerializer, ReviewEntrySerializer, StudyCardSerializer, SyncCardSerializer, SyncDeckSerializer
+from api.duplicates import merge_decks
+from api.exports import export_deck
+from api.imports import UnsupportedImportFormat, import_cards, read_rows
+from api.pagination import CardPagination, DeckPagination, DueCardPagination, ReviewPagination, SearchPagination
+from api.renderers import CSVRenderer, JSONLinesRenderer
+from api.response_cache import cache_response, get_cached_response
+from api.search import search_cards
+from api.stats import FORECAST_DAYS, get_stats
+from api.study import STUDY_SESSION_SETTINGS, study_session
+from api.versions import data_changed, data_changed_on_commit, get_data_version
 
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
 from django.db.utils import IntegrityError
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.http import parse_etags
+
+from datetime import datetime, timedelta
+import hashlib
 
 from rest_framework import permissions
 from rest_framework import viewsets
 from rest_framework import status
+from rest_framework.decorators import detail_route, list_route
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 
 
-class ReviewViewSet(viewsets.ModelViewSet):
+SYNC_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+# Rows written by transactions that were still open when a sync ran can
+# carry an updated_at just before its cursor, so cursors step back a little
+# and clients may receive a few rows twice.
+SYNC_OVERLAP = timedelta(seconds=5)
+# Rows of each kind returned by one /sync/ page.
+SYNC_PAGE_SIZE = 2000
+BULK_REVIEW_LIMIT = getattr(settings, 'MEMORAY_BULK_REVIEW_LIMIT', 1000)
+
+
+def invalid_card_message(card_id):
+    return 'Invalid pk "%s" - object does not exist.' % card_id
+
+
+def encode_sync_cursor(moment):
+    return str((moment - SYNC_EPOCH) // timedelta(microseconds=1))
+
+
+def decode_sync_cursor(cursor):
+    return SYNC_EPOCH + timedelta(microseconds=int(cursor))
+
+
+# A sync that does not fit in one page is continued with a cursor holding
+# the moment the sync started and, for decks, cards, reviews and
+# tombstones in turn, the (time, id) of the last row sent. (time, 0) comes
+# before every row written at that time; (start, 0) marks a kind that has
+# been sent completely.
+def encode_sync_page_cursor(until, positions):
+    return ','.join([encode_sync_cursor(until)] + [
+        '%s.%d' % (encode_sync_cursor(moment), last_id)
+        for moment, last_id in positions])
+
+
+def decode_sync_page_cursor(cursor):
+    parts = cursor.split(',')
+    if len(parts) != 5:
+        raise ValueError(cursor)
+    positions = []
+    for part in parts[1:]:
+        moment, last_id = part.split('.')
+        positions.append((decode_sync_cursor(moment), int(last_id)))
+    return decode_sync_cursor(parts[0]), positions
+
+
+def sync_page(rows, time_field, position, until):
+    # Up to SYNC_PAGE_SIZE values() rows after position, in (time, id)
+    # order, and the position of the last one, or None once no rows are
+    # left.
+    if position is not None:
+        moment, last_id = position
+        rows = rows.filter(Q(**{time_field + '__gt': moment}) |
+                           Q(**{time_field: moment, 'pk__gt': last_id}))
+    rows = list(rows.filter(**{time_field + '__lte': until})
+                .order_by(time_field, 'pk')[:SYNC_PAGE_SIZE + 1])
+    if len(rows) <= SYNC_PAGE_SIZE:
+        return rows, None
+    rows = rows[:SYNC_PAGE_SIZE]
+    return rows, (rows[-1][time_field], rows[-1]['id'])
+
+
+class TombstoneMixin(object):
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            Tombstone.objects.create(user=self.request.user,
+                                     model=instance._meta.model_name,
+                                     object_id=instance.pk)
+            instance.delete()
+
+
+class ConditionalGetMixin(object):
+    # Reads carry an ETag derived from the user's data version, and a
+    # matching If-None-Match is answered with 304 before any queryset is
+    # built. Gzipped responses carry the weak form of the same ETag.
+    def not_modified(self, request):
+        self.data_version = get_data_version(request.user)
+        key = '%d:%d:%s:%s' % (request.user.pk, self.data_version,
+                               request.get_full_path(),
+                               request.META.get('HTTP_ACCEPT', ''))
+        self.etag = '"%s"' % hashlib.sha1(key.encode('utf-8')).hexdigest()
+        for etag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+            if etag == '*' or etag.replace('W/', '', 1) == self.etag:
+                return True
+        return False
+
+    def list(self, request, *args, **kwargs):
+        if self.not_modified(request):
+            return Response(status=status.HTTP_304_NOT_MODIFIED)
+        return super(ConditionalGetMixin, self).list(request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        if self.not_modified(request):
+            return Response(status=status.HTTP_304_NOT_MODIFIED)
+        return super(ConditionalGetMixin, self).retrieve(
+            request, *args, **kwargs)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super(ConditionalGetMixin, self).finalize_response(
+            request, response, *args, **kwargs)
+        if getattr(self, 'etag', None) and response.status_code in (
+                status.HTTP_200_OK, status.HTTP_304_NOT_MODIFIED):
+            response['ETag'] = self.etag
+        return response
+
+
+class ResponseCacheMixin(object):
+    # Rendered list responses are cached per user. Goes after
+    # ConditionalGetMixin, whose data version is part of the cache key.
+    def list(self, request, *args, **kwargs):
+        response = get_cached_response(request, self.data_version)
+        if response is not None:
+            return response
+        self.cache_response = True
+        return super(ResponseCacheMixin, self).list(request, *args, **kwargs)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super(ResponseCacheMixin, self).finalize_response(
+            request, response, *args, **kwargs)
+        if getattr(self, 'cache_response', False) and (
+                response.status_code == status.HTTP_200_OK):
+            cache_response(request, self.data_version, response)
+        return response
+
+
+class ValuesListMixin(object):
+    # Lists are rendered from values() rows through the serializer's
+    # ValuesMixin fast path instead of model instances.
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        return self.values_response(queryset, self.paginator,
+                                    self.get_serializer())
+
+    def values_response(self, queryset, paginator, serializer):
+        # Cursors read their ordering columns from the rows.
+        ordering = getattr(paginator, 'ordering', ())
+        if isinstance(ordering, str):
+            ordering = (ordering,)
+        columns = serializer.values_columns()
+        columns += [field.lstrip('-') for field in ordering
+                    if field.lstrip('-') not in columns]
+        page = paginator.paginate_queryset(queryset.values(*columns),
+                                           self.request, view=self)
+        return paginator.get_paginated_response(
+            serializer.values_representation(page))
+
+
+def search_response(view, cards, serializer):
+    return view.values_response(
+        search_cards(cards, view.request.query_params['q']),
+        SearchPagination(), serializer)
+
+
+class CardSearchMixin(object):
+    # ?q= lists the cards matching a search, ranked, from the text index.
+    # Goes before ValuesListMixin, whose values_response renders the page.
+    def list(self, request, *args, **kwargs):
+        if not request.query_params.get('q', '').strip():
+            return super(CardSearchMixin, self).list(request, *args, **kwargs)
+        cards = self.get_queryset()
+        if 'deck' in request.query_params:
+            try:
+                cards = cards.filter(deck_id=int(request.query_params['deck']))
+            except ValueError:
+                return Response({"deck": ["A valid integer is required."]},
+                                status=status.HTTP_400_BAD_REQUEST)
+        return search_response(self, cards, self.get_serializer())
+
+
+class ReviewViewSet(TombstoneMixin, ConditionalGetMixin,
+                    viewsets.ModelViewSet):
     serializer_class = ReviewSerializer
+    pagination_class = ReviewPagination
     permission_classes = (permissions.IsAuthenticated,)
 
     def get_queryset(self):
-        decks = Deck.objects.filter(user=self.request.user)
-        cards = Card.objects.filter(deck__in=decks)
-        return Review.objects.filter(card__in=cards)
+        return Review.objects.filter(card__deck__user=self.request.user)
 
     def create(self, request):
-        serializer = ReviewSerializer(data=request.data)
-        if serializer.is_valid():
-            serializer.save(card_id=request.data['card'])
-            card = Card.objects.get(pk=request.data['card'])
-            card.review(request.data['answer_quality'])
-            card.save()
-            return Response(serializer.data)
-        return Response(serializer.errors,
-                        status=status.HTTP_400_BAD_REQUEST)
+        serializer = ReviewEntrySerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors,
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        entry = serializer.validated_data
+        if settings.MEMORAY_REVIEW_OUTBOX:
+            return self.enqueue(request, entry)
+        with transaction.atomic():
+            cards = Card.objects.lock_owned(request.user, [entry['card']])
+            if entry['card'] not in cards:
+                return Response(
+                    {"card": [invalid_card_message(entry['card'])]},
+                    status=status.HTTP_400_BAD_REQUEST)
+            card = cards[entry['card']]
+            review = Review.objects.create(
+                card=card, answer_quality=entry['answer_quality'],
+                review_date=entry.get('reviewed_at', timezone.now()))
+            card.review(review.answer_quality, review.review_date)
+            card.save(update_fields=Card.SCHEDULING_FIELDS + ('updated_at',))
+        return Response(ReviewSerializer(review).data)
+
+    def perform_update(self, serializer):
+        # The history of the review's card changes, and of the card it is
+        # moved to, so their scheduling state is replayed from it.
+        card = serializer.validated_data.get('card')
+        if card is not None and not Card.objects.filter(
+                pk=card.pk, deck__user=self.request.user).exists():
+            raise ValidationError({"card": [invalid_card_message(card.pk)]})
+        with transaction.atomic():
+            card_ids = set([serializer.instance.card_id])
+            super(ReviewViewSet, self).perform_update(serializer)
+            card_ids.add(serializer.instance.card_id)
+            rebuild_scheduling(card_ids)
+
+    def perform_destroy(self, instance):
+        # Deleted reviews send no signal that bumps the data version.
+        with transaction.atomic():
+            super(ReviewViewSet, self).perform_destroy(instance)
+            rebuild_scheduling([instance.card_id])
+            data_changed_on_commit(user_id=self.request.user.pk)
+
+    def enqueue(self, request, entry):
+        # Write-behind: the review is only validated and stored in the
+        # outbox here; drain_reviews applies it to the card later.
+        if not Card.objects.filter(pk=entry['card'],
+                                   deck__user=request.user).exists():
+            return Response(
+                {"card": [invalid_card_message(entry['card'])]},
+                status=status.HTTP_400_BAD_REQUEST)
+        pending = PendingReview.objects.create(
+            user=request.user, card_id=entry['card'],
+            answer_quality=entry['answer_quality'],
+            review_date=entry.get('reviewed_at', timezone.now()))
+        # The next due queue read applies it, so cached copies are stale.
+        data_changed(request.user.pk)
+        return Response(PendingReviewSerializer(pending).data,
+                        status=status.HTTP_202_ACCEPTED)
+
+    @list_route(methods=['post'])
+    def bulk(self, request):
+        if (isinstance(request.data, list) and
+                len(request.data) > BULK_REVIEW_LIMIT):
+            return Response(
+                {"non_field_errors": [
+                    "Ensure this list has at most %d entries." %
+                    BULK_REVIEW_LIMIT]},
+                status=status.HTTP_400_BAD_REQUEST)
+        serializer = ReviewEntrySerializer(data=request.data, many=True)
+        if not serializer.is_valid():
+            return Response(serializer.errors,
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        now = timezone.now()
+        entries = [
+            (entry['card'], entry['answer_quality'],
+             entry.get('reviewed_at', now))
+            for entry in serializer.validated_data
+        ]
+
+        with transaction.atomic():
+            cards = Card.objects.lock_owned(
+                request.user, set(card_id for card_id, _, _ in entries))
+            errors = [
+                {} if card_id in cards else
+                {"card": [invalid_card_message(card_id)]}
+                for card_id, _, _ in entries
+            ]
+            if any(errors):
+                return Response(errors, status=status.HTTP_400_BAD_REQUEST)
+            reviews = record_reviews(cards, entries)
+        data_changed(request.user.pk)
+
+        reviewed_cards = sorted(set(review.card for review in reviews),
+                                key=lambda card: card.pk)
+        return Response({
+            "reviews": len(reviews),
+            "cards": CardSerializer(reviewed_cards, many=True).data
+        })
 
 
-class CardViewSet(viewsets.ModelViewSet):
+class CardViewSet(TombstoneMixin, ConditionalGetMixin, ResponseCacheMixin,
+                  CardSearchMixin, ValuesListMixin, viewsets.ModelViewSet):
     serializer_class = CardSerializer
+    pagination_class = CardPagination
     permission_classes = (permissions.IsAuthenticated,)
 
     def get_queryset(self):
-        decks = Deck.objects.filter(user=self.request.user)
-        return Card.objects.filter(deck__in=decks)
+        return Card.objects.filter(deck__user=self.request.user)
+
+    @list_route()
+    def due(self, request):
+        if self.not_modified(request):
+            return Response(status=status.HTTP_304_NOT_MODIFIED)
+        if settings.MEMORAY_REVIEW_OUTBOX:
+            # Read-your-writes: the user's own queued reviews are applied
+            # before their due queue is read.
+            if apply_pending_reviews(
+                    PendingReview.objects.filter(user=request.user)):
+                data_changed(request.user.pk)
+        cards = self.get_queryset().filter(next_due_at__lte=timezone.now())
+        if 'deck' in request.query_params:
+            try:
+                deck_id = int(request.query_params['deck'])
+            except ValueError:
+                return Response({"deck": ["A valid integer is required."]},
+                                status=status.HTTP_400_BAD_REQUEST)
+            cards = cards.filter(deck_id=deck_id)
+
+        return self.values_response(cards, DueCardPagination(),
+                                    self.get_serializer())
+
+    @list_route()
+    def session(self, request):
+        # Not answered from ETags or the response cache: how overdue cards
+        # are relative to each other changes as time passes.
+        if settings.MEMORAY_REVIEW_OUTBOX:
+            if apply_pending_reviews(
+                    PendingReview.objects.filter(user=request.user)):
+                data_changed(request.user.pk)
+        decks = Deck.objects.filter(user=request.user)
+        errors = {}
+        try:
+            size = int(request.query_params.get(
+                'size', STUDY_SESSION_SETTINGS['SIZE']))
+            if not 0 < size <= STUDY_SESSION_SETTINGS['MAX_SIZE']:
+                raise ValueError
+        except ValueError:
+            errors['size'] = ["Ensure this value is between 1 and %d." %
+                              STUDY_SESSION_SETTINGS['MAX_SIZE']]
+        if 'deck' in request.query_params:
+            try:
+                decks = decks.filter(pk=int(request.query_params['deck']))
+            except ValueError:
+                errors['deck'] = ["A valid integer is required."]
+        if errors:
+            return Response(errors, status=status.HTTP_400_BAD_REQUEST)
 
+        serializer = StudyCardSerializer()
+        return Response(serializer.values_representation(study_session(
+            decks, serializer.values_columns(), timezone.now(), size,
+            STUDY_SESSION_SETTINGS['NEW_CARD_RATIO'],
+            STUDY_SESSION_SETTINGS['CANDIDATES'])))
 
-class DeckViewSet(viewsets.ModelViewSet):
+
+class DeckViewSet(TombstoneMixin, ConditionalGetMixin, ResponseCacheMixin,
+                  ValuesListMixin, viewsets.ModelViewSet):
     serializer_class = DeckSerializer
+    pagination_class = DeckPagination
     permission_classes = (permissions.IsAuthenticated,)
 
     def get_queryset(self):
-        return Deck.objects.filter(user=self.request.user)
+        decks = Deck.objects.filter(user=self.request.user)
+        if self.action in ('list', 'retrieve', 'update', 'partial_update'):
+            decks = decks.with_card_counts()
+        return decks
 
     def create(self, request):
         data = {
             "user": request.user.id,
-            "name": request.data["name"],
-            "cards": []
+            "name": request.data["name"]
         }
         serializer = DeckSerializer(data=data)
         if serializer.is_valid():
-            serializer.save()
-            return Response(serializer.data)
+            deck = serializer.save()
+            deck = Deck.objects.with_card_counts().get(pk=deck.pk)
+            return Response(DeckSerializer(deck).data)
         return Response(serializer.errors,
                         status=status.HTTP_400_BAD_REQUEST)
 
+    @detail_route()
+    def cards(self, request, pk=None):
+        if self.not_modified(request):
+            return Response(status=status.HTTP_304_NOT_MODIFIED)
+        deck = self.get_object()
+        serializer = CardSerializer(context=self.get_serializer_context())
+        if request.query_params.get('q', '').strip():
+            return search_response(self, deck.cards.all(), serializer)
+        return self.values_response(deck.cards.all(), CardPagination(),
+                                    serializer)
+
+    @detail_route(methods=['post'], url_path='import')
+    def import_file(self, request, pk=None):
+        deck = self.get_object()
+        media_type = request.content_type.split(';')[0].strip()
+        try:
+            report = import_cards(deck, read_rows(request.stream or [],
+                                                  media_type))
+        except UnsupportedImportFormat:
+            return Response(
+                {"detail": 'Unsupported media type "%s" in request.' %
+                 media_type},
+                status=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+        data_changed(request.user.pk)
+        return Response(report)
+
+    @detail_route(methods=['post'])
+    def merge(self, request, pk=None):
+        # Moves the cards of the deck given in the body into this one and
+        # deletes that deck; cards this deck already has are not moved.
+        deck = self.get_object()
+        try:
+            other_id = int(request.data.get('deck'))
+        except (TypeError, ValueError):
+            return Response({"deck": ["A valid integer is required."]},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if other_id == deck.pk:
+            return Response({"deck": ["A deck cannot be merged into itself."]},
+                            status=status.HTTP_400_BAD_REQUEST)
+        other = Deck.objects.filter(user=request.user, pk=other_id).first()
+        if other is None:
+            return Response(
+                {"deck": ['Invalid pk "%d" - object does not exist.' %
+                          other_id]},
+                status=status.HTTP_400_BAD_REQUEST)
+        moved, duplicates = merge_decks(deck, other)
+        data_changed(request.user.pk)
+        return Response({"moved": moved, "duplicates": duplicates})
+
+    @detail_route(renderer_classes=(JSONLinesRenderer, CSVRenderer))
+    def export(self, request, pk=None):
+        deck = self.get_object()
+        export_format = request.accepted_renderer.format
+        include_reviews = request.query_params.get('reviews') in ('1', 'true')
+        response = StreamingHttpResponse(
+            export_deck(deck, export_format, include_reviews),
+            content_type=request.accepted_renderer.media_type)
+        response['Content-Disposition'] = (
+            'attachment; filename="deck-%d.%s"' % (deck.pk, export_format))
+        return response
+
+
+class SyncViewSet(viewsets.ViewSet):
+    permission_classes = (permissions.IsAuthenticated,)
+
+    def list(self, request):
+        # Pages hold up to SYNC_PAGE_SIZE rows of each kind, written up to
+        # the moment the sync started. While "more" is true, the returned
+        # cursor continues the sync; then it starts the next one.
+        until = timezone.now()
+        positions = [None] * 4
+        if 'since' in request.query_params:
+            cursor = request.query_params['since']
+            try:
+                if ',' in cursor:
+                    until, positions = decode_sync_page_cursor(cursor)
+                else:
+                    positions = [(decode_sync_cursor(cursor), 0)] * 4
+            except (ValueError, OverflowError):
+                return Response({"since": ["Invalid cursor."]},
+                                status=status.HTTP_400_BAD_REQUEST)
+
+        serializers = [SyncDeckSerializer(), SyncCardSerializer(),
+                       ReviewSerializer()]
+        kinds = [
+            (Deck.objects.filter(user=request.user), 'updated_at',
+             serializers[0].values_columns()),
+            (Card.objects.filter(deck__user=request.user), 'updated_at',
+             serializers[1].values_columns()),
+            (Review.objects.filter(card__deck__user=request.user),
+             'updated_at', serializers[2].values_columns()),
+            (Tombstone.objects.filter(user=request.user), 'deleted_at',
+             ['model', 'object_id']),
+        ]
+        pages = []
+        for (rows, time_field, columns), position in zip(kinds, positions):
+            # A kind sent completely on an earlier page is not read again.
+            if position == (until, 0):
+                pages.append(([], position))
+                continue
+            rows = rows.values(*set(columns) | set(['id', time_field]))
+            rows, last = sync_page(rows, time_field, position, until)
+            pages.append((rows, last or (until, 0)))
+        (decks, _), (cards, _), (reviews, _), (tombstones, _) = pages
+
+        deleted = {"deck": [], "card": [], "review": []}
+        for tombstone in tombstones:
+            deleted[tombstone['model']].append(tombstone['object_id'])
+
+        more = any(position != (until, 0) for _, position in pages)
+        return Response({
+            "cursor": (encode_sync_page_cursor(
+                until, [position for _, position in pages]) if more
+                else encode_sync_cursor(until - SYNC_OVERLAP)),
+            "more": more,
+            "decks": serializers[0].values_representation(decks),
+            "cards": serializers[1].values_representation(cards),
+            "reviews": serializers[2].values_representation(reviews),
+            "deleted": deleted
+        })
+
+
+class StatsViewSet(viewsets.ViewSet):
+    permission_classes = (permissions.IsAuthenticated,)
+
+    def list(self, request):
+        days = request.query_params.get('days', str(FORECAST_DAYS[0]))
+        if days not in [str(choice) for choice in FORECAST_DAYS]:
+            return Response(
+                {"days": ["Must be one of %s." %
+                          ", ".join(str(choice) for choice in FORECAST_DAYS)]},
+                status=status.HTTP_400_BAD_REQUEST)
+
+        stats = get_stats(request.user)
+        return Response({
+            "date": stats['date'],
+            "overdue": stats['forecast']['overdue'],
+            "due": stats['forecast']['due'][:int(days)],
+            "decks": stats['decks']
+        })
+
+
 class UserViewSet(viewsets.ModelViewSet):
     serializer_class = UserSerializer
     permission_classes = (permissions.AllowAny,)
 
     def get_queryset(self):
-        return User.objects.filter(pk=self.request.user.pk)
+        return (User.objects.filter(pk=self.request.user.pk)
+                .prefetch_related('decks'))
 
     def create(self, request):
         try:
@@ -45,7 +45,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.middleware.InstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'django.middleware.gzip.GZipMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -131,20 +133,76 @@ STATIC_URL = '/static/'
 STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 
 REST_FRAMEWORK = {
+    # JSON goes through python-rapidjson; MessagePack is used when clients
+    # ask for application/msgpack.
     'DEFAULT_RENDERER_CLASSES': (
-        'rest_framework.renderers.JSONRenderer',
+        'api.renderers.FastJSONRenderer',
+        'api.renderers.MessagePackRenderer',
     ),
     'DEFAULT_PARSER_CLASSES': (
-        'rest_framework.parsers.JSONParser',
+        'api.parsers.FastJSONParser',
+        'api.parsers.MessagePackParser',
     ),
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
     ),
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_jwt.authentication.JSONWebTokenAuthentication',
+        'api.authentication.CachedJSONWebTokenAuthentication',
     )
 }
 
+# Users resolved from JWTs are cached per worker process for TTL seconds.
+# Set SHARED_CACHE to a CACHES alias to cache them there instead, shared
+# between workers.
+MEMORAY_USER_CACHE = {
+    'MAX_SIZE': 10000,
+    'TTL': 60,
+    'SHARED_CACHE': None,
+}
+
+# Request timing in Server-Timing headers and the api.instrumentation log.
+# Requests repeating one SQL shape more than the threshold are flagged as
+# likely N+1 queries.
+MEMORAY_INSTRUMENTATION = 'MEMORAY_INSTRUMENTATION' in os.environ
+MEMORAY_N_PLUS_ONE_THRESHOLD = 10
+
+# Accept single review submissions into an outbox and apply them in the
+# background with the drain_reviews command.
+MEMORAY_REVIEW_OUTBOX = 'MEMORAY_REVIEW_OUTBOX' in os.environ
+
+# /reviews/bulk/ accepts at most this many entries per request.
+MEMORAY_BULK_REVIEW_LIMIT = 1000
+
+# Per-user statistics are kept in the default cache. They are invalidated
+# by API writes and otherwise expire after this many seconds; with several
+# workers, CACHES must point at a shared backend for invalidation to reach
+# all of them.
+MEMORAY_STATS_CACHE_TIMEOUT = 3600
+
+# Rendered deck and card lists are cached per user and invalidated by
+# writes. With CACHE None they are kept in a per-worker LRU of at most
+# MAX_BYTES; set CACHE to a CACHES alias to share them between workers.
+MEMORAY_RESPONSE_CACHE = {
+    'CACHE': None,
+    'MAX_BYTES': 64 * 1024 * 1024,
+    'TTL': 300,
+}
+
+# /cards/session/ returns SIZE cards by default and at most MAX_SIZE, of
+# which NEW_CARD_RATIO are new cards when there are enough of them. Reviews
+# are picked among the CANDIDATES cards that have been due the longest.
+MEMORAY_STUDY_SESSION = {
+    'SIZE': 20,
+    'MAX_SIZE': 200,
+    'NEW_CARD_RATIO': 0.2,
+    'CANDIDATES': 1000,
+}
+
+# compact_reviews moves old reviews to gzip files in this directory, which
+# then holds their only copy. It has to be on persistent storage, so there
+# is no default and compact_reviews refuses to run without it.
+MEMORAY_REVIEW_ARCHIVE_DIR = os.environ.get('MEMORAY_REVIEW_ARCHIVE_DIR')
+
 JWT_AUTH = {
     'JWT_EXPIRATION_DELTA': datetime.timedelta(days=7)
 }